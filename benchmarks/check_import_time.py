@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Check of the cold start time of text_console, based on -X importtime.
+
+    python benchmarks/check_import_time.py [--max-ms 75]
+
+Fails (exit status 1) when importing text_console.__main__, which is what
+"python -m text_console" imports before opening the window, takes longer
+than the budget. The modules imported on startup are checked by
+tests/test_import_time.py.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_time(module):
+    """
+    Import module in a new interpreter; return the cumulative import time
+    in seconds and the names of all imported modules.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # measure with cached bytecode
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=ROOT, env=env, stderr=subprocess.PIPE, universal_newlines=True,
+        check=True)
+    total = None
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.split("|")
+        name = fields[-1].strip()
+        if not fields[1].strip().isdigit():
+            continue  # header
+        modules.add(name)
+        if name == module:
+            total = int(fields[1]) / 1e6
+    return total, modules
+
+
+def best_import_time(module, runs):
+    import_time(module)  # write the bytecode, warm the file cache
+    return min(import_time(module)[0] for _ in range(runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check of the cold start time of text_console.")
+    parser.add_argument(
+        "--max-ms", type=float, default=75,
+        help="budget of the import of text_console.__main__ (default: 75)")
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5,
+        help="imports measured, the best one is checked (default: 5)")
+    args = parser.parse_args()
+
+    failed = False
+    best = best_import_time("text_console.__main__", args.repeat)
+    print("import text_console.__main__: %.1f ms (budget %.1f ms)" % (
+        best * 1000, args.max_ms))
+    if best * 1000 > args.max_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
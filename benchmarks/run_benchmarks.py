@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the hot paths of text_console.
+
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py -o results.json
+    python benchmarks/run_benchmarks.py --baseline results.json
+
+Each benchmark runs a number of times and reports the best and the median
+time in seconds (and the throughput, where meaningful). The results can be
+written to a JSON file, which can later be used as the baseline of a
+comparison: benchmarks slower than the baseline by more than the
+threshold are reported as regressions and the exit status is 1.
+
+The benchmarks of the widgets need a display. On Linux without DISPLAY,
+an Xvfb server is started when available; otherwise they are skipped.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_console import History  # noqa: E402
+from check_import_time import import_time  # noqa: E402
+
+BENCHMARKS = []  # (name, function, needs a display)
+HISTORY_SIZES = (1000, 100000, 1000000)
+GUI_HISTORY_SIZE = 100000
+
+
+def benchmark(name, gui=False):
+    """Register a benchmark function, called with the Context."""
+    def decorator(function):
+        BENCHMARKS.append((name, function, gui))
+        return function
+    return decorator
+
+
+class Context:
+    """State shared by the benchmarks: options, files and Tk objects."""
+    def __init__(self, args, directory):
+        self.args = args
+        self.directory = directory
+        self.history_sizes = args.sizes
+        self._history_files = {}
+        self._root = None
+
+    def measure(self, run, setup=None, items=None):
+        """
+        Time run() args.repeat times, calling setup() (not timed) before
+        each run; items is the number of items processed by a run.
+        """
+        times = []
+        for _ in range(self.args.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        result = {
+            "best": min(times),
+            "median": statistics.median(times),
+            "runs": len(times),
+        }
+        if items:
+            result["items"] = items
+            result["throughput"] = items / result["best"]
+        return result
+
+    def history_file(self, size):
+        """Path of a history journal with size entries, created once."""
+        path = self._history_files.get(size)
+        if path is None:
+            path = os.path.join(self.directory, "history_%d" % size)
+            history = History(path, fsync_interval=None)
+            for i in range(size):
+                if i % 10 == 9:
+                    history.append("for n in range(%d):\n    print(n)" % i)
+                else:
+                    history.append("value_%d = compute(%d, 'text')" % (i % 5000, i))
+            history.save()
+            self._history_files[size] = path
+        return path
+
+    def copy_history(self, size):
+        path = os.path.join(self.directory, "history_copy")
+        shutil.copyfile(self.history_file(size), path)
+        return path
+
+    @property
+    def root(self):
+        if self._root is None:
+            import tkinter as tk
+            self._root = tk.Tk()
+            self._root.geometry("800x600")
+            self._root.update()
+        return self._root
+
+    def console(self, history_size=0):
+        """Return a new console, with a history of history_size entries."""
+        from text_console import BaseTextConsole
+
+        class BenchmarkConsole(BaseTextConsole):
+            load_history_in_background = False  # measured on a full history
+            history_file = (
+                self.copy_history(history_size) if history_size
+                else os.path.join(self.directory, "history_empty"))
+
+        for child in list(self.root.children.values()):
+            child.destroy()
+        self.root.config(menu="")
+        console = BenchmarkConsole(self.root, self.root)
+        console.pack(fill="both", expand=True)
+        self.root.update()
+        return console
+
+    def close(self):
+        if self._root is not None:
+            self._root.destroy()
+
+
+@benchmark("import_time")
+def startup_import(ctx):
+    """Cumulative -X importtime of the package and of the GUI entry point."""
+    results = {}
+    for module in ("text_console", "text_console.__main__"):
+        import_time(module)  # write the bytecode, warm the file cache
+        times = [import_time(module)[0] for _ in range(ctx.args.repeat)]
+        results["import[%s]" % module] = {
+            "best": min(times),
+            "median": statistics.median(times),
+            "runs": len(times),
+        }
+    return results
+
+
+@benchmark("history_load")
+def history_load(ctx):
+    results = {}
+    for size in ctx.history_sizes:
+        path = ctx.history_file(size)
+        results["history_load[%d]" % size] = ctx.measure(
+            lambda: History(path, fsync_interval=None), items=size)
+    return results
+
+
+@benchmark("history_save")
+def history_save(ctx):
+    """Full rewrite (compaction) and incremental save of 100 commands."""
+    results = {}
+    for size in ctx.history_sizes:
+        holder = []
+
+        def load():
+            holder[:] = [History(ctx.copy_history(size), fsync_interval=None)]
+
+        results["history_compact[%d]" % size] = ctx.measure(
+            lambda: holder[0].compact(), setup=load, items=size)
+
+        def append_save():
+            for i in range(100):
+                holder[0].append("new_command(%d)" % i)
+            holder[0].save()
+
+        results["history_append_save[%d]" % size] = ctx.measure(
+            append_save, setup=load, items=100)
+    return results
+
+
+@benchmark("history_recall")
+def history_recall(ctx):
+    """
+    Prefix recall of 100 commands, as by the Up arrow, with prefixes
+    longer than 8 characters: one shared by many commands of the history
+    and one by a command out of 5000.
+    """
+    results = {}
+    for size in ctx.history_sizes:
+        history = History(ctx.history_file(size), fsync_interval=None)
+        history.find_previous("#", len(history))  # builds the index
+        recalls = 100
+        for name, prefix in (("common", "value_12"), ("rare", "value_1234 ")):
+
+            def run():
+                index = len(history)
+                for _ in range(recalls):
+                    index = history.find_previous(prefix, index)
+                    if index is None:
+                        index = len(history)
+
+            result = ctx.measure(run, items=recalls)
+            result["latency"] = result["best"] / recalls
+            results["history_recall_%s[%d]" % (name, size)] = result
+    return results
+
+
+@benchmark("eval_print", gui=True)
+def eval_print(ctx):
+    """Throughput of the output of a print-heavy command."""
+    console = ctx.console()
+    lines = 20000
+
+    def setup():
+        console.insert_cmd("for i in range(%d): print('line', i)" % lines)
+        console.mark_set("insert", "end-1c")
+
+    def run():
+        console.eval_current()
+        console.update_idletasks()
+
+    return {"eval_print": ctx.measure(run, setup=setup, items=lines)}
+
+
+@benchmark("eval_spool", gui=True)
+def eval_spool(ctx):
+    """Throughput of an output exceeding output_spool_threshold."""
+    console = ctx.console()
+    lines = 500000
+
+    def setup():
+        console.insert_cmd("for i in range(%d): print('line', i)" % lines)
+        console.mark_set("insert", "end-1c")
+
+    def run():
+        console.eval_current()
+        console.update_idletasks()
+
+    return {"eval_spool": ctx.measure(run, setup=setup, items=lines)}
+
+
+@benchmark("insert_paste", gui=True)
+def insert_paste(ctx):
+    """insert_cmd and on_paste of a block of 5000 lines."""
+    console = ctx.console()
+    block = "\n".join(
+        "    " * (i % 3) + "result_%d = function(%d, 'argument')" % (i, i)
+        for i in range(5000))
+
+    def clear():
+        console.delete("input", "end")
+        console.mark_set("insert", "end-1c")
+
+    def run_insert():
+        console.insert_cmd(block)
+        console.update_idletasks()
+
+    def setup_paste():
+        clear()
+        console.clipboard_clear()
+        console.clipboard_append(block)
+
+    def run_paste():
+        console.on_paste(None)
+        console.update_idletasks()
+
+    return {
+        "insert_cmd[5000 lines]": ctx.measure(run_insert, setup=clear, items=5000),
+        "on_paste[5000 lines]": ctx.measure(run_paste, setup=setup_paste, items=5000),
+    }
+
+
+@benchmark("history_panel", gui=True)
+def history_panel(ctx):
+    """Rendering and search of the history panel."""
+    from text_console.command_history import CommandHistoryPanel
+
+    console = ctx.console(GUI_HISTORY_SIZE)
+    panel = CommandHistoryPanel(
+        console, console.history, console.insert_cmd, [len(console.history)])
+    panel.update()
+
+    def run_display():
+        panel.update_display()
+        panel.update_idletasks()
+
+    def setup_search():
+        panel.search_var.set("print(n)")
+        panel._search_key = None  # no cached matches
+
+    def run_search():
+        panel.search_history()
+        panel.update_idletasks()
+
+    results = {
+        "panel_update_display[%d]" % GUI_HISTORY_SIZE:
+            ctx.measure(run_display),
+        "panel_search_history[%d]" % GUI_HISTORY_SIZE:
+            ctx.measure(run_search, setup=setup_search),
+    }
+    panel.destroy()
+    return results
+
+
+@benchmark("up_recall", gui=True)
+def up_recall(ctx):
+    """Latency of the Up arrow recalling commands with a typed prefix."""
+    console = ctx.console(GUI_HISTORY_SIZE)
+    presses = 100
+
+    def setup():
+        console.delete("input", "end")
+        console.mark_set("insert", "end-1c")
+        console.insert("insert", "value_1")
+        console._hist_item = len(console.history)
+
+    def run():
+        for _ in range(presses):
+            console.on_up(None)
+            console.update_idletasks()
+
+    result = ctx.measure(run, setup=setup, items=presses)
+    result["latency"] = result["best"] / presses
+    return {"up_recall[%d]" % GUI_HISTORY_SIZE: result}
+
+
+def start_xvfb():
+    """Start Xvfb on a free display if there is none; return the process."""
+    if not sys.platform.startswith("linux") or os.environ.get("DISPLAY"):
+        return None
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        return None
+    for display in range(99, 199):
+        if (os.path.exists("/tmp/.X%d-lock" % display)
+                or os.path.exists("/tmp/.X11-unix/X%d" % display)):
+            continue
+        process = subprocess.Popen(
+            [xvfb, ":%d" % display, "-screen", "0", "1280x1024x24",
+             "-nolisten", "tcp"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(50):
+            if os.path.exists("/tmp/.X11-unix/X%d" % display):
+                os.environ["DISPLAY"] = ":%d" % display
+                return process
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+        process.kill()
+    return None
+
+
+def display_available():
+    try:
+        import tkinter as tk
+        tk.Tk().destroy()
+    except Exception:
+        return False
+    return True
+
+
+def compare(results, baseline, threshold):
+    """Print the comparison with the baseline and return the regressions."""
+    regressions = []
+    print("\n%-36s %12s %12s %9s" % ("benchmark", "baseline", "current", "change"))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("%-36s %12s %12.6f %9s" % (name, "-", result["best"], "new"))
+            continue
+        change = result["best"] / base["best"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-36s %12.6f %12.6f %+8.1f%%%s" % (
+            name, base["best"], result["best"], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the hot paths of text_console.")
+    parser.add_argument(
+        "-o", "--output", metavar="FILE",
+        help="write the results to a JSON file")
+    parser.add_argument(
+        "-b", "--baseline", metavar="FILE",
+        help="compare the results with a JSON file written by --output")
+    parser.add_argument(
+        "-t", "--threshold", type=float, default=0.2,
+        help="slowdown reported as a regression (default: 0.2, i.e., 20%%)")
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5,
+        help="runs of each benchmark (default: 5)")
+    parser.add_argument(
+        "-k", "--select", metavar="NAME", action="append",
+        help="run only the benchmarks whose name contains NAME")
+    parser.add_argument(
+        "--sizes", type=lambda s: [int(n) for n in s.split(",")],
+        default=list(HISTORY_SIZES),
+        help="comma-separated history sizes (default: 1000,100000,1000000)")
+    parser.add_argument(
+        "--no-gui", action="store_true",
+        help="skip the benchmarks needing a display")
+    args = parser.parse_args()
+
+    selected = [
+        (name, function, gui) for name, function, gui in BENCHMARKS
+        if not args.select or any(s in name for s in args.select)]
+    xvfb = None
+    gui = False
+    if not args.no_gui and any(needs_gui for _, _, needs_gui in selected):
+        xvfb = start_xvfb()
+        gui = display_available()
+        if not gui:
+            print("No display available: skipping the GUI benchmarks.",
+                  file=sys.stderr)
+
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="text_console_bench") as directory:
+            ctx = Context(args, directory)
+            try:
+                for name, function, needs_gui in selected:
+                    if needs_gui and not gui:
+                        continue
+                    for key, result in function(ctx).items():
+                        results[key] = result
+                        print("%-36s best %.6f s, median %.6f s" % (
+                            key, result["best"], result["median"]), flush=True)
+            finally:
+                ctx.close()
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n%d regression(s): %s" % (
+                len(regressions), ", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
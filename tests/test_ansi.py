@@ -0,0 +1,35 @@
+from text_console.ansi import MAX_PENDING, AnsiParser
+
+
+def test_colors_and_reset():
+    parser = AnsiParser()
+    assert parser.split("\x1b[1;31mred\x1b[0m plain") == [
+        ("red", ("ansi_fg_1", "ansi_bold")), (" plain", ())]
+
+
+def test_style_carries_over_chunks():
+    parser = AnsiParser()
+    assert parser.split("\x1b[4mone") == [("one", ("ansi_underline",))]
+    assert parser.split("two") == [("two", ("ansi_underline",))]
+
+
+def test_sequence_split_between_chunks():
+    parser = AnsiParser()
+    assert parser.split("a\x1b[3") == [("a", ())]
+    assert parser.split("1mred\x1b[0m b") == [
+        ("red", ("ansi_fg_1",)), (" b", ())]
+    assert parser.split("\x1b") == []
+    assert parser.split("[38;5;200mX") == [("X", ("ansi_fg_200",))]
+
+
+def test_24_bit_colors_and_other_sequences():
+    parser = AnsiParser()
+    assert parser.split("\x1b[38;2;255;0;0mY\x1b[2Jz") == [
+        ("Yz", ("ansi_fg_196",))]
+
+
+def test_unterminated_sequence_is_not_kept():
+    parser = AnsiParser()
+    text = "x\x1b[" + "1;" * MAX_PENDING
+    assert parser.split(text) == [(text.replace("\x1b", ""), ())]
+    assert parser.split("after") == [("after", ())]
@@ -0,0 +1,120 @@
+import io
+import subprocess
+import sys
+
+from text_console.batch import BatchRunner
+
+
+def run(text, **kwargs):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    runner = BatchRunner(stdout=stdout, stderr=stderr, **kwargs)
+    status = runner.run(text)
+    return status, stdout.getvalue(), stderr.getvalue()
+
+
+def test_script_results_and_blocks():
+    status, out, err = run(
+        "x = 1\n"
+        "def f(a):\n"
+        "    return a * 2\n"
+        "f(3)\n"
+        "if x:\n"
+        "    print('yes')\n"
+        "else:\n"
+        "    print('no')\n"
+        "for i in range(2):\n"
+        "    print(i)\n"
+        "print('after')\n"
+    )
+    assert (status, out, err) == (0, "6\nyes\n0\n1\nafter\n", "")
+
+
+def test_script_help():
+    status, out, err = run("len?\n")
+    assert status == 0
+    assert "len(obj, /)" in out
+
+
+def test_script_await():
+    status, out, err = run("async def g():\n    return 5\nawait g()\n")
+    assert (status, out) == (0, "5\n")
+
+
+def test_script_errors():
+    status, out, err = run("print('a')\n1/0\nprint('b')\n")
+    assert (status, out) == (1, "a\nb\n")
+    assert "division by zero" in err
+
+
+def test_script_syntax_error():
+    status, out, err = run("x = = 1\nprint('ok')\n")
+    assert (status, out) == (1, "ok\n")
+    assert "SyntaxError" in err
+
+
+def test_script_incomplete():
+    status, out, err = run("if True:\n    x = (\n")
+    assert status == 1
+    assert "incomplete input" in err
+
+
+def test_warnings_are_not_errors():
+    result = subprocess.run(
+        [sys.executable, "-m", "text_console", "--run", "-"],
+        input="import warnings\nwarnings.warn('careful')\n",
+        capture_output=True, text=True)
+    assert result.returncode == 0
+    assert "UserWarning: careful" in result.stderr
+
+
+def test_transcript():
+    status, out, err = run(
+        ">>> a = 2\n"
+        ">>> a + 1\n"
+        "3\n"
+        ">>> for i in range(2):\n"
+        "...     print(i)\n"
+        "...\n"
+        "0\n"
+        "1\n"
+    )
+    assert (status, out, err) == (0, "3\n0\n1\n", "")
+
+
+def test_transcript_help():
+    status, out, err = run(">>> x = 3\n>>> len?\n>>> x + 1\n")
+    assert status == 0
+    assert "len(obj, /)" in out
+    assert out.endswith("\n4\n")
+
+
+def test_transcript_errors():
+    status, out, err = run(">>> undefined_name\n>>> 1\n")
+    assert (status, out) == (1, "1\n")
+    assert "undefined_name" in err
+
+
+def test_echo():
+    status, out, err = run("6*7\nif 1:\n    pass\n", echo=True)
+    assert out == ">>> 6*7\n42\n>>> if 1:\n...     pass\n"
+
+
+def test_system_exit():
+    result = subprocess.run(
+        [sys.executable, "-m", "text_console", "--run", "-"],
+        input="print('ok')\nraise SystemExit(3)\nprint('no')\n",
+        capture_output=True, text=True)
+    assert (result.returncode, result.stdout) == (3, "ok\n")
+
+
+def test_broken_pipe():
+    process = subprocess.Popen(
+        [sys.executable, "-m", "text_console", "--run", "-"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True)
+    process.stdin.write("for i in range(10**6):\n    print(i)\n")
+    process.stdin.close()
+    assert process.stdout.readline() == "0\n"
+    process.stdout.close()
+    assert process.wait(timeout=60) == 1
+    assert "Traceback" not in process.stderr.read()
@@ -0,0 +1,45 @@
+import contextlib
+import io
+
+from text_console.console import ExecConsole
+
+
+def push(console, source):
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        console.push(source)
+    return stderr.getvalue()
+
+
+def test_time_limit_interrupts_and_keeps_namespace():
+    console = ExecConsole(time_limit=0.2)
+    push(console, "y = 5")
+    errors = push(console, "while True: pass")
+    assert errors.endswith(
+        "Command interrupted: time limit of 0.2 s exceeded\n")
+    assert console.failed
+    assert console.locals["y"] == 5
+    assert push(console, "y += 1") == ""
+    assert not console.failed
+    assert console.locals["y"] == 6
+
+
+def test_memory_limit_interrupts_a_growing_command():
+    console = ExecConsole(memory_limit=10_000_000)
+    errors = push(
+        console, "l = []\nfor i in range(10 ** 7): l.append(str(i))\n")
+    assert "MemoryLimitExceeded" in errors
+    assert errors.endswith(
+        "Command interrupted: memory limit of 10000000 bytes exceeded\n")
+    assert console.failed
+
+
+def test_memory_limit_reports_a_single_allocation():
+    console = ExecConsole(memory_limit=10_000_000)
+    errors = push(console, "x = [0] * 10_000_000")
+    assert errors == (
+        "Command completed: memory limit of 10000000 bytes exceeded\n")
+    assert console.failed
+    del console.locals["x"]
+    assert push(console, "z = [0] * 10") == ""
+    assert not console.failed
@@ -0,0 +1,33 @@
+from collections import OrderedDict, namedtuple
+
+from text_console.display import BoundedRepr
+
+
+def bounded(x, **kwargs):
+    formatter = BoundedRepr(**kwargs)
+    return formatter.repr(x), formatter.truncated
+
+
+def test_containers_within_budget():
+    assert bounded([1, 2], max_items=3) == ("[1, 2]", False)
+    assert bounded({1, 2}, max_items=3) == ("{1, 2}", False)
+    assert bounded(list(range(10)), max_items=3) == ("[0, 1, 2, ...]", True)
+    assert bounded([[[[[[[[1]]]]]]]]) == ("[[[[[[[...]]]]]]]", True)
+
+
+def test_text_and_int_are_truncated():
+    assert bounded("a" * 10 ** 7, max_string=10) == ("'aa...aaa'", True)
+    assert bounded(b"b" * 50, max_string=10) == ("b'b...bbb'", True)
+    assert bounded(10 ** 50, max_string=10) == ("100...0000", True)
+
+
+def test_overridden_repr_of_containers_is_bounded():
+    ordered = OrderedDict((i, i) for i in range(10 ** 6))
+    assert bounded(ordered, max_items=3) == (
+        "OrderedDict({0: 0, 1: 1, 2: 2, ...})", True)
+    point = namedtuple("Point", "x y")(1, 2)
+    assert bounded(point) == ("Point(x=1, y=2)", False)
+
+
+def test_out_of_time():
+    assert bounded([1], time_budget=-1) == (None, True)
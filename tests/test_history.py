@@ -0,0 +1,167 @@
+import pickle
+from pathlib import Path
+
+import pytest
+
+from text_console.history import MAGIC, History
+
+
+def test_background_load_error_keeps_the_file(tmp_path):
+    path = tmp_path / "history"
+    content = b"\xff\xfe not a pickle nor UTF-8 \xff\n"
+    path.write_bytes(content)
+    with pytest.raises(UnicodeDecodeError):
+        History(str(path), load_in_background=False)
+    history = History(str(path), load_in_background=True)
+    history.loaded.wait(10)
+    history.append("x = 1")
+    with pytest.raises(UnicodeDecodeError):
+        history.save()
+    with pytest.raises(UnicodeDecodeError):
+        history.close()
+    assert path.read_bytes() == content
+
+
+def test_no_journal_records_appended_to_another_file(tmp_path):
+    path = tmp_path / "history"
+    history = History(str(path))
+    history.append("a")
+    history.save()
+    other = tmp_path / "other"
+    other.write_bytes(b"legacy line\n")
+    other.replace(path)  # replaced by another program
+    history.append("b")
+    with pytest.raises(ValueError):
+        history.save()
+    assert path.read_bytes() == b"legacy line\n"
+
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / "history")
+    history = History(path)
+    for cmd in ("a = 1", "print(a)", "def f():\n    return 'é'"):
+        history.append(cmd)
+    del history[1]
+    history.close()
+    assert list(History(path)) == ["a = 1", "def f():\n    return 'é'"]
+
+
+def test_reload_after_compaction(tmp_path):
+    path = str(tmp_path / "history")
+    history = History(path, compact_min_records=10)
+    for i in range(50):
+        history.append("x = %d" % i)
+    history.save()
+    del history[:40]
+    history.save()
+    history.compact()
+    history.close()
+    assert list(History(path)) == ["x = %d" % i for i in range(40, 50)]
+
+
+def test_concurrent_instances_merge(tmp_path):
+    path = str(tmp_path / "history")
+    first, second = History(path), History(path)
+    first.append("first 1")
+    second.append("second 1")
+    first.save()
+    second.save()  # merges the command saved by the first instance
+    assert list(second) == ["first 1", "second 1"]
+    first.append("first 2")
+    first.save()
+    assert list(first) == ["first 1", "second 1", "first 2"]
+    second.refresh()
+    assert list(second) == list(first)
+    del second[0]
+    second.save()
+    first.refresh()
+    assert list(first) == ["second 1", "first 2"]
+    first.close()
+    second.close()
+    assert list(History(path)) == ["second 1", "first 2"]
+
+
+def test_deduplicate_and_max_size(tmp_path):
+    path = str(tmp_path / "history")
+    history = History(path, deduplicate=True, max_size=3)
+    for cmd in ("a", "b", "a", "c", "d"):
+        history.append(cmd)
+    assert list(history) == ["a", "c", "d"]
+    history.close()
+    assert list(History(path, max_size=2)) == ["c", "d"]
+
+
+def test_find_previous_and_next(tmp_path):
+    history = History(str(tmp_path / "history"))
+    for cmd in ("print(1)", "x = 1", "print(2)", "pr", "print(3)"):
+        history.append(cmd)
+    assert history.find_previous("print", len(history)) == 4
+    assert history.find_previous("print", 4) == 2
+    assert history.find_previous("print", 2) == 0
+    assert history.find_previous("print", 0) is None
+    assert history.find_previous("", 3) == 2
+    assert history.find_next("print", 0) == 2
+    assert history.find_next("print", 2) == 4
+    assert history.find_next("print", 4) is None
+    assert history.find_previous("zz", len(history)) is None
+    # The recall follows the changes of the history
+    history.append("print(4)")
+    assert history.find_previous("print", len(history)) == 5
+    del history[2]
+    assert history.find_previous("print", 4) == 3
+    assert history.find_next("print", 0) == 3
+
+
+def test_find_previous_non_ascii_prefix(tmp_path):
+    history = History(str(tmp_path / "history"))
+    for cmd in ("é = 1", "e = 2", "éa = 3"):
+        history.append(cmd)
+    history.save()
+    assert history.find_previous("é", len(history)) == 2
+    assert history.find_previous("é", 2) == 0
+    assert history.find_previous("e", len(history)) == 1
+
+
+@pytest.mark.parametrize("pattern, mode, expected", [
+    ("PRINT", "substring", [0, 1, 3]),
+    ("print", "word", [0, 1]),
+    ("print(x)", "substring", [1]),
+    (r"print\(\d\)", "regex", [0]),
+    ("straße", "substring", [2]),
+    ("nothing", "substring", []),
+])
+def test_search_modes(tmp_path, pattern, mode, expected):
+    history = History(str(tmp_path / "history"))
+    for cmd in ("print(1)", "print(x)", "s = 'Straße'", "reprint()"):
+        history.append(cmd)
+    history.save()
+    history.append("unsaved")  # searched as well
+    assert history.search(pattern, mode) == expected
+
+
+def test_legacy_pickle_is_converted(tmp_path):
+    path = tmp_path / "history"
+    path.write_bytes(pickle.dumps(["a = 1", "print(a)"]))
+    history = History(str(path))
+    assert list(history) == ["a = 1", "print(a)"]
+    history.append("b = 2")
+    history.close()
+    assert path.read_bytes().startswith(MAGIC)
+    assert list(History(str(path))) == ["a = 1", "print(a)", "b = 2"]
+
+
+def test_legacy_text_is_converted(tmp_path):
+    path = tmp_path / "history"
+    path.write_text("a = 1\n\nprint(a)\n", encoding="utf-8")
+    history = History(str(path))
+    assert list(history) == ["a = 1", "print(a)"]
+    history.close()
+    assert list(History(str(path))) == ["a = 1", "print(a)"]
+
+
+def test_legacy_pickle_objects_are_refused(tmp_path):
+    path = tmp_path / "history"
+    path.write_bytes(pickle.dumps([Path("x")]))
+    # Not unpickled: the file is then read as text, which it is not
+    with pytest.raises(UnicodeDecodeError):
+        History(str(path))
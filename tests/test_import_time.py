@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which must not be imported on startup: "import text_console"
+# (e.g., to use History) and "python -m text_console" import them on demand
+NOT_ON_STARTUP = {
+    "text_console": (
+        "tkinter", "code", "pickle", "asyncio", "multiprocessing",
+    ),
+    "text_console.__main__": (
+        "pickle", "asyncio", "multiprocessing", "pstats", "cProfile",
+        "ctypes", "tracemalloc", "tkinter.messagebox", "tkinter.ttk",
+    ),
+}
+
+
+def imported_modules(module):
+    """Import module in a new interpreter; return the names of sys.modules."""
+    process = subprocess.run(
+        [sys.executable, "-c",
+         "import sys, %s; print('\\n'.join(sys.modules))" % module],
+        cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return set(process.stdout.split())
+
+
+@pytest.mark.parametrize("module", sorted(NOT_ON_STARTUP))
+def test_no_on_demand_modules_on_startup(module):
+    modules = imported_modules(module)
+    imported = [name for name in NOT_ON_STARTUP[module] if name in modules]
+    assert imported == []
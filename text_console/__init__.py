@@ -1,5 +1,13 @@
-from .text_console import TextConsole, BaseTextConsole
 from .history import History
 from .__version__ import __version__
 
 __all__ = ["TextConsole", "History"]
+
+
+def __getattr__(name):
+    # The widgets are imported on first use, so that History can be
+    # used without importing tkinter
+    if name in ("TextConsole", "BaseTextConsole"):
+        from . import text_console
+        return getattr(text_console, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,4 +1,5 @@
 import sys
+import os
 import argparse
 import tkinter as tk
 import webbrowser
@@ -59,12 +60,44 @@ def main():
         dest='version',
         action='store_true',
         help="Print version and exit")
+    parser.add_argument(
+        '-r',
+        "--run",
+        dest='run',
+        metavar='FILE',
+        help="Run the commands of a script or of a transcript of a session"
+             " ('-' for stdin) without opening the console window, writing"
+             " their output to stdout; exit with status 1 if a command"
+             " failed")
+    parser.add_argument(
+        '-e',
+        "--echo",
+        dest='echo',
+        action='store_true',
+        help="With --run, also print each command with its prompts")
 
     args, unknown = parser.parse_known_args()
     if args.version:
         print(f'Python Console version {__version__}')
         sys.exit(0)
 
+    if args.run is not None:
+        from .batch import BatchRunner
+        if args.run == '-':
+            text = sys.stdin.read()
+        else:
+            with open(args.run, encoding='utf-8') as f:
+                text = f.read()
+        runner = BatchRunner(locals={'__name__': '__console__'}, echo=args.echo)
+        try:
+            status = runner.run(text)
+        except BrokenPipeError:
+            # stdout closed by its reader: avoid another error at exit
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            status = 1
+        sys.exit(status)
+
     app = TkConsole()
     app.mainloop()
 
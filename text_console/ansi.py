@@ -0,0 +1,173 @@
+import re
+from functools import lru_cache
+
+# Control sequences: SGR and other CSI sequences, OSC sequences
+_SEQUENCE = re.compile(
+    r'\x1b\[([0-9;:?]*)([@-~])|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]'
+)
+_INCOMPLETE = re.compile(r'\x1b(?:\[[0-9;:?]*|\][^\x07\x1b]*)?$')
+# Longest incomplete sequence carried over (e.g., an OSC never terminated)
+MAX_PENDING = 4096
+
+# The 16 basic colors, darkened where needed to be readable on white
+_BASIC_COLORS = (
+    "#000000", "#cd3131", "#00bc00", "#949800",
+    "#0451a5", "#bc05bc", "#0598bc", "#555555",
+    "#666666", "#cd3131", "#14ce14", "#b5ba00",
+    "#0451a5", "#bc05bc", "#0598bc", "#a5a5a5",
+)
+_CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+
+def color_of(index):
+    """Hex color of an entry of the xterm 256-color palette."""
+    if index < 16:
+        return _BASIC_COLORS[index]
+    if index < 232:
+        index -= 16
+        return "#%02x%02x%02x" % (
+            _CUBE_LEVELS[index // 36],
+            _CUBE_LEVELS[index // 6 % 6],
+            _CUBE_LEVELS[index % 6]
+        )
+    level = 8 + (index - 232) * 10
+    return "#%02x%02x%02x" % (level, level, level)
+
+
+def _cube_index(r, g, b):
+    """Nearest entry of the 6x6x6 color cube, bounding the colors of 24-bit sequences."""
+    def level(value):
+        return min(range(6), key=lambda i: abs(_CUBE_LEVELS[i] - value))
+    return 16 + 36 * level(r) + 6 * level(g) + level(b)
+
+
+@lru_cache(maxsize=256)
+def _codes(parameters):
+    return tuple(int(code) if code.isdigit() else 0
+                 for code in re.split('[;:]', parameters))
+
+
+def tag_options(tag):
+    """Options of tag_configure for a tag returned by AnsiParser."""
+    kind, _, value = tag[5:].partition('_')
+    if kind == 'fg':
+        return {'foreground': color_of(int(value))}
+    if kind == 'bg':
+        return {'background': color_of(int(value))}
+    if kind == 'underline':
+        return {'underline': True}
+    return {}  # bold and italic need a font, set by the widget
+
+
+class AnsiParser:
+    """
+    Splits text written to a stream into (text, tags) segments, turning
+    SGR escape sequences into tags named ansi_fg_<n>, ansi_bg_<n> (n in
+    the xterm 256-color palette, to which 24-bit colors are reduced),
+    ansi_bold, ansi_italic and ansi_underline; the set of tags is thus
+    bounded. Other control sequences are removed. The style and an
+    incomplete sequence at the end of a chunk carry over to the next one,
+    up to MAX_PENDING characters: beyond, the sequence is taken as never
+    terminated, and its text is shown without the ESC character.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._fg = None
+        self._bg = None
+        self._bold = self._italic = self._underline = False
+        self._tags = ()
+        self._pending = ''
+
+    def split(self, text):
+        """Return the list of (text, tags) segments of a chunk of text."""
+        if self._pending:
+            text, self._pending = self._pending + text, ''
+        if '\x1b' not in text:
+            return [(text, self._tags)] if text else []
+        incomplete = _INCOMPLETE.search(text)
+        if incomplete and len(incomplete.group()) > MAX_PENDING:
+            start = incomplete.start()
+            text = text[:start] + text[start + 1:]
+        elif incomplete:
+            self._pending = incomplete.group()
+            text = text[:incomplete.start()]
+        segments = []
+        parts = []  # text of the current run of equally styled segments
+        tags = self._tags
+        position = 0
+        for match in _SEQUENCE.finditer(text):
+            if match.start() > position:
+                parts.append(text[position:match.start()])
+            position = match.end()
+            if match.group(2) == 'm':
+                self._apply(match.group(1))
+                if self._tags != tags:
+                    if parts:
+                        segments.append((''.join(parts), tags))
+                        parts = []
+                    tags = self._tags
+        if position < len(text):
+            parts.append(text[position:])
+        if parts:
+            segments.append((''.join(parts), tags))
+        return segments
+
+    def _apply(self, parameters):
+        codes = _codes(parameters)
+        i = 0
+        while i < len(codes):
+            code = codes[i]
+            if code == 0:
+                self._fg = self._bg = None
+                self._bold = self._italic = self._underline = False
+            elif code == 1:
+                self._bold = True
+            elif code == 3:
+                self._italic = True
+            elif code == 4:
+                self._underline = True
+            elif code == 22:
+                self._bold = False
+            elif code == 23:
+                self._italic = False
+            elif code == 24:
+                self._underline = False
+            elif 30 <= code <= 37:
+                self._fg = code - 30
+            elif 90 <= code <= 97:
+                self._fg = code - 90 + 8
+            elif code == 39:
+                self._fg = None
+            elif 40 <= code <= 47:
+                self._bg = code - 40
+            elif 100 <= code <= 107:
+                self._bg = code - 100 + 8
+            elif code == 49:
+                self._bg = None
+            elif code in (38, 48) and i + 1 < len(codes):
+                color = None
+                if codes[i + 1] == 5 and i + 2 < len(codes):
+                    color = codes[i + 2] % 256
+                    i += 2
+                elif codes[i + 1] == 2 and i + 4 < len(codes):
+                    color = _cube_index(*(min(c, 255) for c in codes[i + 2:i + 5]))
+                    i += 4
+                if code == 38:
+                    self._fg = color
+                else:
+                    self._bg = color
+            i += 1
+        tags = []
+        if self._fg is not None:
+            tags.append('ansi_fg_%d' % self._fg)
+        if self._bg is not None:
+            tags.append('ansi_bg_%d' % self._bg)
+        if self._bold:
+            tags.append('ansi_bold')
+        if self._italic:
+            tags.append('ansi_italic')
+        if self._underline:
+            tags.append('ansi_underline')
+        self._tags = tuple(tags)
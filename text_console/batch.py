@@ -0,0 +1,153 @@
+import re
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+
+from .console import ExecConsole, expand_help
+from .display import ResultFormatter
+from .stream import ConsoleStream
+
+PROMPT1 = ">>> "
+PROMPT2 = "... "
+# Lines continuing a compound statement at its indentation level
+_CONTINUATION = re.compile(r"(else|elif|except|finally)\b")
+
+
+class _StandardOutput:
+    """
+    Receives the writes of the ConsoleStream objects of a command, as the
+    OutputBuffer of the console does, and writes them to the standard
+    streams. If stdout is closed by its reader (e.g., 'head'), the
+    BrokenPipeError is kept in 'broken_pipe' instead of being raised in
+    the command, and the following output is discarded.
+    """
+    def __init__(self, stdout, stderr):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.broken_pipe = None
+
+    def put(self, tag, text):
+        if tag == "errors":
+            self.stderr.write(text)
+        elif self.broken_pipe is None:
+            try:
+                self.stdout.write(text)
+            except BrokenPipeError as e:
+                self.broken_pipe = e
+
+
+class BatchRunner:
+    """
+    Runs console commands without a GUI, writing their output and results
+    to stdout and their errors to stderr.
+
+    Commands are pushed to an ExecConsole, as by the console widget:
+    each is evaluated as an expression first (its result is shown,
+    bounded by ResultFormatter) and executed as statements otherwise, and
+    lines ending with '?' are rewritten as help() calls. Top-level await
+    waits for the coroutine.
+
+    The text run is either a transcript, if its first non-blank line
+    starts with the '>>> ' prompt (commands are the lines with the '>>> '
+    and '... ' prompts, the other lines being the output of the session,
+    which is ignored), or a script, in which a command ends before the
+    next line at indentation level 0 which does not continue it (e.g.,
+    'else:'), so that blank lines are not needed after the blocks.
+
+    With echo, each command is written to stdout with its prompts before
+    running it. 'failed' counts the commands which raised an exception
+    (warnings are only written to stderr). BrokenPipeError is raised,
+    after the command, if stdout was closed by its reader.
+    """
+    def __init__(self, locals=None, stdout=None, stderr=None, echo=False,
+                 formatter=None):
+        self.console = ExecConsole(locals=locals)
+        self.stdout = stdout or sys.stdout
+        self.stderr = stderr or sys.stderr
+        self.echo = echo
+        self.formatter = formatter or ResultFormatter()
+        self.failed = 0
+
+    def run(self, text):
+        """Run a script or a transcript; return 1 if a command failed, 0 otherwise."""
+        lines = [line.rstrip() for line in text.splitlines()]
+        first = next((line for line in lines if line.strip()), "")
+        if first.startswith(PROMPT1.rstrip()):
+            self._run_transcript(lines)
+        else:
+            self._run_script(lines)
+        return 1 if self.failed else 0
+
+    def _run_transcript(self, lines):
+        command = None
+        for line in lines:
+            if line.startswith(PROMPT1.rstrip()):
+                if command is not None:
+                    self._run_block(command)
+                command = [expand_help(line[len(PROMPT1):])]
+            elif command is not None and line.startswith(PROMPT2.rstrip()):
+                command.append(expand_help(line[len(PROMPT2):]))
+            elif command is not None:
+                self._run_block(command)  # output of the session follows
+                command = None
+        if command is not None:
+            self._run_block(command)
+
+    def _run_script(self, lines):
+        block = []
+        for i, line in enumerate(lines):
+            block.append(expand_help(line))
+            following = next(
+                (line for line in lines[i + 1:] if line.strip()), None)
+            if following is not None and (
+                    following[0].isspace() or _CONTINUATION.match(following)):
+                continue  # the command goes on
+            if not any(line.strip() for line in block):
+                block = []
+            elif self._run_block(block, final=following is None):
+                block = []
+        if block:
+            self._run_block(block, final=True)
+
+    def _run_block(self, lines, final=True):
+        """
+        Run a command; return False if it is incomplete, which is an error
+        if final.
+        """
+        source = "\n".join(lines).rstrip("\n")
+        if not source.strip():
+            return True
+        if self._push(source):
+            return True
+        # Complete a compound statement, as an empty line does in the console
+        if self._push(source + "\n", echo=False):
+            return True
+        if not final:
+            return False
+        self.stderr.write("SyntaxError: incomplete input: %s\n" % lines[0])
+        self.console.resetbuffer()
+        self.failed += 1
+        return True
+
+    def _push(self, source, echo=True):
+        """Push a command to the console; return True if it was complete."""
+        output = _StandardOutput(self.stdout, self.stderr)
+        if echo and self.echo:
+            source_lines = source.split("\n")
+            self.stdout.write(PROMPT1 + source_lines[0] + "\n")
+            for line in source_lines[1:]:
+                self.stdout.write(PROMPT2 + line + "\n")
+        with redirect_stderr(ConsoleStream(output, "errors")):
+            with redirect_stdout(ConsoleStream(output, "output")):
+                incomplete = self.console.push(source)
+        if output.broken_pipe is not None:
+            raise output.broken_pipe
+        if incomplete:
+            return False
+        if self.console.failed:
+            self.failed += 1
+        else:
+            result = self.console.get_last_result()
+            if result is not None:
+                self.stdout.write(self.formatter.format(result)[0] + "\n")
+        self.stdout.flush()
+        return True
@@ -1,9 +1,32 @@
+import re
 import tkinter as tk
+import tkinter.font as tkfont
+
+from .history import SEARCH_MODES, compile_search
 
 class CommandHistoryPanel(tk.Toplevel):
+    """
+    Virtualized view of the command history: only the entries around the
+    view, a page and render_margin entries before and after it, are
+    rendered in the Text widget, which scrolls by line through them
+    (also through an entry taller than the panel); another window of
+    entries is rendered when the view reaches the first or last rendered
+    line. The scrollbar is driven by the entry position.
+    """
+    render_margin = 5  # entries rendered beyond a page around the view
+    relayout_delay = 100  # ms without resize events before the relayout
+
     def __init__(self, master, history, insert_cmd_callback, hist_item_ref, close_callback=None):
         super().__init__(master)
         self.history = history
+        self._top = 0  # row of the first rendered entry (row 0 = newest)
+        self._rows = range(0)  # rows of the rendered entries
+        self._line_index = []  # history index of each rendered line, None for dividers
+        self._entry_line = {}  # history index -> first rendered line
+        self._num_width = 5
+        self._divider_width = 0
+        self._version = None  # history version of the rendered entries
+        self._relayout_job = None
         self.insert_cmd_callback = insert_cmd_callback
         self.hist_item_ref = hist_item_ref
         self.close_callback = close_callback
@@ -40,6 +63,10 @@ class CommandHistoryPanel(tk.Toplevel):
         self.btn_up.pack(side="left")
         self.btn_down = tk.Button(search_frame, text="↓", width=2)
         self.btn_down.pack(side="left")
+        self.search_mode = tk.StringVar(value=SEARCH_MODES[0])
+        self.mode_menu = tk.OptionMenu(search_frame, self.search_mode, *SEARCH_MODES)
+        self.mode_menu.config(width=9)
+        self.mode_menu.pack(side="left", padx=(4, 0))
         self.after(300, self.focus_search_entry_delayed)
         # --- End search bar frame ---
         text_frame = tk.Frame(main_frame)
@@ -49,14 +76,14 @@ class CommandHistoryPanel(tk.Toplevel):
         self.history_txt = tk.Text(
             text_frame, 
             wrap="none",
-            yscrollcommand=v_scrollbar.set,
             xscrollcommand=h_scrollbar.set,
             font=("Consolas", 10),
             bg="white",
             fg="black",
             selectbackground="#cce7ff"
         )
-        v_scrollbar.config(command=self.history_txt.yview)
+        self.v_scrollbar = v_scrollbar
+        v_scrollbar.config(command=self.on_vscroll)
         h_scrollbar.config(command=self.history_txt.xview)
         v_scrollbar.pack(side="right", fill="y")
         h_scrollbar.pack(side="bottom", fill="x")
@@ -68,6 +95,11 @@ class CommandHistoryPanel(tk.Toplevel):
         self.history_txt.tag_configure("divider", foreground="#cccccc", selectbackground="white", selectforeground="#cccccc")
         self.history_txt.tag_configure("nonselectable", foreground="#0066cc", font=("Consolas", 10, "bold"), selectbackground="white", selectforeground="#0066cc")
         self.history_txt.config(state="disabled")
+        self._line_height = tkfont.Font(font=self.history_txt.cget("font")).metrics("linespace")
+        # A fixed set of tag bindings, valid for any rendered row
+        self.history_txt.tag_bind("number", "<Double-Button-1>", self.on_number_double_click)
+        self.history_txt.tag_bind("number", "<Enter>", self.on_number_enter)
+        self.history_txt.tag_bind("number", "<Leave>", self.on_number_leave)
         status_frame = tk.Frame(main_frame)
         status_frame.pack(fill="x", pady=(5, 0))
         self.status_label = tk.Label(
@@ -88,6 +120,7 @@ class CommandHistoryPanel(tk.Toplevel):
         # Search navigation state
         self.search_matches = []
         self.search_index = [0]
+        self._search_key = None  # (pattern, mode, history version) of search_matches
         # Bindings
         self.history_txt.bind("<Control-c>", self.copy_selected_command)
         self.history_txt.bind("<Control-C>", self.copy_selected_command)
@@ -106,6 +139,16 @@ class CommandHistoryPanel(tk.Toplevel):
         self.history_txt.bind("<Enter>", self.on_number_enter)
         self.history_txt.bind("<Leave>", self.on_number_leave)
         self.bind('<Configure>', self.on_window_configure)
+        # Scrolling moves the view through the rendered window
+        self.history_txt.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.history_txt.bind("<Button-4>", lambda e: self.scroll_lines(-3))
+        self.history_txt.bind("<Button-5>", lambda e: self.scroll_lines(3))
+        self.history_txt.bind("<Up>", lambda e: self.scroll_lines(-1))
+        self.history_txt.bind("<Down>", lambda e: self.scroll_lines(1))
+        self.history_txt.bind("<Prior>", lambda e: self.scroll_lines(-self.view_lines()))
+        self.history_txt.bind("<Next>", lambda e: self.scroll_lines(self.view_lines()))
+        self.history_txt.bind("<Control-Home>", lambda e: self.scroll_to(0))
+        self.history_txt.bind("<Control-End>", lambda e: self.scroll_to(len(self.history) - 1, 1.0))
 
     def delayed_setup(self):
         self.update_display()
@@ -120,7 +163,11 @@ class CommandHistoryPanel(tk.Toplevel):
             self.close_callback()
         self.destroy()
 
-    def calculate_layout(self):
+    def calculate_layout(self, entries=()):
+        """
+        Return the number, command and total widths, and the length of the
+        longest line of the given entries (as lists of lines).
+        """
         try:
             text_width_pixels = self.history_txt.winfo_width()
             char_width = 8
@@ -128,28 +175,145 @@ class CommandHistoryPanel(tk.Toplevel):
         except:
             widget_width = max(100, (self.winfo_width() - 80) // 8)
         max_command_length = 0
-        for command in self.history:
-            for line in str(command).split('\n'):
-                max_command_length = max(max_command_length, len(line))
+        for lines in entries:
+            max_command_length = max(max_command_length, *map(len, lines))
         num_width = max(5, len(str(len(self.history))))
         cmd_width = max(50, widget_width - num_width - 3)
         return num_width, cmd_width, max_command_length, widget_width
 
+    def view_lines(self):
+        """Number of lines of the view."""
+        return max(1, self.history_txt.winfo_height() // self._line_height)
+
+    def visible_rows(self):
+        """Number of entries needed to fill the view (each takes two lines at least)."""
+        return self.view_lines() // 2 + 1
+
+    def entry_lines(self, hist_index):
+        """Lines of a history entry, as displayed."""
+        return str(self.history[hist_index]).strip().split('\n')
+
+    def row_of(self, hist_index):
+        """Row of a history entry (the newest command is shown first)."""
+        return len(self.history) - 1 - hist_index
+
+    def scroll_to(self, row, fraction=0.0):
+        """
+        Render the entries around a row and show it at the top of the view,
+        from the given fraction of its lines (1.0 shows the end of the
+        last entry).
+        """
+        total = len(self.history)
+        row = max(0, min(row, total - 1))
+        self._top = max(0, row - self.visible_rows() - self.render_margin)
+        self.update_display(row, fraction)
+        return "break"
+
+    def scroll_lines(self, lines):
+        """
+        Scroll the view by lines; the entries around it are rendered again
+        first if it would leave the rendered ones.
+        """
+        txt = self.history_txt
+        first = int(txt.index("@0,0").split('.')[0])
+        last = int(txt.index(f"@0,{txt.winfo_height()}").split('.')[0])
+        if (first + lines < 1 and self._rows.start > 0
+                or last + lines > len(self._line_index)
+                and self._rows.stop < len(self.history)):
+            self.scroll_to(*self.view_position())
+        txt.yview_scroll(lines, "units")
+        self.update_scrollbar()
+        return "break"
+
+    def on_mouse_wheel(self, event):
+        return self.scroll_lines(-3 if event.delta > 0 else 3)
+
+    def on_vscroll(self, *args):
+        """Scrollbar command: 'moveto fraction' or 'scroll n units|pages'."""
+        if args[0] == "moveto":
+            position = max(0.0, float(args[1])) * len(self.history)
+            self.scroll_to(int(position), position % 1)
+        elif args[0] == "scroll":
+            lines = int(args[1])
+            if args[2] == "pages":
+                lines *= self.view_lines()
+            self.scroll_lines(lines)
+
+    def entry_height(self, hist_index):
+        """Rendered lines of an entry, its divider included."""
+        start = self._entry_line[hist_index]
+        end = self._entry_line.get(hist_index - 1, len(self._line_index) + 1)
+        return end - start
+
+    def view_position(self):
+        """
+        Return the row of the entry at the top of the view, and the
+        fraction of its lines above the view.
+        """
+        if not self._line_index:
+            return self._top, 0.0
+        line = int(self.history_txt.index("@0,0").split('.')[0])
+        line = min(line, len(self._line_index))
+        hist_index = self._line_index[line - 1]
+        if hist_index is None:  # dividers belong to the entry above
+            hist_index = self._line_index[line - 2]
+        offset = line - self._entry_line[hist_index]
+        return self.row_of(hist_index), offset / self.entry_height(hist_index)
+
+    def update_scrollbar(self):
+        total = len(self.history)
+        if not total:
+            self.v_scrollbar.set(0, 1)
+            return
+        row, fraction = self.view_position()
+        first = row + fraction
+        self.v_scrollbar.set(first / total, min(total, first + self.visible_rows()) / total)
+
     def on_window_configure(self, event=None):
         if event and event.widget == self:
-            self.update_display()
+            # Debounce: relayout once the resizing stops
+            if self._relayout_job is not None:
+                self.after_cancel(self._relayout_job)
+            self._relayout_job = self.after(self.relayout_delay, self.relayout)
+
+    def relayout(self):
+        """
+        Adapt the rendered entries to the panel size: content is rebuilt
+        only if more entries are needed or the history has changed,
+        otherwise only the dividers are redrawn for the new width.
+        """
+        self._relayout_job = None
+        row, _ = self.view_position()
+        needed = min(len(self.history), row + self.visible_rows() + 1)
+        if (self._version != self.history.version
+                or self._rows.stop < needed):
+            self.scroll_to(*self.view_position())
+            return
+        layout = self.calculate_layout()
+        if layout[3] != self._divider_width:
+            self.redraw_dividers(layout[3])
+        self.update_scrollbar()
+
+    def redraw_dividers(self, width):
+        """Resize the rendered divider lines."""
+        divider = "─" * width
+        self.history_txt.config(state="normal")
+        for line, hist_index in enumerate(self._line_index, 1):
+            if hist_index is None:
+                self.history_txt.delete(f"{line}.0", f"{line}.end")
+                self.history_txt.insert(f"{line}.0", divider, "divider")
+        self.history_txt.config(state="disabled")
+        self._divider_width = width
 
     def on_number_double_click(self, event):
         index = self.history_txt.index(f"@{event.x},{event.y}")
         line = int(index.split('.')[0])
-        while line > 0:
-            num_text = self.history_txt.get(f"{line}.0", f"{line}.end").split('│')[0].strip()
-            if num_text.isdigit():
-                hist_index = int(num_text) - 1  # assuming history is 1-based in the panel
+        hist_index = None  # Not found
+        while 0 < line <= len(self._line_index):
+            hist_index = self._line_index[line - 1]
+            if hist_index is not None:  # dividers belong to the entry above
                 break
             line -= 1
-        else:
-            hist_index = None  # Not found
 
         if hist_index is not None:
             command = self.history[hist_index]
@@ -188,35 +352,61 @@ class CommandHistoryPanel(tk.Toplevel):
         except tk.TclError:
             pass
 
-    def update_display(self):
-        self.history_txt.config(state="normal")
-        self.history_txt.delete("1.0", "end")
-        num_width, cmd_width, max_cmd_length, total_width = self.calculate_layout()
+    def update_display(self, row=None, fraction=0.0):
+        """
+        Render the window of entries starting from the top row, with a
+        single insert, and show the given row (by default, the first one)
+        at the top of the view, from the given fraction of its lines.
+        """
+        total = len(self.history)
+        self._top = max(0, min(self._top, total - 1))
+        rows = range(self._top, min(
+            total, self._top + 2 * (self.visible_rows() + self.render_margin)))
+        self._rows = rows
+        self._version = self.history.version
+        entries = [self.entry_lines(total - 1 - row) for row in rows]
+        num_width, cmd_width, max_cmd_length, total_width = self.calculate_layout(entries)
+        self._num_width = num_width
+        self._divider_width = total_width
         header_text = f"{'№':<{num_width}}│ Command"
         self.header_label.config(text=header_text)
-        for i, command in enumerate(reversed(self.history)):
-            item_number = len(self.history) - i
-            command_text = str(command).strip()
-            command_lines = command_text.split('\n')
-            first_line = command_lines[0] if command_lines else ""
-            tag_name = f"numtag_{item_number}"
-            start_idx = self.history_txt.index("end-1c")
-            self.history_txt.insert("end", f"{item_number:<{num_width}}", ("number", "nonselectable", tag_name))
-            end_idx = self.history_txt.index("end-1c")
-            self.history_txt.insert("end", " │ ", ("separator", "nonselectable"))
-            self.history_txt.insert("end", f"{first_line}\n", "command")
-            # Bind number column events for this tag
-            self.history_txt.tag_bind(tag_name, "<Double-Button-1>", self.on_number_double_click)
-            self.history_txt.tag_bind(tag_name, "<Enter>", self.on_number_enter)
-            self.history_txt.tag_bind(tag_name, "<Leave>", self.on_number_leave)
+        args = []
+        self._line_index = []
+        self._entry_line = {}
+        for row, command_lines in zip(rows, entries):
+            hist_index = total - 1 - row
+            self._entry_line[hist_index] = len(self._line_index) + 1
+            self._line_index.append(hist_index)
+            args += [
+                f"{hist_index + 1:<{num_width}}", ("number", "nonselectable"),
+                " │ ", ("separator", "nonselectable"),
+                f"{command_lines[0]}\n", "command",
+            ]
             for line in command_lines[1:]:
-                self.history_txt.insert("end", f"{'':<{num_width}}", "nonselectable")
-                self.history_txt.insert("end", " │ ", ("separator", "nonselectable"))
-                self.history_txt.insert("end", f"{line}\n", "command")
-            if i < len(self.history) - 1:
-                self.history_txt.insert("end", "─" * total_width, "divider")
-                self.history_txt.insert("end", "\n")
+                self._line_index.append(hist_index)
+                args += [
+                    f"{'':<{num_width}}", "nonselectable",
+                    " │ ", ("separator", "nonselectable"),
+                    f"{line}\n", "command",
+                ]
+            if row < total - 1:
+                self._line_index.append(None)
+                args += ["─" * total_width + "\n", "divider"]
+        self.history_txt.config(state="normal")
+        self.history_txt.delete("1.0", "end")
+        if args:
+            self.history_txt.insert("1.0", *args)
         self.history_txt.config(state="disabled")
+        if row is None or total - 1 - row not in self._entry_line:
+            self.history_txt.yview_moveto(0)
+        elif fraction >= 1.0:  # the end of the last entry
+            self.history_txt.yview_moveto(1.0)
+        else:
+            hist_index = total - 1 - row
+            height = self.entry_height(hist_index)
+            offset = min(round(fraction * height), height - 1)
+            self.history_txt.yview(f"{self._entry_line[hist_index] + offset}.0")
+        self.update_scrollbar()
 
     def copy_selected_command(self, event=None):
         try:
@@ -251,16 +441,19 @@ class CommandHistoryPanel(tk.Toplevel):
         self.history_txt.tag_remove("sel", "1.0", "end")
         if not pattern:
             return
-        matches = []
-        for i in range(1, int(self.history_txt.index("end-1c").split(".")[0])):
-            line_content = self.history_txt.get(f"{i}.0", f"{i}.end")
-            sep_index = line_content.find("│")
-            if sep_index != -1:
-                command_part = line_content[sep_index+1:]
-                col_offset = sep_index + 1
-                idx = command_part.lower().find(pattern.lower())
-                if idx != -1:
-                    matches.append((i, col_offset + idx, col_offset + idx + len(pattern)))
+        key = (pattern, self.search_mode.get(), self.history.version)
+        if key != self._search_key:
+            try:
+                matches = self.find_matches(pattern, key[1])
+            except re.error as e:
+                self.status_label.config(text=f"Invalid regular expression: {e}")
+                return
+            self.search_matches.clear()
+            self.search_matches.extend(matches)
+            self._search_key = key
+            self.status_label.config(
+                text=f"Total commands: {len(self.history)}. Matches: {len(matches)}.")
+        matches = self.search_matches
         if not matches:
             self.search_index[0] = 0
             return
@@ -268,13 +461,34 @@ class CommandHistoryPanel(tk.Toplevel):
             self.search_index[0] = (self.search_index[0] + 1) % len(matches) if self.search_index[0] < len(matches) else 0
         else:
             self.search_index[0] = (self.search_index[0] - 1) % len(matches)
-        line, start_col, end_col = matches[self.search_index[0]]
+        self.show_match(matches[self.search_index[0]])
+
+    def find_matches(self, pattern, mode):
+        """
+        Search the history through its index; return the first match of
+        each displayed line as (hist_index, line_no, start_col, end_col),
+        in panel order (newest first).
+        """
+        regex = compile_search(pattern, mode)
+        matches = []
+        for hist_index in reversed(self.history.search(pattern, mode)):
+            for line_no, line in enumerate(self.entry_lines(hist_index)):
+                found = regex.search(line)
+                if found and found.end() > found.start():
+                    matches.append((hist_index, line_no, found.start(), found.end()))
+        return matches
+
+    def show_match(self, match):
+        """Scroll to a search match (hist_index, line_no, start_col, end_col) and select it."""
+        hist_index, line_no, start, end = match
+        if hist_index not in self._entry_line:
+            self.scroll_to(self.row_of(hist_index))
+        line = self._entry_line[hist_index] + line_no
+        col_offset = self._num_width + 3  # number column and " │ "
         self.history_txt.see(f"{line}.0")
-        self.history_txt.tag_add("sel", f"{line}.{start_col}", f"{line}.{end_col}")
-        self.history_txt.mark_set("insert", f"{line}.{start_col}")
+        self.history_txt.tag_add("sel", f"{line}.{col_offset + start}", f"{line}.{col_offset + end}")
+        self.history_txt.mark_set("insert", f"{line}.{col_offset + start}")
         self.history_txt.focus_set()
-        self.search_matches.clear()
-        self.search_matches.extend(matches)
 
     def on_search_enter(self, event=None):
         self.search_index[0] = -1
@@ -290,10 +504,8 @@ class CommandHistoryPanel(tk.Toplevel):
 
     def load_selected_to_main(self, event=None):
         if self.search_matches and 0 <= self.search_index[0] < len(self.search_matches):
-            line, start_col, end_col = self.search_matches[self.search_index[0]]
-            num_text = self.history_txt.get(f"{line}.0", f"{line}.end").split('│')[0].strip()
+            hist_index = self.search_matches[self.search_index[0]][0]
             try:
-                hist_index = int(num_text) - 1
                 if 0 <= hist_index < len(self.history):
                     self.hist_item_ref[0] = hist_index
                     self.insert_cmd_callback(self.history[hist_index])
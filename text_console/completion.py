@@ -0,0 +1,116 @@
+import re
+import types
+import bisect
+import keyword
+import builtins
+from collections import OrderedDict
+
+# Descriptors of C types, e.g. slots: reading them runs no Python code
+_C_DESCRIPTORS = (
+    types.MemberDescriptorType, types.GetSetDescriptorType,
+    types.MethodDescriptorType, types.ClassMethodDescriptorType,
+    types.WrapperDescriptorType,
+)
+_DOTTED_NAME = re.compile(r'[^\W\d]\w*(?:\.[^\W\d]\w*)*\.?$|\.$')
+
+
+def name_before(text):
+    """Return the dotted name at the end of text, '' if there is none."""
+    match = _DOTTED_NAME.search(text)
+    if match is None or match.group() == '.':
+        return ''
+    return match.group()
+
+
+class Completer:
+    """
+    Completes names and dotted attributes over a namespace.
+
+    The sorted names of the namespace and the sorted dir() of the last
+    max_cached completed objects are cached, so that a completion costs
+    a binary search even for modules with thousands of attributes.
+    invalidate() makes the whole cache stale in constant time (it is
+    called after each executed command); stale entries are rebuilt when
+    they are used again.
+    """
+    def __init__(self, namespace, max_cached=64):
+        self.namespace = namespace
+        self.max_cached = max_cached
+        self.generation = 0
+        self._names = (None, [])  # (generation, sorted global names)
+        self._attributes = OrderedDict()  # id -> (generation, obj, names)
+
+    def invalidate(self):
+        self.generation += 1
+
+    def complete(self, text):
+        """Return the sorted completions of the dotted name 'text'."""
+        if '.' in text:
+            expr, prefix = text.rsplit('.', 1)
+            try:
+                names = self.attributes(self._resolve(expr))
+            except Exception:  # e.g., an attribute of a property
+                return []
+            base = expr + '.'
+        else:
+            names, prefix, base = self.global_names(), text, ''
+        start = bisect.bisect_left(names, prefix)
+        matches = []
+        for name in names[start:]:
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+        if base and not prefix.startswith('_'):
+            matches = [name for name in matches if not name.startswith('_')]
+        return [base + name for name in matches]
+
+    def global_names(self):
+        generation, names = self._names
+        if generation != self.generation:
+            names = set(self.namespace)
+            names.update(dir(builtins))
+            names.update(keyword.kwlist)
+            names = sorted(names)
+            self._names = (self.generation, names)
+        return names
+
+    def attributes(self, obj):
+        """Return the sorted dir() of obj, cached."""
+        key = id(obj)
+        entry = self._attributes.get(key)
+        if entry is not None and entry[0] == self.generation and entry[1] is obj:
+            self._attributes.move_to_end(key)
+            return entry[2]
+        names = sorted(set(name for name in dir(obj) if isinstance(name, str)))
+        self._attributes[key] = (self.generation, obj, names)
+        self._attributes.move_to_end(key)
+        if len(self._attributes) > self.max_cached:
+            self._attributes.popitem(last=False)
+        return names
+
+    def _resolve(self, expr):
+        """
+        Return the object named by a dotted name, without evaluating code:
+        attributes are looked up with inspect.getattr_static, so that no
+        property or __getattr__ runs, and the resolution stops (raising
+        AttributeError) at a descriptor implemented in Python. The slots
+        and the attributes of C types are read.
+        """
+        from inspect import getattr_static
+        first, *rest = expr.split('.')
+        if first in self.namespace:
+            obj = self.namespace[first]
+        else:
+            obj = getattr(builtins, first)
+        for name in rest:
+            attr = getattr_static(obj, name)
+            if isinstance(attr, _C_DESCRIPTORS):
+                if not issubclass(type(obj), type):  # no __class__ lookup
+                    attr = attr.__get__(obj, type(obj))
+            elif isinstance(attr, (classmethod, staticmethod)):
+                attr = attr.__func__
+            elif (hasattr(type(attr), '__get__')
+                    and not isinstance(attr, types.FunctionType)):
+                raise AttributeError(name)  # e.g., a property
+            obj = attr
+        return obj
@@ -0,0 +1,396 @@
+import sys
+import ast
+import time
+import threading
+from code import InteractiveConsole
+from collections import OrderedDict, deque, namedtuple
+
+from .completion import Completer
+
+
+CommandStats = namedtuple(
+    'CommandStats', 'source wall_time cpu_time peak_memory'
+)
+CommandStats.__doc__ = """
+Measures of a pushed command: wall and CPU times in seconds, peak of
+the memory allocated while running in bytes (None if not traced).
+"""
+
+
+_NOT_AN_EXPRESSION = object()
+_NOT_CACHED = object()
+_CO_COROUTINE = 0x80  # inspect.CO_COROUTINE, without importing inspect
+
+# asyncio, cProfile, ctypes and tracemalloc are imported on first use:
+# they are slow to import and most commands do not need them
+
+
+def expand_help(line):
+    """Rewrite a line ending with '?', e.g. 'len?', as 'help(len)'."""
+    return 'help(%s)' % line[:-1] if line.endswith('?') else line
+
+
+class TimeLimitExceeded(KeyboardInterrupt):
+    """Raised in a command running for longer than the time limit."""
+
+
+class MemoryLimitExceeded(MemoryError):
+    """Raised in a command allocating more memory than the memory limit."""
+
+
+class Watchdog:
+    """
+    Thread raising TimeLimitExceeded or MemoryLimitExceeded in the thread
+    that created it, when it runs for longer than time_limit seconds or
+    when the memory traced by tracemalloc grows by more than memory_limit
+    bytes. tracemalloc does not tell the allocating thread: the memory
+    allocated meanwhile by other threads is also counted.
+
+    The exception is raised asynchronously, so it interrupts Python code
+    but not a single long call into C code, which is interrupted when
+    it returns. Memory is polled every 'interval' seconds; stop() also
+    compares the peak traced by tracemalloc with the limit, so that an
+    allocation completed between two polls is reported (without
+    interrupting the command, which has completed). 'tripped' describes
+    the exceeded limit, 'interrupted' tells if the exception was raised.
+    """
+    def __init__(self, time_limit=None, memory_limit=None, interval=0.05):
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.interval = interval  # seconds between memory checks
+        self.tripped = None
+        self.interrupted = False
+        self._baseline = 0
+        self._check_peak = False
+        if memory_limit:
+            import tracemalloc
+            self._baseline = tracemalloc.get_traced_memory()[0]
+            # The peak is the one of the command once reset (Python 3.9+)
+            self._check_peak = hasattr(tracemalloc, 'reset_peak')
+            if self._check_peak:
+                tracemalloc.reset_peak()
+        self._thread_id = threading.get_ident()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        if self.memory_limit:
+            import tracemalloc
+        deadline = None
+        if self.time_limit is not None:
+            deadline = time.monotonic() + self.time_limit
+        while True:
+            timeout = self.interval if self.memory_limit else None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            if self._stopped.wait(timeout):
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                self._trip(
+                    TimeLimitExceeded,
+                    "time limit of %g s exceeded" % self.time_limit
+                )
+                return
+            if (self.memory_limit and tracemalloc.is_tracing()
+                    and tracemalloc.get_traced_memory()[0] - self._baseline
+                    > self.memory_limit):
+                self._trip(MemoryLimitExceeded, self._memory_reason())
+                return
+
+    def _memory_reason(self):
+        return "memory limit of %d bytes exceeded" % self.memory_limit
+
+    def _trip(self, exc_type, reason):
+        with self._lock:
+            if self._stopped.is_set():
+                return
+            self.tripped = reason
+            self.interrupted = True
+            import ctypes
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(self._thread_id), ctypes.py_object(exc_type)
+            )
+
+    def stop(self):
+        """
+        Stop watching; called by the watched thread. The exception raised
+        meanwhile, if any, is discarded; the peak of the traced memory is
+        then checked.
+        """
+        while True:
+            try:
+                with self._lock:
+                    self._stopped.set()
+                    if self.tripped:
+                        # Discard the exception if it has not been raised yet
+                        import ctypes
+                        ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                            ctypes.c_ulong(self._thread_id), None
+                        )
+                break
+            except (TimeLimitExceeded, MemoryLimitExceeded):
+                pass  # raised once at most: stop again
+        if self._check_peak and not self.tripped:
+            import tracemalloc
+            if (tracemalloc.is_tracing()
+                    and tracemalloc.get_traced_memory()[1] - self._baseline
+                    > self.memory_limit):
+                self.tripped = self._memory_reason()
+
+
+class ExecConsole(InteractiveConsole):
+    """
+    Console that tries eval first, then exec, to handle expressions properly.
+
+    Each push is measured: the CommandStats of the last pushes are kept
+    in 'stats' (the most recent one is 'last_stats'). Peak allocations are
+    traced with tracemalloc when 'trace_memory' is set. Setting
+    'profile_next' runs the next push under cProfile and stores the
+    resulting pstats.Stats in 'last_profile'.
+
+    A Watchdog interrupts a push running for longer than 'time_limit'
+    seconds or allocating more than 'memory_limit' bytes (traced with
+    tracemalloc); the exceeded limit is reported on stderr and the
+    namespace is kept.
+
+    Code objects are kept in an LRU cache of code_cache_size entries,
+    keyed by source, mode and __future__ flags, which also remembers
+    the sources that are not expressions: a command run again is not
+    compiled again.
+
+    Commands may use 'await' at top level. Their coroutine runs on a
+    persistent event loop ('loop'): to completion within the push, or,
+    with 'await_in_background' set, as a task listed in 'tasks' while
+    push returns at once. The owner then calls run_pending()
+    periodically, which runs the loop and returns the completed tasks,
+    so that several awaited commands overlap.
+
+    complete() returns the completions of a dotted name through a
+    Completer, whose cache is invalidated after each push.
+
+    'failed' is set when the last push raised an exception (including a
+    syntax error or an exceeded limit); warnings and other text written
+    to stderr do not set it.
+    """
+    def __init__(self, locals=None, filename="<console>", max_stats=100,
+                 time_limit=None, memory_limit=None, code_cache_size=256):
+        super().__init__(locals=locals, filename=filename)
+        self.compile.compiler.flags |= ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+        self.await_in_background = False
+        self.tasks = []  # (source, concurrent.futures.Future) of the awaited commands
+        self._loop = None
+        self._source = None
+        self.completer = Completer(self.locals)
+        self.code_cache_size = code_cache_size
+        self._code_cache = OrderedDict()
+        self.stats = deque(maxlen=max_stats)
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.trace_memory = False
+        self.profile_next = False
+        self.last_profile = None
+        self.failed = False
+
+    @property
+    def last_stats(self):
+        return self.stats[-1] if self.stats else None
+
+    @property
+    def loop(self):
+        """Event loop of the awaited commands, created on first use."""
+        if self._loop is None:
+            import asyncio
+            self._loop = asyncio.new_event_loop()
+        return self._loop
+
+    def _await(self, coro):
+        """Run the coroutine of a command with top-level await."""
+        if not self.await_in_background:
+            return self.loop.run_until_complete(coro)
+        import asyncio
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        self.tasks.append((self._source, future))
+        return None
+
+    def run_pending(self, time_slice=0.01):
+        """
+        Run the event loop until its tasks are done or for time_slice
+        seconds, waiting meanwhile for the I/O and timers of the tasks;
+        return the (source, future) tuples of the tasks completed.
+        """
+        import asyncio
+        loop = self.loop
+        deadline = time.perf_counter() + time_slice
+        # One iteration runs the callbacks scheduled from outside the
+        # loop, e.g. the creation of the tasks of the commands
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+        tasks = asyncio.all_tasks(loop)
+        remaining = deadline - time.perf_counter()
+        if tasks and remaining > 0:
+            loop.run_until_complete(asyncio.wait(tasks, timeout=remaining))
+        done = [task for task in self.tasks if task[1].done()]
+        if done:
+            self.tasks = [task for task in self.tasks if not task[1].done()]
+            self.completer.invalidate()
+        return done
+
+    def complete(self, text):
+        """Return the completions of a dotted name over the namespace."""
+        return self.completer.complete(text)
+
+    def runcode(self, code):
+        """InteractiveConsole.runcode, also running code with top-level await."""
+        if not code.co_flags & _CO_COROUTINE:
+            return super().runcode(code)
+        try:
+            self._await(eval(code, self.locals))
+        except SystemExit:
+            raise
+        except BaseException:
+            self.showtraceback()
+
+    def showtraceback(self):
+        self.failed = True
+        super().showtraceback()
+
+    def showsyntaxerror(self, *args, **kwargs):
+        self.failed = True
+        super().showsyntaxerror(*args, **kwargs)
+
+    def push(self, source):
+        self._source = source
+        self.failed = False
+        profiler = None
+        if self.profile_next:
+            self.profile_next = False
+            import cProfile
+            profiler = cProfile.Profile()
+        # Tracing can only be on if tracemalloc was imported
+        tracemalloc = sys.modules.get('tracemalloc')
+        if self.trace_memory or self.memory_limit:
+            import tracemalloc
+        tracing = tracemalloc is not None and tracemalloc.is_tracing()
+        start_tracing = (self.trace_memory or self.memory_limit) and not tracing
+        if start_tracing:
+            tracemalloc.start()
+        elif tracing and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        watchdog = None
+        wall_time = time.perf_counter()
+        cpu_time = time.thread_time()
+        try:
+            try:
+                if self.time_limit is not None or self.memory_limit:
+                    watchdog = Watchdog(self.time_limit, self.memory_limit)
+                if profiler is None:
+                    return self._push(source)
+                profiler.enable()
+                try:
+                    return self._push(source)
+                finally:
+                    profiler.disable()
+            finally:
+                if watchdog is not None:
+                    watchdog.stop()
+        except (TimeLimitExceeded, MemoryLimitExceeded):
+            # Raised after the code of the command had completed
+            self.failed = True
+            self.resetbuffer()
+            return False
+        finally:
+            self.completer.invalidate()
+            if watchdog is not None:
+                if watchdog.tripped:
+                    self.failed = True
+                    self.write("Command %s: %s\n" % (
+                        "interrupted" if watchdog.interrupted else "completed",
+                        watchdog.tripped))
+            wall_time = time.perf_counter() - wall_time
+            cpu_time = time.thread_time() - cpu_time
+            peak_memory = None
+            if tracemalloc is not None and tracemalloc.is_tracing():
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                if start_tracing:
+                    tracemalloc.stop()
+            self.stats.append(
+                CommandStats(source, wall_time, cpu_time, peak_memory)
+            )
+            if profiler is not None:
+                import pstats
+                self.last_profile = pstats.Stats(profiler)
+
+    def _compile(self, source, filename, symbol):
+        """
+        Compile through the cache. Returns None for an incomplete command
+        and, in "eval" mode, _NOT_AN_EXPRESSION for statements.
+        """
+        key = (source, symbol, self.compile.compiler.flags)
+        code = self._code_cache.get(key, _NOT_CACHED)
+        if code is not _NOT_CACHED:
+            self._code_cache.move_to_end(key)
+            return code
+        if symbol == "eval":
+            try:
+                code = compile(source, filename, "eval", key[2], True)
+            except (OverflowError, SyntaxError, ValueError):
+                code = _NOT_AN_EXPRESSION
+        else:
+            # Errors are not cached: the traceback must be shown again
+            code = self.compile(source, filename, symbol)
+        self._code_cache[key] = code
+        if len(self._code_cache) > self.code_cache_size:
+            self._code_cache.popitem(last=False)
+        return code
+
+    def runsource(self, source, filename="<input>", symbol="single"):
+        """InteractiveConsole.runsource, compiling through the cache."""
+        try:
+            code = self._compile(source, filename, symbol)
+        except (OverflowError, SyntaxError, ValueError):
+            self.showsyntaxerror(filename)
+            return False
+        if code is None:
+            return True  # incomplete command
+        self.runcode(code)
+        return False
+
+    def _push(self, source):
+        # Try to compile as eval first (for expressions)
+        code_obj = self._compile(source, "<console>", "eval")
+        if code_obj is _NOT_AN_EXPRESSION:
+            # Not a valid expression, try as exec (statements)
+            # Clear the last result since we're executing a statement, not an expression
+            self._last_result = None
+            return self.runsource(source, filename="<console>", symbol="exec")
+        try:
+            # We have an expression - execute it and return the result
+            result = eval(code_obj, self.locals)
+            if code_obj.co_flags & _CO_COROUTINE:
+                result = self._await(result)
+            if result is not None:
+                # Store the result for retrieval
+                self._last_result = result
+                return False  # Command is complete
+            else:
+                self._last_result = None
+                return False  # Command is complete
+        except KeyboardInterrupt as e:
+            # Interrupted, e.g., by the watchdog
+            self._last_result = None
+            self.failed = True
+            self.write("%s\n" % type(e).__name__)
+            return False
+        except Exception as e:
+            # Other errors (runtime errors)
+            self._last_result = None  # Clear result on error
+            self.failed = True
+            print(str(e) or type(e).__name__, file=sys.stderr)
+            return False  # Command is complete
+            
+    def get_last_result(self):
+        """Get the result of the last expression evaluation."""
+        return getattr(self, '_last_result', None)
@@ -0,0 +1,265 @@
+import builtins
+import reprlib
+import time
+from collections import deque
+from collections.abc import Mapping, Sequence
+from itertools import islice
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+# Types with a bounded representation, also used for their subclasses
+# which do not override __repr__
+_BOUNDED_TYPES = (
+    str, bytes, bytearray, int, tuple, list, dict, set, frozenset, deque
+)
+
+
+# Containers whose subclasses overriding __repr__ are bounded by their items
+_CONTAINER_TYPES = (tuple, list, dict, set, frozenset, deque)
+
+
+class BoundedRepr(reprlib.Repr):
+    """
+    reprlib.Repr with the same limit for all container types, a time
+    budget, and a 'truncated' flag telling whether anything was elided.
+
+    Only a slice of strings and bytes is converted, so that their size
+    does not matter; the same holds for the subclasses of the builtin
+    types which do not override __repr__. The subclasses of the builtin
+    containers which override it (e.g., OrderedDict, Counter,
+    defaultdict, named tuples), and the mappings and sequences defined
+    in Python with more items than the limit, are represented by their
+    first items, in iteration order, within their type name, e.g.
+    "OrderedDict({'a': 1, ...})", without calling their __repr__. The
+    representation of other objects is built by their __repr__ and then
+    truncated.
+    """
+    def __init__(self, max_items=100, max_depth=6, max_string=1000,
+                 time_budget=0.25):
+        super().__init__()
+        self.maxlevel = max_depth
+        self.maxtuple = self.maxlist = self.maxarray = max_items
+        self.maxdict = self.maxset = self.maxfrozenset = max_items
+        self.maxdeque = max_items
+        self.maxstring = self.maxlong = self.maxother = max_string
+        self.time_budget = time_budget
+        self.truncated = False
+        self._deadline = None
+
+    def repr(self, x):
+        """Return the bounded representation, or None if out of time."""
+        self.truncated = False
+        self._deadline = time.monotonic() + self.time_budget
+        try:
+            return super().repr(x)
+        except _OutOfTime:
+            self.truncated = True
+            return None
+
+    def repr1(self, x, level):
+        if time.monotonic() > self._deadline:
+            raise _OutOfTime
+        return super().repr1(x, level)
+
+    def _repr_iterable(self, x, level, left, right, maxiter, trail=''):
+        if len(x) > maxiter or (level <= 0 and len(x)):
+            self.truncated = True
+        return super()._repr_iterable(x, level, left, right, maxiter, trail)
+
+    def repr_dict(self, x, level):
+        if len(x) > self.maxdict or (level <= 0 and len(x)):
+            self.truncated = True
+        return super().repr_dict(x, level)
+
+    def repr_str(self, x, level):
+        if len(x) > self.maxstring:
+            self.truncated = True
+        return super().repr_str(x, level)
+
+    def _repr_text(self, x, limit):
+        """Representation of str, bytes or bytearray, of a slice of x."""
+        text = builtins.repr(x[:limit])
+        if len(text) > limit:
+            self.truncated = True
+            i = max(0, (limit - 3) // 2)
+            j = max(0, limit - 3 - i)
+            text = builtins.repr(x[:i] + x[len(x) - j:])
+            text = text[:i] + '...' + text[len(text) - j:]
+        return text
+
+    def repr_bytes(self, x, level):
+        return self._repr_text(x, self.maxstring)
+
+    repr_bytearray = repr_bytes
+
+    def repr_memoryview(self, x, level):
+        return builtins.repr(x)  # without the content: its size does not matter
+
+    def repr_int(self, x, level):
+        try:
+            text = super().repr_int(x, level)
+        except ValueError:  # too many digits for a string conversion
+            return '<int of %d bits>' % x.bit_length()
+        if '...' in text:
+            self.truncated = True
+        return text
+
+    def _repr_items(self, items, size, level, left, right):
+        """Bounded representation of the first of size items (strings)."""
+        if not size:
+            return left + right
+        if level <= 0:
+            self.truncated = True
+            return left + '...' + right
+        parts = list(islice(items, self.maxlist))
+        if size > len(parts):
+            self.truncated = True
+            parts.append('...')
+        return left + ', '.join(parts) + right
+
+    def _repr_container(self, x, level):
+        """
+        Bounded representation of a mapping or of another collection,
+        as its type name followed by its first items.
+        """
+        name = type(x).__name__
+        if isinstance(x, Mapping):
+            items = ('%s: %s' % (self.repr1(key, level - 1),
+                                 self.repr1(value, level - 1))
+                     for key, value in x.items())
+            return name + self._repr_items(items, len(x), level, '({', '})')
+        if isinstance(x, tuple) and hasattr(x, '_fields'):  # named tuple
+            items = ('%s=%s' % (field, self.repr1(value, level - 1))
+                     for field, value in zip(x._fields, x))
+            return name + self._repr_items(items, len(x), level, '(', ')')
+        items = (self.repr1(item, level - 1) for item in x)
+        left, right = (
+            ('({', '})') if isinstance(x, (set, frozenset)) else
+            ('((', '))') if isinstance(x, tuple) else ('([', '])'))
+        return name + self._repr_items(items, len(x), level, left, right)
+
+    def repr_instance(self, x, level):
+        cls = type(x)
+        for base in cls.__mro__[1:]:
+            if base in _BOUNDED_TYPES and base.__repr__ is cls.__repr__:
+                return getattr(self, 'repr_' + base.__name__)(x, level)
+        if isinstance(x, _CONTAINER_TYPES) or (
+                isinstance(x, (Mapping, Sequence))
+                and cls.__module__ != 'builtins'
+                and len(x) > self.maxlist):
+            # Rather than the overridden __repr__ of all the items
+            return self._repr_container(x, level)
+        if isinstance(x, (str, bytes, bytearray)) and len(x) > self.maxother:
+            # Rather than the overridden __repr__ of the whole text
+            return self._repr_text(x, self.maxother)
+        text = super().repr_instance(x, level)
+        if len(text) >= self.maxother and '...' in text:
+            self.truncated = True
+        return text
+
+
+class ResultPager:
+    """
+    Renders the further pages of a truncated result, on demand: the
+    items of containers (one per line), or chunks of the text of strings
+    and of other objects.
+    """
+    def __init__(self, obj, formatter, offset=0):
+        self.obj = obj
+        self.formatter = formatter
+        self.offset = offset  # items or characters already shown
+        self._text = None
+
+    def next_page(self):
+        """Return the text of the next page and whether more pages follow."""
+        formatter = self.formatter
+        obj = self.obj
+        size = formatter.page_items
+        if isinstance(obj, (str, bytes, bytearray)):
+            return self._text_page(obj)
+        if isinstance(obj, Mapping):
+            items = islice(obj.items(), self.offset, self.offset + size)
+            lines = ['%s: %s' % (formatter.short(k), formatter.short(v))
+                     for k, v in items]
+        elif hasattr(obj, '__len__') and hasattr(obj, '__iter__'):
+            items = islice(iter(obj), self.offset, self.offset + size)
+            lines = ['[%d] %s' % (i, formatter.short(item))
+                     for i, item in enumerate(items, self.offset)]
+        else:
+            if self._text is None:
+                self._text = repr(obj)
+            return self._text_page(self._text)
+        self.offset += len(lines)
+        return '\n'.join(lines), self.offset < len(obj)
+
+    def _text_page(self, text):
+        end = self.offset + self.formatter.page_chars
+        page = text[self.offset:end]
+        if not isinstance(page, str):
+            page = repr(page)
+        self.offset = end
+        return page, end < len(text)
+
+
+class RemoteResult:
+    """
+    Result of an expression evaluated by another process (the kernel),
+    formatted there: its text, and the pager of its further pages if it
+    was truncated, shown as they are.
+    """
+    def __init__(self, text, pager=None):
+        self.text = text
+        self.pager = pager
+
+    def __repr__(self):
+        return self.text
+
+
+class ResultFormatter:
+    """
+    Formats expression results within length, depth, size and time
+    budgets. format() returns the text and a ResultPager when anything
+    was left out, None otherwise.
+    """
+    def __init__(self, max_items=100, max_depth=6, max_string=1000,
+                 max_chars=20000, time_budget=0.25):
+        self.max_chars = max_chars
+        self.page_items = max_items
+        self.page_chars = max_chars
+        self._repr = BoundedRepr(max_items, max_depth, max_string, time_budget)
+        self._short = BoundedRepr(
+            max(max_items // 10, 4), 2, max(max_string // 10, 40), time_budget)
+
+    def short(self, obj):
+        """Compact representation of an item shown in a page."""
+        text = self._short.repr(obj)
+        return '<...>' if text is None else text
+
+    def format(self, obj):
+        if isinstance(obj, RemoteResult):
+            return obj.text, obj.pager
+        try:
+            text = self._repr.repr(obj)
+        except Exception as e:
+            return '<%s object: repr() failed with %s: %s>' % (
+                type(obj).__name__, type(e).__name__, e), None
+        truncated = self._repr.truncated
+        if text is None:
+            size = ' of %d items' % len(obj) if hasattr(obj, '__len__') else ''
+            text = '<%s%s: representation interrupted after %.2f s>' % (
+                type(obj).__name__, size, self._repr.time_budget)
+        over_budget = len(text) > self.max_chars
+        if over_budget:
+            text = text[:self.max_chars] + '...'
+            truncated = True
+        if not truncated:
+            return text, None
+        offset = 0
+        if (isinstance(obj, Sequence) and not over_budget
+                and not isinstance(obj, (str, bytes, bytearray))
+                and len(obj) > self.page_items):
+            offset = self.page_items  # continue after the items shown
+        return text, ResultPager(obj, self, offset)
@@ -0,0 +1,58 @@
+import io
+import keyword
+import builtins
+import tokenize
+
+SYNTAX_TAGS = (
+    "syn_keyword", "syn_builtin", "syn_definition",
+    "syn_string", "syn_comment", "syn_number"
+)
+
+_BUILTINS = frozenset(dir(builtins))
+_STRING_TOKENS = frozenset(
+    getattr(tokenize, name) for name in
+    ("STRING", "FSTRING_START", "FSTRING_MIDDLE", "FSTRING_END")
+    if hasattr(tokenize, name)
+)
+
+
+def syntax_spans(lines):
+    """
+    Tokenize the lines of code and return, for each line, the list of
+    (tag, start_column, end_column) spans to highlight. Incomplete code
+    (e.g., an open string or bracket) is highlighted up to the error.
+    """
+    spans = [[] for _ in lines]
+    readline = io.StringIO('\n'.join(lines) + '\n').readline
+    after_def = False
+    try:
+        for token in tokenize.generate_tokens(readline):
+            tag = None
+            if token.type == tokenize.NAME:
+                if after_def:
+                    tag = "syn_definition"
+                elif keyword.iskeyword(token.string):
+                    tag = "syn_keyword"
+                elif token.string in _BUILTINS:
+                    tag = "syn_builtin"
+                after_def = token.string in ("def", "class")
+            elif token.type in _STRING_TOKENS:
+                tag = "syn_string"
+            elif token.type == tokenize.COMMENT:
+                tag = "syn_comment"
+            elif token.type == tokenize.NUMBER:
+                tag = "syn_number"
+            if tag is None:
+                continue
+            (start_row, start_col), (end_row, end_col) = token.start, token.end
+            for row in range(start_row, min(end_row, len(lines)) + 1):
+                line_spans = spans[row - 1]
+                start = start_col if row == start_row else 0
+                end = end_col if row == end_row else len(lines[row - 1])
+                if line_spans and line_spans[-1][0] == tag and line_spans[-1][2] == start:
+                    line_spans[-1] = (tag, line_spans[-1][1], end)
+                else:
+                    line_spans.append((tag, start, end))
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return spans
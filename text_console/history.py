@@ -1,44 +1,1094 @@
 import os
-import pickle
+import re
+import mmap
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from collections.abc import MutableSequence
+from contextlib import contextmanager
 
-class History(list):
-    def __init__(self, history_file=".console_history"):
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MAGIC = b"TCHIST1\n"
+APPEND = b"A"  # payload: UTF-8 command text
+DELETE = b"D"  # payload: offset of the deleted append record
+IDENTITY = b"I"  # payload: random token, first record of a new journal
+_RECORD = struct.Struct(">cII")  # kind, payload length, CRC-32 of payload
+_TOKEN_SIZE = 8
+_OFFSET = struct.Struct(">Q")
+SEARCH_MODES = ("substring", "word", "regex")
+# Prefixes whose commands are kept ordered by sequence number for recall
+_RECALL_BUCKETS = 4
+
+
+def _record(kind, payload):
+    return _RECORD.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+
+def _header():
+    """Start of a new journal, identified by a random token."""
+    return MAGIC + _record(IDENTITY, os.urandom(_TOKEN_SIZE))
+
+
+def _token(header):
+    """Return the token identifying a journal from its first bytes, or None."""
+    start = len(MAGIC) + _RECORD.size
+    if header[len(MAGIC):len(MAGIC) + 1] != IDENTITY:
+        return None
+    return bytes(header[start:start + _TOKEN_SIZE])
+
+
+def _decode(data, offset):
+    """Return the command of the append record at offset of data."""
+    _, length, _ = _RECORD.unpack_from(data, offset)
+    start = offset + _RECORD.size
+    return str(data[start:start + length], "utf-8")
+
+
+def _copy_records(data, offsets, f):
+    """
+    Write to f a new journal with the append records at the ascending
+    offsets of data, copied without decoding them; return their offsets
+    in the new journal.
+    """
+    header = _header()
+    f.write(header)
+    pos = len(header)
+    new_offsets = array("q")
+    for offset in offsets:
+        _, length, _ = _RECORD.unpack_from(data, offset)
+        size = _RECORD.size + length
+        f.write(data[offset:offset + size])
+        new_offsets.append(pos)
+        pos += size
+    return new_offsets
+
+
+def _remap(offsets, old, new):
+    """
+    Map the offsets found in the ascending array old to the corresponding
+    ones of new, dropping the others.
+    """
+    result = array("q")
+    for offset in offsets:
+        i = bisect_left(old, offset)
+        if i < len(old) and old[i] == offset:
+            result.append(new[i])
+    return result
+
+
+def compile_search(pattern, mode="substring"):
+    """
+    Return the case-insensitive regular expression searching pattern
+    with one of the SEARCH_MODES; raises re.error for invalid regexes.
+    """
+    if mode == "regex":
+        return re.compile(pattern, re.IGNORECASE)
+    expr = re.escape(pattern)
+    if mode == "word":
+        expr = r"\b%s\b" % expr
+    return re.compile(expr, re.IGNORECASE)
+
+
+def _bisect(n, before):
+    """
+    Return the first i in range(n) for which before(i) is false, before
+    being true for all the preceding ones.
+    """
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if before(mid):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+# Characters other than their case variants matched by these ASCII
+# letters in a case-insensitive str regex
+_CASE_EXTRA = {"i": "\u0130\u0131", "k": "\u212a", "s": "\u017f"}
+
+
+def _journal_search(pattern, mode):
+    """
+    Return a bytes regex finding in the journal at least the records of
+    the commands matched by compile_search(pattern, mode), or None if
+    there is none (regular expressions and non-ASCII patterns).
+    """
+    if mode == "regex" or not pattern or not pattern.isascii():
+        return None
+    parts = []
+    for char in pattern:
+        expr = re.escape(char.encode("ascii"))
+        extra = _CASE_EXTRA.get(char.lower())
+        if extra:
+            expr = b"(?:%s)" % b"|".join(
+                [expr] + [e.encode("utf-8") for e in extra])
+        parts.append(expr)
+    # Words: "\b" differs for non-ASCII characters, matches are checked
+    return re.compile(b"".join(parts), re.IGNORECASE)
+
+
+class _PrefixIndex:
+    """
+    Sequence numbers of the commands sorted by their UTF-8 text (which
+    has the order of the strings), then by sequence number: the commands
+    starting with a prefix, of any length, are a range found by
+    bisection, decoding O(log n) commands. Only the sequence numbers are
+    kept.
+
+    The sequence numbers of the commands starting with the last
+    _RECALL_BUCKETS prefixes recalled are also kept in ascending order
+    (a bucket), so that the command before or after an entry is found by
+    bisection: building a bucket takes O(k log k) for k commands, then
+    the recalls with its prefix take O(log k). The buckets are updated
+    with the index.
+    """
+    def __init__(self, history):
+        self._history = history
+        order = sorted(range(len(history._seqs)), key=history._raw)
+        self._seqs = array("q", (history._seqs[i] for i in order))
+        self._buckets = OrderedDict()  # prefix bytes -> ascending seqs
+
+    def _raw(self, i):
+        history = self._history
+        return history._raw(history._position(self._seqs[i]))
+
+    def _find(self, seq, position):
+        key = (self._history._raw(position), seq)
+        return _bisect(len(self._seqs), lambda i: (self._raw(i), self._seqs[i]) < key)
+
+    def add(self, seq, position):
+        self._seqs.insert(self._find(seq, position), seq)
+        raw = self._history._raw(position)
+        for prefix, bucket in self._buckets.items():
+            if raw.startswith(prefix):
+                insort(bucket, seq)  # an append: new entries come last
+
+    def remove(self, seq, position):
+        del self._seqs[self._find(seq, position)]
+        for bucket in self._buckets.values():
+            i = bisect_left(bucket, seq)
+            if i < len(bucket) and bucket[i] == seq:
+                del bucket[i]
+
+    def candidates(self, prefix):
+        """
+        Ascending sequence numbers of the commands starting with prefix
+        (the bucket of the prefix, not to be modified).
+        """
+        prefix = prefix.encode("utf-8")
+        bucket = self._buckets.get(prefix)
+        if bucket is not None:
+            self._buckets.move_to_end(prefix)
+            return bucket
+        size = len(prefix)
+        start = _bisect(len(self._seqs), lambda i: self._raw(i)[:size] < prefix)
+        end = _bisect(len(self._seqs), lambda i: self._raw(i)[:size] <= prefix)
+        bucket = self._buckets[prefix] = array("q", sorted(self._seqs[start:end]))
+        if len(self._buckets) > _RECALL_BUCKETS:
+            self._buckets.popitem(last=False)
+        return bucket
+
+
+class _TextIndex:
+    """
+    Sorted keys combining the CRC-32 of each command (the one of its
+    journal record) and its sequence number, so that the commands which
+    may be equal to a text are found by bisection without decoding any.
+    A match must be checked against the entry (the CRC-32 of different
+    commands can be the same).
+    """
+    def __init__(self, history):
+        self._history = history
+        self._keys = array("Q", sorted(
+            history._crc(i) << 32 | seq for i, seq in enumerate(history._seqs)))
+
+    def add(self, seq, position):
+        insort(self._keys, self._history._crc(position) << 32 | seq)
+
+    def remove(self, seq, position):
+        key = self._history._crc(position) << 32 | seq
+        del self._keys[bisect_left(self._keys, key)]
+
+    def get(self, text):
+        """Sequence numbers of the commands with the CRC-32 of text."""
+        crc = zlib.crc32(text.encode("utf-8"))
+        start = bisect_left(self._keys, crc << 32)
+        end = bisect_left(self._keys, (crc + 1) << 32)
+        return [key & 0xFFFFFFFF for key in self._keys[start:end]]
+
+
+class History(MutableSequence):
+    """
+    List of commands persisted to an append-only journal file. It is a
+    MutableSequence, not a list subclass: list(history) copies the
+    commands to a list.
+
+    Each appended command is written as a framed record and each deletion
+    as a tombstone record referencing the deleted one, so save() only
+    writes what changed since the previous call. When tombstones and
+    deleted records exceed compact_ratio of the file, the journal is
+    rewritten by a background thread. fsync_interval is the minimum time
+    in seconds between two fsync calls after a save (0 syncs every save,
+    None leaves flushing to the operating system). Files written in the
+    previous pickle (holding a list of strings only, no other objects are
+    unpickled) or line-based formats are converted on loading.
+
+    The journal is memory-mapped (read into memory on Windows, where a
+    mapped file cannot be replaced): loading only checks the records and
+    collects the offsets of the commands, which are decoded when accessed
+    and not kept, so memory use does not grow with the history size but
+    for the offset and the sequence number of each entry. Only the
+    commands not yet saved are held as strings.
+
+    With deduplicate, appending a command already in the history moves it
+    to the end (found through a hash index) instead of storing it again.
+    With max_size, appending beyond that number of entries evicts the
+    least recently used ones, i.e., the first ones. Both are applied
+    incrementally by append() and written to the journal as tombstones;
+    a history file exceeding them is trimmed on loading.
+
+    With load_in_background, the history file is read by a background
+    thread: until the 'loaded' event is set, the history only holds the
+    commands appended meanwhile, which then follow the loaded ones, and
+    save() and refresh() do nothing. If the file cannot be loaded (e.g.,
+    an undecodable legacy file), save() and close() raise the error of
+    the load instead of writing to it.
+
+    Several instances, also in different processes, can share the same
+    history file. Writes are serialized by an exclusive lock on a .lock
+    file beside it; before writing, save() merges the records appended by
+    the other instances since its last read, reading from that offset
+    only, so that no command is lost (refresh() merges them without
+    writing). When the file was replaced by the compaction of another
+    instance, it is reloaded. Changes that cannot be journaled (assigned
+    or inserted entries) rewrite the file with the entries of this
+    instance.
+
+    Each entry has a sequence number, increasing in list order, which
+    identifies it in the indexes built on first use and updated
+    incrementally: the prefix index of find_previous() and find_next()
+    and, with deduplicate, the index of the CRC-32 of the commands. They
+    keep 8 bytes per entry, not the commands. search() deliberately has
+    no index, since an index of the substrings would hold several times
+    the text of the commands: it scans the journal, in O(journal size).
+
+    The journal is never truncated in place, which would kill the
+    processes reading beyond the end of their mapping (SIGBUS); if
+    another program truncates it, this is detected by a stat call before
+    reading, the lost entries are dropped and the journal is rewritten.
+    """
+    def __init__(
+            self,
+            history_file=".console_history",
+            fsync_interval=5.0,
+            compact_ratio=0.5,
+            compact_min_records=1000,
+            max_size=None,
+            deduplicate=False,
+            load_in_background=False):
         super().__init__()
         self.history_file = history_file
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_records = compact_min_records
+        self.max_size = max_size
+        self.deduplicate = deduplicate
+        self._data = b""  # mapped journal
+        self._offsets = array("q")  # journal offset of each saved entry
+        self._unsaved = []  # commands of the trailing entries not yet written
+        self._seqs = array("q")  # sequence number of each entry
+        self._next_seq = 0
+        self._indexes = {}  # name -> index object, built on first use
+        self.version = 0  # incremented on every change of the entries
+        self._pending_deletes = []  # journal offsets of deleted, saved entries
+        self._dead = 0  # deleted records and tombstones in the journal
+        self._rewrite = False  # the journal cannot express the changes
+        self._compacting = False
+        self._compactor = None
+        self._last_fsync = 0.0
+        self._file_id = None  # (device, inode) of the journal last read
+        self._token = None  # token of the journal last read
+        self._read_offset = 0  # end of the last record read or written
+        self._load_error = None  # exception of the background load
+        self._lock = threading.RLock()
+        self.loaded = threading.Event()
+
+        if load_in_background and os.path.exists(self.history_file):
+            threading.Thread(target=self._load_in_background, daemon=True).start()
+        else:
+            self._load()
 
+    def _load(self):
         if os.path.exists(self.history_file):
+            with self._lock, self._file_lock():
+                with open(self.history_file, "rb") as f:
+                    magic = f.read(len(MAGIC))
+                    stat = os.fstat(f.fileno())
+                    if magic == MAGIC:
+                        self._map(f)
+                if magic == MAGIC:
+                    self._file_id = (stat.st_dev, stat.st_ino)
+                    self._token = _token(self._data)
+                    self._read_offset = self._replay(len(MAGIC))
+                    self._trim()
+                elif magic:
+                    self._invalidate_journal(self._load_legacy())
+                    self._trim()
+        self.loaded.set()
+        if self._rewrite:
+            self.save()
+
+    def _load_in_background(self):
+        """
+        Load the history file into another instance, without holding the
+        lock, then take over its entries, followed by the ones appended
+        meanwhile.
+        """
+        try:
+            loaded = History(
+                self.history_file,
+                fsync_interval=self.fsync_interval,
+                compact_ratio=self.compact_ratio,
+                compact_min_records=self.compact_min_records,
+                max_size=self.max_size,
+                deduplicate=self.deduplicate
+            )
+            loaded.close()  # saves its changes, e.g., a converted legacy file
+        except Exception as e:
+            # Raised by save(): writing would corrupt the unreadable file
+            self._load_error = e
+            self.loaded.set()
+            return
+        with self._lock:
+            appended = self._unsaved
+            for name in (
+                    "_data", "_offsets", "_unsaved", "_pending_deletes",
+                    "_dead", "_rewrite", "_file_id", "_token", "_read_offset"):
+                setattr(self, name, getattr(loaded, name))
+            # Numbered after the entries appended meanwhile
+            self._seqs = array("q", (self._next_seq + seq for seq in loaded._seqs))
+            self._next_seq += loaded._next_seq
+            self._indexes = {}
+            self.version += 1
+            self.loaded.set()
+            for text in appended:
+                self.append(text)
+            if appended:
+                self.save()
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Hold the exclusive lock shared by the instances using the history
+        file (not acquired if the lock file cannot be created).
+        """
+        try:
+            f = open(self.history_file + ".lock", "a+b")
+        except OSError:
+            yield
+            return
+        with f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _map(self, f):
+        """
+        Map the journal open as f, read-only; on Windows, where a mapped
+        file cannot be replaced, read it into memory instead.
+        """
+        if os.name == "nt":
+            f.seek(0)
+            self._data = bytearray(f.read())
+        elif os.fstat(f.fileno()).st_size:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    def _replay(self, pos):
+        """
+        Replay the records of the mapped journal from offset pos and return
+        the offset of their end, without decoding the commands. A torn
+        final record (from an interrupted write) is discarded.
+        """
+        end = len(self._data)
+        with memoryview(self._data) as view:
+            while pos + _RECORD.size <= end:
+                kind, length, crc = _RECORD.unpack_from(view, pos)
+                start = pos + _RECORD.size
+                if start + length > end:
+                    break
+                if zlib.crc32(view[start:start + length]) != crc:
+                    break
+                if kind == APPEND:
+                    self._add_entry(None, pos)
+                elif kind == DELETE:
+                    index = self._find_offset(_OFFSET.unpack_from(view, start)[0])
+                    if index is not None:
+                        self._remove_entry(index)
+                        self._dead += 1
+                    self._dead += 1
+                pos = start + length
+        if pos < end:
+            self._discard_torn_record(pos)
+        return pos
+
+    def _discard_torn_record(self, end):
+        """
+        Replace the journal with its records up to end (called with the
+        file lock held). It is not truncated in place: the instances
+        mapping it would be killed reading beyond its new end.
+        """
+        tmp_file = self._tmp_file()
+        with open(tmp_file, "wb") as f:
+            for start in range(0, end, 1 << 20):
+                f.write(self._data[start:min(start + (1 << 20), end)])
+        self._replace_journal(tmp_file)
+
+    def _check_mapping(self):
+        """
+        Map the journal again if another program truncated it, as reading
+        the mapping beyond the end of the file would kill the process
+        (SIGBUS) instead of raising an exception. The entries whose
+        records were lost are dropped, and the journal is rewritten by
+        the next save(). Costs a stat call; a replaced journal stays
+        mapped.
+        """
+        if not isinstance(self._data, mmap.mmap):
+            return
+        file_id, size = self._stat()
+        if file_id != self._file_id or size >= len(self._data):
+            return
+        with open(self.history_file, "rb") as f:
+            self._map(f)
+        data, offsets = self._data, self._offsets
+
+        def fits(i):
+            end = offsets[i] + _RECORD.size
+            return end <= len(data) and (
+                end + _RECORD.unpack_from(data, offsets[i])[1] <= len(data))
+
+        saved = len(offsets)
+        kept = _bisect(saved, fits)
+        del self._seqs[kept:saved]
+        del self._offsets[kept:]
+        self._indexes = {}
+        self.version += 1
+        self._read_offset = min(self._read_offset, len(data))
+        self._rewrite = True
+
+    def refresh(self):
+        """
+        Merge the commands saved to the history file by other instances
+        since the last read; returns True if the entries changed. Costs a
+        stat call and the read of the journal header when the file did not
+        change: a journal replaced by one of the same size may have reused
+        the inode of the previous one.
+        """
+        if not self.loaded.is_set() or self._changed() is None:
+            return False
+        with self._lock:
+            if self._compacting:
+                return False  # merged by the save() following it
+            with self._file_lock():
+                return self._refresh()
+
+    def _stat(self):
+        """Return the (device, inode) and the size of the history file."""
+        try:
+            stat = os.stat(self.history_file)
+        except FileNotFoundError:
+            return None, 0
+        return (stat.st_dev, stat.st_ino), stat.st_size
+
+    def _changed(self):
+        """
+        Return None if the journal did not change since the last read,
+        False if other instances appended to it, True if it was replaced.
+        """
+        file_id, size = self._stat()
+        if file_id != self._file_id or size < self._read_offset:
+            return True
+        if file_id is not None and self._token is not None:
+            with open(self.history_file, "rb") as f:
+                # The inode of a replaced journal may have been reused
+                if _token(f.read(len(_header()))) != self._token:
+                    return True
+        return False if size > self._read_offset else None
+
+    def _refresh(self):
+        """
+        Merge the records written by other instances (called with both
+        locks held). The new commands are placed before the unsaved ones,
+        which follow them in the file once written.
+        """
+        replaced = self._changed()
+        if replaced is None or replaced and self._rewrite:
+            return False  # unchanged, or overwritten by the pending rewrite
+        deleted = []
+        if replaced:
             try:
-                # Try loading pickled history (preferred)
                 with open(self.history_file, "rb") as f:
-                    data = pickle.load(f)
-                    # Ensure all entries are strings
-                    for entry in data:
-                        if not isinstance(entry, str):
-                            raise ValueError
-                    self.extend(data)
-            except Exception:
-                # Fallback: legacy line-by-line text file
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        txt = line.rstrip("\n")
-                        if txt:
-                            self.append(txt)
+                    if f.read(len(MAGIC)) not in (MAGIC, b""):
+                        return False
+            except FileNotFoundError:
+                pass
+            # The commands deleted here are deleted again (their last
+            # occurrence) from the new journal
+            deleted = [
+                _decode(self._data, offset) for offset in self._pending_deletes]
+        unsaved = list(self._unsaved)
+        for index in range(len(self._seqs) - 1, len(self._offsets) - 1, -1):
+            self._remove_entry(index)
+        file_id = None
+        self._data = b""
+        try:
+            with open(self.history_file, "rb") as f:
+                stat = os.fstat(f.fileno())
+                file_id = (stat.st_dev, stat.st_ino)
+                self._map(f)
+        except FileNotFoundError:
+            pass
+        self._file_id = file_id
+        if replaced:
+            self._offsets = array("q")
+            self._seqs = array("q")
+            self._indexes = {}
+            self._pending_deletes = []
+            self._dead = 0
+            self.version += 1
+            self._token = _token(self._data)
+            self._read_offset = 0
+            if self._data:
+                self._read_offset = self._replay(len(MAGIC))
+            for text in deleted:
+                for index in range(len(self._offsets) - 1, -1, -1):
+                    if self._text(index) == text:
+                        self._pending_deletes.append(self._remove_entry(index))
+                        break
+        else:
+            self._read_offset = self._replay(self._read_offset)
+        for text in unsaved:
+            self._add_entry(text)
+        self._trim()
+        return True
+
+    def _load_legacy(self):
+        """
+        Return the commands of a history file saved in the pickle or
+        line-based format.
+        """
+        import pickle
+
+        class Unpickler(pickle.Unpickler):
+            def find_class(self, module, name):
+                # A list of strings needs no global: refuse any object
+                raise pickle.UnpicklingError(
+                    "%s.%s not allowed in a history file" % (module, name))
 
-    def __getitem__(self, index):
         try:
-            return super().__getitem__(index)
-        except IndexError:
+            # Try loading pickled history (preferred)
+            with open(self.history_file, "rb") as f:
+                data = Unpickler(f).load()
+                # Ensure all entries are strings
+                if not isinstance(data, list):
+                    raise ValueError
+                for entry in data:
+                    if not isinstance(entry, str):
+                        raise ValueError
+                return data
+        except Exception:
+            # Fallback: legacy line-by-line text file
+            entries = []
+            with open(self.history_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    txt = line.rstrip("\n")
+                    if txt:
+                        entries.append(txt)
+            return entries
+
+    def _trim(self):
+        """
+        Drop the duplicates (keeping the last occurrence) and the oldest
+        entries exceeding max_size, in a single pass over the entries.
+        """
+        count = len(self._seqs)
+        if not self.deduplicate and (
+                self.max_size is None or count <= self.max_size):
+            return
+        keep = bytearray(b"\x01") * count
+        seen = {}  # CRC-32 of a command -> index of its last occurrence
+        kept = 0
+        for i in range(count - 1, -1, -1):
+            if self.deduplicate:
+                last = seen.setdefault(self._crc(i), i)
+                if last != i and self._raw(last) == self._raw(i):
+                    keep[i] = 0
+                    continue
+            kept += 1
+            if self.max_size is not None and kept > self.max_size:
+                keep[i] = 0
+        if all(keep):
+            return
+        saved = len(self._offsets)
+        self._pending_deletes.extend(
+            offset for offset, k in zip(self._offsets, keep) if not k)
+        self._offsets = array(
+            "q", (offset for offset, k in zip(self._offsets, keep) if k))
+        self._unsaved = [
+            text for text, k in zip(self._unsaved, keep[saved:]) if k]
+        self._seqs = array("q", (q for q, k in zip(self._seqs, keep) if k))
+        self._indexes = {}
+        self.version += 1
+
+    def _find_offset(self, offset):
+        """Return the index of the saved entry at the given offset."""
+        index = bisect_left(self._offsets, offset)
+        if index < len(self._offsets) and self._offsets[index] == offset:
+            return index
+        return None
+
+    def _text(self, index):
+        """Return the command of an entry (non-negative index)."""
+        saved = len(self._offsets)
+        if index >= saved:
+            return self._unsaved[index - saved]
+        return _decode(self._data, self._offsets[index])
+
+    def _raw(self, index):
+        """Return the UTF-8 text of an entry (non-negative index)."""
+        saved = len(self._offsets)
+        if index >= saved:
+            return self._unsaved[index - saved].encode("utf-8")
+        offset = self._offsets[index]
+        _, length, _ = _RECORD.unpack_from(self._data, offset)
+        start = offset + _RECORD.size
+        return self._data[start:start + length]
+
+    def _crc(self, index):
+        """Return the CRC-32 of the UTF-8 text of an entry (non-negative index)."""
+        saved = len(self._offsets)
+        if index >= saved:
+            return zlib.crc32(self._unsaved[index - saved].encode("utf-8"))
+        return _RECORD.unpack_from(self._data, self._offsets[index])[2]
+
+    def __len__(self):
+        return len(self._seqs)
+
+    def __iter__(self):
+        # Decoded in chunks, not holding the lock while the caller iterates
+        index = 0
+        while True:
+            with self._lock:
+                self._check_mapping()
+                texts = [
+                    self._text(i)
+                    for i in range(index, min(index + 1000, len(self._seqs)))]
+            if not texts:
+                return
+            yield from texts
+            index += len(texts)
+
+    def __contains__(self, item):
+        return any(text == item for text in self)
+
+    def __eq__(self, other):
+        if isinstance(other, History):
+            other = list(other)
+        return list(self) == other
+
+    def __repr__(self):
+        return "History(%r)" % list(self)
+
+    def __getitem__(self, index):
+        with self._lock:
+            self._check_mapping()
+            if isinstance(index, slice):
+                return [
+                    self._text(i)
+                    for i in range(*index.indices(len(self._seqs)))]
+            if index < 0:
+                index += len(self._seqs)
+            if not 0 <= index < len(self._seqs):
+                return None
+            return self._text(index)
+
+    def __setitem__(self, index, item):
+        with self._lock:
+            entries = list(self)
+            if isinstance(index, slice):
+                entries[index] = [self._as_text(i) for i in item]
+            else:
+                entries[index] = self._as_text(item)
+            self._invalidate_journal(entries)
+
+    def __delitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                for i in sorted(range(*index.indices(len(self))), reverse=True):
+                    del self[i]
+                return
+            if index < 0:
+                index += len(self._seqs)
+            if not 0 <= index < len(self._seqs):
+                raise IndexError("history index out of range")
+            offset = self._remove_entry(index)
+            if offset is not None:
+                self._pending_deletes.append(offset)
+
+    def insert(self, index, item):
+        with self._lock:
+            if index >= len(self._seqs):
+                self.append(item)
+                return
+            entries = list(self)
+            entries.insert(index, self._as_text(item))
+            self._invalidate_journal(entries)
+
+    def _invalidate_journal(self, entries):
+        """
+        The changes cannot be journaled: replace the entries with the
+        given commands, to be rewritten to a new file on next save.
+        """
+        self._offsets = array("q")
+        self._unsaved = entries
+        # New sequence numbers: they are never reused for another entry
+        self._seqs = array(
+            "q", range(self._next_seq, self._next_seq + len(entries)))
+        self._next_seq += len(entries)
+        self._indexes = {}
+        self.version += 1
+        self._pending_deletes = []
+        self._rewrite = True
+
+    def _add_entry(self, text, offset=None):
+        """
+        Add an entry, unsaved if offset is None, otherwise the saved one
+        at that journal offset (then text can be None).
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        if offset is None:
+            self._unsaved.append(text)
+        else:
+            self._offsets.append(offset)  # saved entries precede unsaved ones
+        self._seqs.append(seq)
+        self.version += 1
+        if self._indexes:
+            for index in self._indexes.values():
+                index.add(seq, len(self._seqs) - 1)
+
+    def _remove_entry(self, index):
+        """Remove an entry, returning its journal offset (None if unsaved)."""
+        for idx in self._indexes.values():
+            idx.remove(self._seqs[index], index)
+        del self._seqs[index]
+        self.version += 1
+        saved = len(self._offsets)
+        if index >= saved:
+            del self._unsaved[index - saved]
             return None
+        return self._offsets.pop(index)
 
-    def append(self, item):
+    def _index(self, name, factory):
+        """Return the named index, building it on first use."""
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = factory(self)
+        return index
+
+    def _position(self, seq):
+        """Return the list index of the entry with the given sequence number."""
+        return bisect_left(self._seqs, seq)
+
+    def find_previous(self, prefix, index):
+        """
+        Return the index of the last command before index starting with
+        prefix, or None. The prefix index finds the commands starting with
+        prefix without decoding them, and their sequence numbers, kept in
+        ascending order for the last prefixes recalled, are bisected with
+        the one of index: only the first recall with a prefix sorts them.
+        """
+        with self._lock:
+            if not prefix:
+                index = min(index, len(self._seqs)) - 1
+                return index if index >= 0 else None
+            self._check_mapping()
+            if index >= len(self._seqs):
+                limit = self._next_seq
+                index = len(self._seqs)
+            elif index < 0:
+                return None
+            else:
+                limit = self._seqs[index]
+            candidates = self._index("prefix", _PrefixIndex).candidates(prefix)
+            i = bisect_left(candidates, limit)
+            return self._position(candidates[i - 1]) if i else None
+
+    def search(self, pattern, mode="substring"):
+        """
+        Return the ascending indexes of the commands matching pattern
+        (case-insensitive) with one of the SEARCH_MODES. Except for
+        regular expressions and non-ASCII patterns, the journal is first
+        searched as bytes, and only the commands of the records found
+        are decoded and checked. Every call scans the whole journal, in
+        time proportional to its size: no index is kept, to keep the
+        memory use independent of the text of the commands.
+        """
+        regex = compile_search(pattern, mode)
+        journal_regex = _journal_search(pattern, mode)
+        with self._lock:
+            self._check_mapping()
+            if journal_regex is None:
+                positions = range(len(self._seqs))
+            else:
+                positions = self._search_journal(journal_regex)
+                positions.extend(range(len(self._offsets), len(self._seqs)))
+            return [i for i in positions if regex.search(self._text(i))]
+
+    def _search_journal(self, regex):
+        """Return the ascending indexes of the saved entries matching regex."""
+        data, offsets = self._data, self._offsets
+        positions = []
+        pos = offsets[0] if offsets else len(data)
+        while True:
+            match = regex.search(data, pos)
+            if match is None:
+                return positions
+            i = bisect_right(offsets, match.start()) - 1
+            _, length, _ = _RECORD.unpack_from(data, offsets[i])
+            start = offsets[i] + _RECORD.size
+            if start <= match.start() < start + length:
+                positions.append(i)
+                pos = start + length
+            else:  # in a header or in a deleted record
+                pos = match.start() + 1
+
+    def find_next(self, prefix, index):
+        """
+        Return the index of the first command after index starting with
+        prefix, or None, found as by find_previous().
+        """
+        with self._lock:
+            if index + 1 >= len(self._seqs):
+                return None
+            if not prefix:
+                return max(index + 1, 0)
+            self._check_mapping()
+            index = max(index, -1)
+            limit = self._seqs[index] if index >= 0 else -1
+            candidates = self._index("prefix", _PrefixIndex).candidates(prefix)
+            i = bisect_right(candidates, limit)
+            return self._position(candidates[i]) if i < len(candidates) else None
+
+    @staticmethod
+    def _as_text(item):
         # Convert lists to true multiline strings
         if isinstance(item, list):
-            item = "\n".join(item)
-        elif not isinstance(item, str):
-            item = str(item)
-        super().append(item)
+            return "\n".join(item)
+        if not isinstance(item, str):
+            return str(item)
+        return item
+
+    def append(self, item):
+        with self._lock:
+            text = self._as_text(item)
+            if self.deduplicate:
+                self._check_mapping()
+                for seq in self._index("text", _TextIndex).get(text):
+                    position = self._position(seq)
+                    if self._text(position) == text:
+                        del self[position]
+                        break
+            self._add_entry(text)
+            if self.max_size is not None:
+                excess = len(self._seqs) - self.max_size
+                if excess > 0:
+                    del self[:excess]
 
     def save(self):
-        # Pickle the list of strings so embedded newlines survive
-        with open(self.history_file, "wb") as f:
-            pickle.dump(list(self), f)
+        """
+        Write the changes made since the last call to the journal.
+        While a compaction is running, the changes are written by it;
+        while loading in background, they are written once loaded. If the
+        background load failed, its exception is raised and nothing is
+        written.
+        """
+        with self._lock:
+            if self._compacting or not self.loaded.is_set():
+                return
+            if self._load_error is not None:
+                raise self._load_error
+            with self._file_lock():
+                self._refresh()
+                if self._rewrite:
+                    self._rewrite_journal()
+                    return
+                if self._unsaved or self._pending_deletes:
+                    self._write_pending()
+            needs_compaction = (
+                self._dead >= self.compact_min_records
+                and self._dead > self.compact_ratio * (
+                    self._dead + len(self._seqs))
+            )
+        if needs_compaction:
+            self.compact(wait=False)
+
+    def _write_pending(self, path=None, size=None):
+        """Append the tombstones and the unsaved entries to the journal."""
+        path = path or self.history_file
+        if size is None:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+        chunks = [] if size else [_header()]
+        pos = size or len(chunks[0])
+        for offset in self._pending_deletes:
+            chunks.append(_record(DELETE, _OFFSET.pack(offset)))
+            pos += len(chunks[-1])
+        self._dead += 2 * len(self._pending_deletes)
+        offsets = array("q")
+        for text in self._unsaved:
+            chunks.append(_record(APPEND, text.encode("utf-8")))
+            offsets.append(pos)
+            pos += len(chunks[-1])
+        written = b"".join(chunks)
+        with open(path, "a+b") as f:
+            if size:
+                f.seek(0)
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError("%s is not a history journal" % path)
+            f.write(written)
+            self._sync(f)
+            if path == self.history_file:
+                stat = os.fstat(f.fileno())
+                self._file_id = (stat.st_dev, stat.st_ino)
+                if not size:
+                    self._token = _token(chunks[0])
+                self._read_offset = pos
+                if isinstance(self._data, bytearray) and len(self._data) == size:
+                    self._data += written  # journal read into memory
+                else:
+                    f.flush()
+                    self._map(f)
+        self._offsets.extend(offsets)
+        self._pending_deletes = []
+        self._unsaved = []
+
+    def _sync(self, f, force=False):
+        if self.fsync_interval is None and not force:
+            return
+        now = time.monotonic()
+        if force or now - self._last_fsync >= self.fsync_interval:
+            f.flush()
+            os.fsync(f.fileno())
+            self._last_fsync = now
+
+    def compact(self, wait=True):
+        """
+        Rewrite the journal with the live entries only.
+        With wait=False, the rewrite runs in a background thread.
+        """
+        self.loaded.wait()
+        with self._lock:
+            if self._compacting:
+                compactor = self._compactor
+            else:
+                self._compacting = True
+                compactor = threading.Thread(
+                    target=self._compact, daemon=True)
+                self._compactor = compactor
+                compactor.start()
+        if wait and compactor is not None:
+            compactor.join()
+
+    def _compact(self):
+        with self._lock:
+            data = self._data
+            offsets = array("q", self._offsets)
+        tmp_file = self._tmp_file()
+        try:
+            # Copy the saved records without holding the lock (the mapping
+            # of a replaced journal stays valid)
+            with open(tmp_file, "wb") as f:
+                new_offsets = _copy_records(data, offsets, f)
+                size = f.tell()
+            del data
+            # Add the changes made meanwhile, then replace the journal
+            with self._lock, self._file_lock():
+                if self._rewrite or self._changed() is not None:
+                    # The entries were assigned or other instances wrote
+                    # to the journal meanwhile: the snapshot is discarded
+                    # and the next save() (not this thread) updates them
+                    os.remove(tmp_file)
+                    return
+                if self._offsets == offsets:
+                    self._offsets = new_offsets
+                else:
+                    self._offsets = _remap(self._offsets, offsets, new_offsets)
+                self._pending_deletes = list(
+                    _remap(self._pending_deletes, offsets, new_offsets))
+                self._dead = 0
+                self._write_pending(tmp_file, size)
+                self._replace_journal(tmp_file)
+        finally:
+            with self._lock:
+                self._compacting = False
+                self._compactor = None
+
+    def _rewrite_journal(self):
+        """Write all entries to a new journal (called with the lock held)."""
+        tmp_file = self._tmp_file()
+        with open(tmp_file, "wb") as f:
+            self._offsets = _copy_records(self._data, self._offsets, f)
+            size = f.tell()
+        self._pending_deletes = []  # not copied
+        self._dead = 0
+        self._write_pending(tmp_file, size)
+        self._replace_journal(tmp_file)
+        self._rewrite = False
+
+    def _tmp_file(self):
+        """Name of the file rewritten by this instance, not shared with others."""
+        return "%s.%d-%x.tmp" % (self.history_file, os.getpid(), id(self))
+
+    def _replace_journal(self, tmp_file):
+        with open(tmp_file, "rb+") as f:
+            self._sync(f, force=True)
+            stat = os.fstat(f.fileno())
+            token = _token(f.read(len(_header())))
+            self._map(f)
+        os.replace(tmp_file, self.history_file)
+        self._file_id = (stat.st_dev, stat.st_ino)
+        self._token = token
+        self._read_offset = stat.st_size
+
+    def close(self):
+        """Wait for a running compaction and save the pending changes."""
+        self.loaded.wait()
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        self.save()
+        compactor = self._compactor  # started by save()
+        if compactor is not None:
+            compactor.join()
@@ -0,0 +1,348 @@
+import os
+import sys
+import queue
+import pstats
+import signal
+import _thread
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+
+from .console import ExecConsole
+from .display import ResultFormatter, RemoteResult
+from .stream import OutputBuffer, ConsoleStream
+
+
+class RemotePager:
+    """Pager of a truncated result kept by the kernel."""
+    def __init__(self, client, conn, pager_id):
+        self.client = client
+        self.conn = conn  # of the kernel keeping the result
+        self.pager_id = pager_id
+
+    def next_page(self):
+        """Return the text of the next page and whether more pages follow."""
+        return self.client.page(self.conn, self.pager_id)
+
+
+class KernelClient:
+    """
+    Runs the commands in a separate worker process (the kernel), so that
+    CPU-bound commands do not compete with the Tk event loop and a crash
+    does not take down the application.
+
+    The client has the interface of ExecConsole used by the console
+    widget. push() sends the command through a pipe and blocks until it
+    completes, writing the streamed output to sys.stdout and sys.stderr
+    of the caller, so it is meant to be called from a worker thread.
+    The kernel is started on first use and after a crash; interrupt()
+    raises KeyboardInterrupt in the running command and restart()
+    replaces the kernel with a new one, with a fresh namespace.
+
+    Results are formatted by the kernel with a ResultFormatter of
+    formatter_options: get_last_result() returns a RemoteResult, whose
+    further pages, if truncated, are requested to the kernel, which keeps
+    the last max_pagers truncated results.
+    """
+    def __init__(self, locals=None, filename="<console>", max_stats=100,
+                 formatter_options=None, time_limit=None, memory_limit=None,
+                 max_pagers=20):
+        self.initial_locals = dict(locals or {})  # must be picklable
+        self.filename = filename
+        self.formatter_options = formatter_options or {}
+        self.max_pagers = max_pagers
+        self.stats = deque(maxlen=max_stats)
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.trace_memory = False
+        self.profile_next = False
+        self.last_profile = None
+        self._last_result = None
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()  # protects _process and _conn
+        self._send_lock = threading.Lock()
+        # Forking a process running Tk is not safe
+        self._context = multiprocessing.get_context('spawn')
+
+    @property
+    def last_stats(self):
+        return self.stats[-1] if self.stats else None
+
+    @property
+    def pid(self):
+        process = self._process
+        return process.pid if process is not None else None
+
+    def start(self):
+        """Start the kernel if it is not running; return the connection."""
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                conn, child_conn = self._context.Pipe()
+                process = self._context.Process(
+                    target=_kernel_main,
+                    args=(child_conn, self.initial_locals, self.filename,
+                          self.formatter_options, self.max_pagers),
+                    name="text_console-kernel",
+                    daemon=True
+                )
+                process.start()
+                child_conn.close()
+                self._process, self._conn = process, conn
+            return self._conn
+
+    def _send(self, conn, message):
+        with self._send_lock:
+            conn.send(message)
+
+    def push(self, source):
+        conn = self.start()
+        options = {
+            'trace_memory': self.trace_memory,
+            'profile_next': self.profile_next,
+            'time_limit': self.time_limit,
+            'memory_limit': self.memory_limit
+        }
+        self.profile_next = False
+        self._last_result = None
+        try:
+            self._send(conn, ('push', source, options))
+            # Other messages, e.g., late replies to complete(), are skipped
+            while True:
+                message = conn.recv()
+                if message[0] == 'output':
+                    for tag, text in message[1]:
+                        stream = sys.stderr if tag == 'errors' else sys.stdout
+                        stream.write(text)
+                elif message[0] == 'done':
+                    break
+                elif message[0] == 'exit':
+                    self.close()
+                    raise SystemExit(message[1])
+        except (EOFError, OSError):
+            conn.close()
+            with self._lock:
+                crashed = conn is self._conn
+            if not crashed:
+                print("Kernel restarted", file=sys.stderr)
+                return False
+            exitcode = self._stop()
+            print(
+                "Kernel process terminated (exit code %s); a new one is"
+                " started by the next command" % exitcode,
+                file=sys.stderr
+            )
+            return False
+        _, more, result, stats, profile = message
+        if result is not None:
+            text, pager_id = result
+            pager = None
+            if pager_id is not None:
+                pager = RemotePager(self, conn, pager_id)
+            self._last_result = RemoteResult(text, pager)
+        if stats is not None:
+            self.stats.append(stats)
+        if profile is not None:
+            self.last_profile = pstats.Stats()
+            self.last_profile.stats = profile
+            self.last_profile.get_top_level_stats()
+        return more
+
+    def resetbuffer(self):
+        conn = self._conn
+        if conn is not None:
+            try:
+                self._send(conn, ('reset',))
+            except OSError:
+                pass
+
+    def get_last_result(self):
+        """Get the result of the last expression evaluation."""
+        return self._last_result
+
+    def complete(self, text, timeout=1.0):
+        """
+        Return the completions of a dotted name over the namespace of the
+        kernel; to be called while no command is running.
+        """
+        conn = self._conn
+        if conn is None:
+            return []
+        try:
+            self._send(conn, ('complete', text))
+            while conn.poll(timeout):
+                message = conn.recv()
+                if message[0] == 'completions' and message[1] == text:
+                    return message[2]
+        except (EOFError, OSError):
+            pass
+        return []
+
+    def page(self, conn, pager_id, timeout=5.0):
+        """
+        Return the next page of a truncated result kept by the kernel of
+        conn and whether more pages follow; to be called while no command
+        is running. A result of a terminated kernel has no more pages.
+        """
+        if conn is not self._conn:
+            return '', False
+        try:
+            self._send(conn, ('page', pager_id))
+            while conn.poll(timeout):
+                message = conn.recv()
+                if message[0] == 'page' and message[1] == pager_id:
+                    return message[2], message[3]
+        except (EOFError, OSError):
+            pass
+        return '', False
+
+    def interrupt(self):
+        """Raise KeyboardInterrupt in the command running in the kernel."""
+        conn = self._conn
+        if conn is not None:
+            try:
+                self._send(conn, ('interrupt',))
+            except OSError:
+                pass
+
+    def restart(self):
+        """Terminate the kernel and start a new one."""
+        self._stop()
+        self.start()
+
+    def _stop(self):
+        """Terminate the kernel process; return its exit code."""
+        with self._lock:
+            process, self._process = self._process, None
+            self._conn = None  # closed by its reader or when collected
+        if process is None:
+            return None
+        if process.is_alive():
+            process.terminate()
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+        process.join()
+        return process.exitcode
+
+    def close(self):
+        """Ask the kernel to exit, terminating it if it does not."""
+        conn, process = self._conn, self._process
+        if process is None:
+            return
+        try:
+            self._send(conn, ('shutdown',))
+        except OSError:
+            pass
+        process.join(1)
+        self._stop()
+
+
+def _receive(conn, requests, running):
+    """
+    Kernel thread reading the requests, so that an interrupt request
+    is handled while a command runs on the main thread.
+    """
+    if hasattr(signal, 'pthread_sigmask'):
+        # Have SIGINT delivered to the main thread, interrupting blocking calls
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT})
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            requests.put(('shutdown',))
+            return
+        if message[0] != 'interrupt':
+            requests.put(message)
+        elif running.is_set():
+            if hasattr(signal, 'pthread_sigmask'):
+                os.kill(os.getpid(), signal.SIGINT)
+            else:
+                _thread.interrupt_main()
+
+
+def _kernel_main(conn, locals, filename, formatter_options, max_pagers):
+    """Body of the kernel process."""
+    console = ExecConsole(locals=locals, filename=filename)
+    formatter = ResultFormatter(**formatter_options)
+    pagers = OrderedDict()  # ResultPager of the truncated results, by id
+    pager_count = 0
+
+    def send_output():
+        chunks = output.drain()
+        if chunks:
+            conn.send(('output', chunks))
+
+    output = OutputBuffer(send_output)
+    sys.stdout = ConsoleStream(output, 'output')
+    sys.stderr = ConsoleStream(output, 'errors')
+    requests = queue.Queue()
+    running = threading.Event()
+
+    def on_interrupt(signum, frame):
+        # Interrupts arriving once the command has completed are ignored
+        if running.is_set():
+            raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    threading.Thread(
+        target=_receive, args=(conn, requests, running), daemon=True
+    ).start()
+    while True:
+        message = requests.get()
+        if message[0] == 'shutdown':
+            break
+        if message[0] == 'reset':
+            console.resetbuffer()
+            continue
+        if message[0] == 'complete':
+            conn.send(('completions', message[1], console.complete(message[1])))
+            continue
+        if message[0] == 'page':
+            pager = pagers.get(message[1])
+            try:
+                text, more = pager.next_page() if pager else ('', False)
+            except Exception as e:
+                text, more = '<%s: %s>' % (type(e).__name__, e), False
+            if not more:
+                pagers.pop(message[1], None)
+            conn.send(('page', message[1], text, more))
+            continue
+        _, source, options = message
+        console.trace_memory = options['trace_memory']
+        console.profile_next = options['profile_next']
+        console.time_limit = options['time_limit']
+        console.memory_limit = options['memory_limit']
+        result = None
+        running.set()
+        try:
+            try:
+                more = console.push(source)
+                if not more and console.get_last_result() is not None:
+                    text, pager = formatter.format(console.get_last_result())
+                    pager_id = None
+                    if pager is not None:
+                        pager_count += 1
+                        pager_id = pager_count
+                        pagers[pager_id] = pager
+                        if len(pagers) > max_pagers:
+                            pagers.popitem(last=False)
+                    result = text, pager_id
+            finally:
+                # An interrupt arriving before is raised here at the latest
+                running.clear()
+        except KeyboardInterrupt:
+            running.clear()
+            console.resetbuffer()
+            more = False
+            result = None
+            print("KeyboardInterrupt", file=sys.stderr)
+        except SystemExit as e:
+            send_output()
+            conn.send(('exit', e.code))
+            break
+        profile = None
+        if options['profile_next'] and console.last_profile is not None:
+            profile = console.last_profile.stats
+        send_output()
+        conn.send(('done', more, result, console.last_stats, profile))
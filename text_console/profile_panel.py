@@ -0,0 +1,70 @@
+import io
+import tkinter as tk
+
+SORT_KEYS = ("cumulative", "tottime", "ncalls", "filename")
+
+
+class ProfilePanel(tk.Toplevel):
+    """Side window listing the top entries of a pstats.Stats profile."""
+    def __init__(self, master, stats, top_n=30, close_callback=None):
+        super().__init__(master)
+        self.stats = stats
+        self.top_n = top_n
+        self.close_callback = close_callback
+        self.title("Command Profile")
+        self.geometry("800x450")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._build_ui()
+        self.render()
+
+    def _build_ui(self):
+        main_frame = tk.Frame(self)
+        main_frame.pack(fill="both", expand=True, padx=10, pady=10)
+        top_frame = tk.Frame(main_frame)
+        top_frame.pack(fill="x", pady=(0, 5))
+        tk.Label(top_frame, text="Sort by:").pack(side="left")
+        self.sort_key = tk.StringVar(value=SORT_KEYS[0])
+        sort_menu = tk.OptionMenu(
+            top_frame, self.sort_key, *SORT_KEYS, command=lambda key: self.render()
+        )
+        sort_menu.pack(side="left", padx=(4, 0))
+        text_frame = tk.Frame(main_frame)
+        text_frame.pack(fill="both", expand=True)
+        v_scrollbar = tk.Scrollbar(text_frame, orient="vertical")
+        h_scrollbar = tk.Scrollbar(text_frame, orient="horizontal")
+        self.profile_txt = tk.Text(
+            text_frame,
+            wrap="none",
+            yscrollcommand=v_scrollbar.set,
+            xscrollcommand=h_scrollbar.set,
+            font=("Consolas", 10),
+            bg="white",
+            fg="black"
+        )
+        v_scrollbar.config(command=self.profile_txt.yview)
+        h_scrollbar.config(command=self.profile_txt.xview)
+        v_scrollbar.pack(side="right", fill="y")
+        h_scrollbar.pack(side="bottom", fill="x")
+        self.profile_txt.pack(fill="both", expand=True)
+        self.bind("<Escape>", lambda e: self.on_close())
+        self.bind("<Control-w>", lambda e: self.on_close())
+
+    def render(self):
+        """Show the top_n entries of the profile, sorted by the selected key."""
+        stream = io.StringIO()
+        self.stats.stream = stream
+        self.stats.sort_stats(self.sort_key.get()).print_stats(self.top_n)
+        self.profile_txt.config(state="normal")
+        self.profile_txt.delete("1.0", "end")
+        self.profile_txt.insert("1.0", stream.getvalue().strip("\n"))
+        self.profile_txt.config(state="disabled")
+
+    def update_stats(self, stats):
+        self.stats = stats
+        self.render()
+        self.lift()
+
+    def on_close(self):
+        if self.close_callback:
+            self.close_callback()
+        self.destroy()
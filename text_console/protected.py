@@ -0,0 +1,166 @@
+import re
+import sys
+import bisect
+
+PROTECTED_TAGS = ("prompt", "output", "errors", "banner", "timing")
+_LINE_COLUMN = re.compile(r"(\d+)\.(\d+)")
+
+
+class ProtectedRegions:
+    """
+    Map of the protected (not editable) column ranges of the lines of a
+    Text widget, i.e., the ranges of PROTECTED_TAGS.
+
+    The ranges of a line are read with tag_prevrange/tag_nextrange when
+    the line is first looked up and cached until the text changes from
+    that line onwards, so that resolving the editable position next to
+    the cursor is a binary search instead of a Tcl round trip for each
+    character. The edits of the console update the cached lines instead
+    of resolving their indices where they can: an edit at the end of the
+    text only changes the last lines, a deletion of whole lines renumbers
+    the following ones, and a prompt appended to a line is added to its
+    ranges.
+    """
+    def __init__(self, text, tags=PROTECTED_TAGS):
+        self.text = text
+        self.tags = tags
+        self._lines = {}  # line -> (starts, ranges, length)
+
+    def invalidate(self, from_line=1):
+        """Discard the ranges of the lines from from_line onwards."""
+        if from_line <= 1:
+            self._lines.clear()
+            return
+        for line in [line for line in self._lines if line >= from_line]:
+            del self._lines[line]
+
+    def _line(self, index):
+        """Line of a text index, resolved by Tk unless it is 'line.column'."""
+        match = _LINE_COLUMN.fullmatch(str(index))
+        if match is None:
+            return int(self.text.index(index).split('.')[0])
+        return int(match.group(1))
+
+    def before_insert(self, index):
+        """Discard the ranges changed by an insertion at index."""
+        if not self._lines:
+            return
+        if index in ("end", "end-1c"):
+            # The last cached line is the last line or the empty one after it
+            self.invalidate(max(self._lines) - 1)
+        else:
+            self.invalidate(self._line(index))
+
+    def before_delete(self, index1, index2=None):
+        """Discard or renumber the ranges changed by a deletion."""
+        if not self._lines:
+            return
+        first = _LINE_COLUMN.fullmatch(str(index1))
+        last = _LINE_COLUMN.fullmatch(str(index2)) if index2 else None
+        if (first is None or last is None or first.group(2) != "0"
+                or last.group(2) != "0"):
+            self.invalidate(self._line(index1))
+            return
+        # Whole lines: the following ones keep their ranges
+        first, last = int(first.group(1)), int(last.group(1))
+        count = max(last - first, 0)
+        self._lines = {
+            line - count if line >= last else line: entry
+            for line, entry in self._lines.items()
+            if not first <= line < last
+        }
+
+    def append(self, line, column, count, protected=True):
+        """
+        Add 'count' characters inserted at the end of a line, at column,
+        with a protected tag or not, to its ranges (e.g., a prompt).
+        """
+        entry = self._lines.get(line)
+        if entry is None:
+            if column == 0:  # an empty line
+                ranges = [(0, count)] if protected else []
+                self._lines[line] = ([0] if protected else [], ranges, count)
+            return
+        starts, ranges, length = entry
+        if length != column:
+            del self._lines[line]
+            return
+        ranges = list(ranges)
+        if protected and ranges and ranges[-1][1] == column:
+            ranges[-1] = (ranges[-1][0], column + count)
+        elif protected:
+            ranges.append((column, column + count))
+        self._lines[line] = ([start for start, _ in ranges], ranges, length + count)
+
+    def _read(self, line):
+        """Return the sorted, merged (start, end) protected columns of a line."""
+        text = self.text
+        line_start = '%d.0' % line
+        line_end = text.index('%d.end' % line)
+        length = int(line_end.split('.')[1])
+        found = []
+        for tag in self.tags:
+            # A range starting on a previous line may cover the line start
+            previous = text.tag_prevrange(tag, line_start + '+1c')
+            index = line_start
+            if previous and text.compare(previous[1], '>', line_start):
+                end = previous[1]
+                found.append((0, self._column(end, line)))
+                index = end
+            while True:
+                found_range = text.tag_nextrange(tag, index, line_end + '+1c')
+                if not found_range:
+                    break
+                start, end = found_range
+                found.append(
+                    (int(str(start).split('.')[1]), self._column(end, line))
+                )
+                index = end
+        found.sort()
+        ranges = []
+        for start, end in found:
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+        entry = ([start for start, _ in ranges], ranges, length)
+        self._lines[line] = entry
+        return entry
+
+    @staticmethod
+    def _column(index, line):
+        """Column of an index, or a larger value if it is on a following line."""
+        row, column = map(int, str(index).split('.'))
+        return column if row == line else sys.maxsize
+
+    def _entry(self, line):
+        entry = self._lines.get(line)
+        return entry if entry is not None else self._read(line)
+
+    def _covering(self, line, column):
+        """Return the protected range containing the column, or None."""
+        starts, ranges, _ = self._entry(line)
+        i = bisect.bisect_right(starts, column) - 1
+        if i >= 0 and ranges[i][1] > column:
+            return ranges[i]
+        return None
+
+    def length(self, line):
+        return self._entry(line)[2]
+
+    def is_protected(self, line, column):
+        return self._covering(line, column) is not None
+
+    def editable_at_or_after(self, line, column):
+        """First editable column from 'column' to the line end, or None."""
+        covering = self._covering(line, column)
+        if covering is not None:
+            column = covering[1]
+        return column if column < self.length(line) else None
+
+    def editable_at_or_before(self, line, column, lowest=0):
+        """Last editable column from 'column' down to 'lowest', or None."""
+        covering = self._covering(line, column)
+        if covering is not None:
+            column = covering[0] - 1  # ranges are merged: this one is free
+        return column if column >= lowest else None
@@ -0,0 +1,84 @@
+import os
+import atexit
+import tempfile
+from collections import deque
+
+
+class OutputSpool:
+    """
+    Temporary file receiving the output of a command too large to be shown
+    by the console. All the text written, with its ANSI sequences, goes to
+    the file; only the last tail characters are kept in memory, as (tag,
+    text) chunks, to be shown when the command ends. The file is deleted
+    by remove(), or at exit.
+    """
+    def __init__(self, tail=1 << 14):
+        fd, self.path = tempfile.mkstemp(prefix="text_console_", suffix=".txt")
+        self._file = os.fdopen(
+            fd, "w", encoding="utf-8", errors="replace", newline="")
+        self.tail = tail
+        self.chars = 0  # characters written
+        self.lines = 0  # newlines written
+        self._tail = deque()  # last (tag, text) chunks written
+        self._tail_chars = 0
+        atexit.register(self.remove)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def write(self, tag, text):
+        self._file.write(text)
+        self.chars += len(text)
+        self.lines += text.count("\n")
+        if len(text) >= self.tail:
+            self._tail.clear()
+            self._tail_chars = 0
+            text = text[-self.tail:]
+        self._tail.append((tag, text))
+        self._tail_chars += len(text)
+        while self._tail_chars - len(self._tail[0][1]) >= self.tail:
+            self._tail_chars -= len(self._tail.popleft()[1])
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def size(self):
+        """Size of the file in bytes, 0 once deleted."""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def close(self):
+        """
+        Close the file and return its tail: the last (tag, text) chunks
+        written, of at most tail characters, starting at a line start
+        unless the tail is a single line.
+        """
+        self._file.close()
+        chunks = list(self._tail)
+        self._tail.clear()
+        excess = self._tail_chars - self.tail
+        if excess > 0:
+            chunks[0] = (chunks[0][0], chunks[0][1][excess:])
+        if self.chars > self._tail_chars - max(excess, 0):
+            # Drop the rest of the line preceding the tail
+            for i, (tag, text) in enumerate(chunks):
+                newline = text.find("\n")
+                if newline >= 0:
+                    chunks[i] = (tag, text[newline + 1:])
+                    del chunks[:i]
+                    break
+        return [(tag, text) for tag, text in chunks if text]
+
+    def remove(self):
+        """Close and delete the file."""
+        atexit.unregister(self.remove)
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:  # e.g., open in a viewer on Windows
+            pass
@@ -0,0 +1,220 @@
+import mmap
+import tkinter as tk
+import tkinter.font as tkfont
+
+from .ansi import AnsiParser, tag_options
+
+
+class SpoolViewer(tk.Toplevel):
+    """
+    Pager of an output spool file. The file is memory-mapped and only the
+    lines visible from the top one, plus a small margin, are decoded and
+    rendered in the Text widget; the scrollbar is driven by the byte
+    offset of the top line, so that no index of the lines is needed and
+    files of any size are opened immediately.
+
+    The size of the file is checked every refresh_interval ms and the
+    file is mapped again when it grows, e.g., while the command writing
+    it is running; status is a function returning the text of the status
+    bar, which is then updated too.
+    """
+    render_margin = 5  # lines rendered below the visible ones
+    max_line_bytes = 4096  # bytes shown of each line
+    relayout_delay = 100  # ms without resize events before the relayout
+    refresh_interval = 500  # ms between checks of the size of the file
+
+    def __init__(self, master, path, status=None, close_callback=None):
+        super().__init__(master)
+        self.path = path
+        self.status = status
+        self.close_callback = close_callback
+        self._data = b""
+        self._map()
+        self._top = 0  # offset of the first rendered line
+        self._end = 0  # offset following the last rendered line
+        self._relayout_job = None
+        self._ansi_tags = set()
+        self.title("Command Output - %s" % path)
+        self.geometry("800x600")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._build_ui()
+        self.after(200, self.update_display)
+        self._refresh_job = self.after(self.refresh_interval, self.refresh)
+
+    def _map(self):
+        """Map the file again if it has grown; return whether it has."""
+        try:
+            with open(self.path, "rb") as f:
+                if f.seek(0, 2) <= len(self._data):
+                    return False
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:  # deleted with the oldest spools
+            return False
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = data
+        return True
+
+    def refresh(self):
+        """Show the lines added to the file, if the last ones were shown."""
+        at_end = self._end >= len(self._data)
+        if self._map():
+            if at_end:
+                self.update_display()
+            else:
+                self.update_scrollbar()
+        if self.status is not None:
+            self.status_label.config(text=self.status())
+        self._refresh_job = self.after(self.refresh_interval, self.refresh)
+
+    def _build_ui(self):
+        main_frame = tk.Frame(self)
+        main_frame.pack(fill="both", expand=True, padx=10, pady=10)
+        text_frame = tk.Frame(main_frame)
+        text_frame.pack(fill="both", expand=True)
+        self.v_scrollbar = tk.Scrollbar(text_frame, orient="vertical")
+        h_scrollbar = tk.Scrollbar(text_frame, orient="horizontal")
+        self.output_txt = tk.Text(
+            text_frame,
+            wrap="none",
+            xscrollcommand=h_scrollbar.set,
+            font=("Consolas", 10),
+            bg="white",
+            fg="#00178c"
+        )
+        self.v_scrollbar.config(command=self.on_vscroll)
+        h_scrollbar.config(command=self.output_txt.xview)
+        self.v_scrollbar.pack(side="right", fill="y")
+        h_scrollbar.pack(side="bottom", fill="x")
+        self.output_txt.pack(fill="both", expand=True)
+        self.output_txt.config(state="disabled")
+        self._line_height = tkfont.Font(font=self.output_txt.cget("font")).metrics("linespace")
+        self.status_label = tk.Label(
+            main_frame, text=self.status() if self.status else "",
+            relief="sunken", anchor="w")
+        self.status_label.pack(fill="x", pady=(5, 0))
+        self.bind("<Escape>", lambda e: self.on_close())
+        self.bind("<Control-w>", lambda e: self.on_close())
+        self.bind("<Configure>", self.on_window_configure)
+        # Scrolling moves the rendered window
+        self.output_txt.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.output_txt.bind("<Button-4>", lambda e: self.scroll_lines(-3))
+        self.output_txt.bind("<Button-5>", lambda e: self.scroll_lines(3))
+        self.output_txt.bind("<Up>", lambda e: self.scroll_lines(-1))
+        self.output_txt.bind("<Down>", lambda e: self.scroll_lines(1))
+        self.output_txt.bind("<Prior>", lambda e: self.scroll_lines(-self.visible_lines()))
+        self.output_txt.bind("<Next>", lambda e: self.scroll_lines(self.visible_lines()))
+        self.output_txt.bind("<Control-Home>", lambda e: self.scroll_to(0))
+        self.output_txt.bind("<Control-End>", lambda e: self.scroll_to_end())
+        self.output_txt.focus_set()
+
+    def on_close(self):
+        if self.close_callback:
+            self.close_callback()
+        self.destroy()
+
+    def destroy(self):
+        self.after_cancel(self._refresh_job)
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()  # the file can then be deleted on Windows
+        super().destroy()
+
+    def visible_lines(self):
+        return max(1, self.output_txt.winfo_height() // self._line_height)
+
+    def _line_start(self, offset):
+        """Offset of the start of the line containing offset."""
+        return self._data.rfind(b"\n", 0, offset) + 1
+
+    def _next_line(self, offset):
+        """Offset of the start of the line following the one at offset."""
+        newline = self._data.find(b"\n", offset)
+        return len(self._data) if newline < 0 else newline + 1
+
+    def scroll_to(self, offset):
+        """Render the lines from the one containing offset."""
+        offset = self._line_start(max(0, min(offset, len(self._data))))
+        if offset != self._top:
+            self._top = offset
+            self.update_display()
+        return "break"
+
+    def scroll_to_end(self):
+        self._map()
+        offset = len(self._data)
+        for _ in range(self.visible_lines()):
+            if offset == 0:
+                break
+            offset = self._line_start(offset - 1)
+        return self.scroll_to(offset)
+
+    def scroll_lines(self, lines):
+        offset = self._top
+        for _ in range(abs(lines)):
+            if lines < 0:
+                if offset == 0:
+                    break
+                offset = self._line_start(offset - 1)
+            else:
+                following = self._next_line(offset)
+                if following >= len(self._data):
+                    break
+                offset = following
+        return self.scroll_to(offset)
+
+    def on_mouse_wheel(self, event):
+        return self.scroll_lines(-3 if event.delta > 0 else 3)
+
+    def on_vscroll(self, *args):
+        """Scrollbar command: 'moveto fraction' or 'scroll n units|pages'."""
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self._data)))
+        elif args[0] == "scroll":
+            lines = int(args[1])
+            if args[2] == "pages":
+                lines *= self.visible_lines()
+            self.scroll_lines(lines)
+
+    def update_scrollbar(self):
+        size = len(self._data)
+        if not size:
+            self.v_scrollbar.set(0, 1)
+            return
+        self.v_scrollbar.set(self._top / size, self._end / size)
+
+    def on_window_configure(self, event=None):
+        if event and event.widget == self:
+            # Debounce: render again once the resizing stops
+            if self._relayout_job is not None:
+                self.after_cancel(self._relayout_job)
+            self._relayout_job = self.after(self.relayout_delay, self.update_display)
+
+    def update_display(self):
+        """Render the visible lines, with a single insert."""
+        self._relayout_job = None
+        parser = AnsiParser()  # the style set before the top line is not known
+        args = []
+        offset = self._top
+        for _ in range(self.visible_lines() + self.render_margin):
+            if offset >= len(self._data):
+                break
+            following = self._next_line(offset)
+            end = min(following, offset + self.max_line_bytes)
+            text = str(self._data[offset:end], "utf-8", "replace")
+            if end < following:
+                text += "…\n"
+            for segment, tags in parser.split(text):
+                for tag in tags:
+                    if tag not in self._ansi_tags:
+                        self.output_txt.tag_configure(tag, **tag_options(tag))
+                        self._ansi_tags.add(tag)
+                args.extend((segment, tags))
+            offset = following
+        self._end = offset
+        self.output_txt.config(state="normal")
+        self.output_txt.delete("1.0", "end")
+        if args:
+            self.output_txt.insert("1.0", *args)
+        self.output_txt.config(state="disabled")
+        self.output_txt.yview_moveto(0)
+        self.update_scrollbar()
@@ -0,0 +1,144 @@
+import io
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class OutputBuffer:
+    """
+    Thread-safe queue of (tag, text) chunks written by the executed code.
+
+    Adjacent writes with the same tag are merged, so that the widget can
+    display them with a single insert, and the order of stdout and stderr
+    writes is preserved. The buffer is drained by the widget at a bounded
+    rate; writers running on a worker thread are blocked when more than
+    max_pending characters are waiting, which keeps memory usage flat.
+    """
+    def __init__(self, flush_callback, interval=0.016, max_pending=1 << 20):
+        self.flush_callback = flush_callback
+        self.interval = interval
+        self.max_pending = max_pending
+        self.had_errors = False
+        self._chunks = []
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._owner = threading.get_ident()  # the Tk thread
+
+    def reset(self):
+        """Prepare for a new command."""
+        self.had_errors = False
+
+    def put(self, tag, text):
+        """Queue text; flush it if called from the Tk thread and it is due."""
+        if not text:
+            return
+        with self._lock:
+            if self._chunks and self._chunks[-1][0] == tag:
+                self._chunks[-1][1].append(text)
+            else:
+                self._chunks.append((tag, [text]))
+            self._pending += len(text)
+            if tag == "errors":
+                self.had_errors = True
+            if threading.get_ident() != self._owner:
+                # Worker thread: wait for the widget to catch up
+                while self._pending > self.max_pending:
+                    self._drained.wait(0.1)
+                return
+            due = (
+                self._pending >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.interval
+            )
+        if due:
+            self.flush_callback()
+
+    def drain(self):
+        """Return the pending chunks as a list of (tag, text) tuples."""
+        with self._lock:
+            chunks, self._chunks = self._chunks, []
+            self._pending = 0
+            self._last_flush = time.monotonic()
+            self._drained.notify_all()
+        return [(tag, "".join(parts)) for tag, parts in chunks]
+
+
+class ConsoleStream(io.TextIOBase):
+    """File-like object sending everything written to an OutputBuffer."""
+    def __init__(self, buffer, tag):
+        super().__init__()
+        self._buffer = buffer
+        self.tag = tag
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if not isinstance(s, str):
+            raise TypeError(
+                "write() argument must be str, not %s" % type(s).__name__
+            )
+        self._buffer.put(self.tag, s)
+        return len(s)
+
+
+class ThreadOutput:
+    """
+    Replacement of sys.stdout or sys.stderr sending the writes of each
+    thread listed in 'streams' to its own stream, and those of the other
+    threads (e.g., threads of the application embedding the console) to
+    the replaced one. Other attributes are the ones of the stream of the
+    calling thread.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.streams = {}  # thread ident -> stream
+
+    def _stream(self):
+        return self.streams.get(threading.get_ident(), self.default)
+
+    def write(self, s):
+        stream = self._stream()
+        if stream is None:  # no console (pythonw): print() discards output
+            return len(s)
+        return stream.write(s)
+
+    def flush(self):
+        stream = self._stream()
+        if stream is not None:
+            stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
+
+
+@contextmanager
+def redirect_thread(name, stream):
+    """
+    Redirect sys.stdout or sys.stderr (name is 'stdout' or 'stderr') to
+    stream for the calling thread only, as contextlib.redirect_stdout does
+    for all threads. A ThreadOutput replaces the standard stream while a
+    thread is redirected.
+    """
+    output = getattr(sys, name)
+    if not isinstance(output, ThreadOutput):
+        output = ThreadOutput(output)
+        setattr(sys, name, output)
+    ident = threading.get_ident()
+    previous = output.streams.get(ident)
+    output.streams[ident] = stream
+    try:
+        yield stream
+    finally:
+        if previous is not None:
+            output.streams[ident] = previous
+        else:
+            del output.streams[ident]
+            if not output.streams and getattr(sys, name) is output:
+                setattr(sys, name, output.default)
@@ -1,47 +1,41 @@
+import os
 import sys
 import re
+import queue
+import threading
+import traceback
 import tkinter as tk
-from tkinter import Menu, messagebox, ttk
+from tkinter import Menu
 import tkinter.font as tkfont
-from code import InteractiveConsole
-from io import StringIO
-from contextlib import redirect_stdout, redirect_stderr
+from collections import OrderedDict
 
+from .console import ExecConsole, expand_help
+from .completion import name_before
+from .highlight import SYNTAX_TAGS, syntax_spans
+from .ansi import AnsiParser, tag_options
+from .protected import ProtectedRegions
 from .history import History
 from .command_history import CommandHistoryPanel
+from .stream import OutputBuffer, ConsoleStream, redirect_thread
+from .display import ResultFormatter
+from .profile_panel import ProfilePanel
+from .spool import OutputSpool
+from .spool_viewer import SpoolViewer
 from .__version__ import __version__
 
 
-class ExecConsole(InteractiveConsole):
-    """Console that tries eval first, then exec, to handle expressions properly."""
-    def push(self, source):
-        # Try to compile as eval first (for expressions)
-        try:
-            code_obj = compile(source, filename="<console>", mode="eval")
-            # If successful, we have an expression - execute it and return the result
-            result = eval(code_obj, self.locals)
-            if result is not None:
-                # Store the result for retrieval
-                self._last_result = result
-                return False  # Command is complete
-            else:
-                self._last_result = None
-                return False  # Command is complete
-        except SyntaxError:
-            # Not a valid expression, try as exec (statements)
-            # Clear the last result since we're executing a statement, not an expression
-            self._last_result = None
-            pass
-        except Exception as e:
-            # Other errors (runtime errors)
-            self._last_result = None  # Clear result on error
-            print(str(e), file=sys.stderr)
-            return False  # Command is complete
-        return self.runsource(source, filename="<console>", symbol="exec")
-            
-    def get_last_result(self):
-        """Get the result of the last expression evaluation."""
-        return getattr(self, '_last_result', None)
+def format_duration(seconds):
+    if seconds < 1:
+        return '%.1f ms' % (seconds * 1000)
+    return '%.3f s' % seconds
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit) if unit != 'B' else '%d B' % size
+        size /= 1024
+    return '%.1f GiB' % size
 
 
 class BaseTextConsole(tk.Text):
@@ -49,6 +43,11 @@ class BaseTextConsole(tk.Text):
     
     # Class attributes that can be overridden by subclasses
     history_file = ".console_history"
+    history_max_size = None  # None for an unbounded history
+    history_deduplicate = False  # move a repeated command to the end
+    load_history_in_background = True  # the prompt is usable meanwhile
+    max_scrollback_lines = None  # e.g. 10000; None for an unbounded scrollback
+    max_scrollback_chars = None
     console_locals = {}
     context_menu_items = [
         ("Cut", "cut"),
@@ -58,6 +57,39 @@ class BaseTextConsole(tk.Text):
     ]
     show_about_message = "Python Console v" + __version__
     show_help_content = "Welcome to the Python Console"
+    threaded_execution = False  # run commands on a worker thread
+    kernel_mode = False  # run commands in a separate worker process
+    concurrent_await = True  # commands with top-level await run as background tasks
+    event_loop_interval = 20  # ms between runs of the asyncio event loop
+    completion_rows = 10  # rows of the completion popup
+    syntax_highlighting = True  # highlight the code in the input region
+    syntax_colors = {
+        "syn_keyword": "#7f0055",
+        "syn_builtin": "#267f99",
+        "syn_definition": "#795e26",
+        "syn_string": "#a31515",
+        "syn_comment": "#808080",
+        "syn_number": "#098658",
+    }
+    time_limit = None  # seconds a command may run, None for no limit
+    memory_limit = None  # bytes a command may allocate, None for no limit
+    execution_poll_interval = 20  # ms between checks of the worker thread
+    output_flush_interval = 16  # ms between refreshes of streamed output
+    render_ansi = True  # show ANSI colors and styles of the output
+    # Output of a command beyond this number of characters is spooled to a
+    # temporary file instead of being shown (None to never spool)
+    output_spool_threshold = 1 << 20
+    output_spool_tail = 1 << 14  # last characters of spooled output shown
+    max_output_spools = 5  # spool files kept for the viewer
+    # Limits for the display of expression results
+    result_max_items = 100  # items shown for each container
+    result_max_depth = 6  # nesting levels shown
+    result_max_string = 1000  # characters shown for each string
+    result_max_chars = 20000  # characters of the whole representation
+    result_time_budget = 0.25  # seconds
+    max_result_pagers = 20  # truncated results that can still "show more"
+    show_timing = False  # status line with the measures of each command
+    profile_top_n = 30  # entries listed in the profile window
     
     def __init__(self, main, master, **kw):
         kw.setdefault('width', 50)
@@ -72,6 +104,7 @@ class BaseTextConsole(tk.Text):
         kw.setdefault('undo', True)
 
         super().__init__(master, **kw)
+        self._protected = ProtectedRegions(self)
         
         # Initialize console with merged locals
         merged_locals = {
@@ -81,15 +114,69 @@ class BaseTextConsole(tk.Text):
             "local": self
         }
         merged_locals.update(self.console_locals)
-        self._console = ExecConsole(locals=merged_locals)
+        if self.kernel_mode:
+            from .kernel import KernelClient  # imports multiprocessing
+            # The widget objects cannot be shared with another process
+            self._console = KernelClient(
+                locals=self.console_locals,
+                formatter_options=self.result_limits(),
+                max_pagers=self.max_result_pagers,
+                time_limit=self.time_limit,
+                memory_limit=self.memory_limit
+            )
+        else:
+            self._console = ExecConsole(
+                locals=merged_locals,
+                time_limit=self.time_limit,
+                memory_limit=self.memory_limit
+            )
+            self._console.await_in_background = self.concurrent_await
+        self._event_loop_scheduled = False
+        self._jobs = {}  # pending after() callbacks, cancelled by destroy
         
         # Initialize history
-        self.history = History(self.history_file)
+        self.history = History(
+            self.history_file,
+            max_size=self.history_max_size,
+            deduplicate=self.history_deduplicate,
+            load_in_background=self.load_history_in_background
+        )
         self._hist_item = len(self.history)
         self._hist_match = ''
+        if not self.history.loaded.is_set():
+            self._schedule('history', 50, self._on_history_loaded)
         
         # Initialize settings
         self._save_errors_in_history = tk.BooleanVar(value=False)
+        self._show_timing = tk.BooleanVar(value=self.show_timing)
+        self._trace_memory = tk.BooleanVar(value=False)
+        self.profile_panel = None
+        self._shown_profile = None
+
+        # Threaded execution state
+        self._running = False
+        self._typeahead = []
+        self._exec_queue = queue.Queue()
+
+        # Bounded display of results
+        self._formatter = ResultFormatter(**self.result_limits())
+        self._pagers = OrderedDict()  # "show more" tag -> ResultPager
+        self._pager_count = 0
+
+        # Streamed command output, inserted at _output_index
+        self._output_index = 'end'
+        self._ansi_parsers = {}  # stream tag -> AnsiParser
+        self._ansi_tags = set()  # ANSI tags already configured
+        self._ansi_fonts = {}  # tag -> font of bold and italic text
+        self._output = OutputBuffer(
+            self._flush_output, interval=self.output_flush_interval / 1000
+        )
+        self._spool = None  # OutputSpool of the running command
+        self._spool_tag = None  # tag of its marker line
+        self._spool_head = []  # (tag, text) chunks shown of the command output
+        self._spool_head_chars = 0
+        self._spools = OrderedDict()  # marker tag -> OutputSpool
+        self._spool_count = 0
         
         self.setup_tags()
         self.setup_bindings()
@@ -105,6 +192,23 @@ class BaseTextConsole(tk.Text):
 
         # Add this attribute in your __init__ method if not present
         self.history_panel = None
+        self._completion_popup = None  # created on first use
+        self._completions = []
+
+        # Incremental syntax highlighting of the input region
+        self._highlight_scheduled = False
+        self._highlight_start = None  # index of the input highlighted last
+        self._highlighted = []  # (line, spans) of each highlighted input line
+
+    def result_limits(self):
+        """Keyword arguments of ResultFormatter from the result_* attributes"""
+        return dict(
+            max_items=self.result_max_items,
+            max_depth=self.result_max_depth,
+            max_string=self.result_max_string,
+            max_chars=self.result_max_chars,
+            time_budget=self.result_time_budget
+        )
 
     def setup_tags(self):
         """Set up text tags for styling"""
@@ -127,6 +231,18 @@ class BaseTextConsole(tk.Text):
             font=("Courier", font_size - 2)
         )
         self.tag_configure("output", foreground="#00178c")
+        for font in self._ansi_fonts.values():
+            font.configure(size=font_size)
+        self.tag_configure("running", background="#ffe08a")
+        self.tag_configure("show_more", foreground="blue", underline=True)
+        self.tag_configure("show_spool", foreground="blue", underline=True)
+        self.tag_configure(
+            "timing",
+            foreground="gray",
+            font=("Courier", font_size - 2)
+        )
+        for tag in SYNTAX_TAGS:
+            self.tag_configure(tag, foreground=self.syntax_colors.get(tag))
         self.tag_configure("number", foreground="#0066cc", font=("Consolas", 10, "bold"))
         self.tag_configure("number_hover", background="#e0f0ff")
         self.tag_configure("nonselectable", foreground="#0066cc", font=("Consolas", 10, "bold"), selectbackground="white", selectforeground="#0066cc")
@@ -145,6 +261,9 @@ class BaseTextConsole(tk.Text):
         self.bind('<BackSpace>', self.on_backspace)
         self.bind('<Control-c>', self.on_ctrl_c)
         self.bind('<<Paste>>', self.on_paste)
+        # The middle button pastes at the pointer, possibly several lines
+        self.bind('<<PasteSelection>>',
+                  lambda e: self._protected.before_insert('@%d,%d' % (e.x, e.y)))
         self.bind("<Button-3>", self.show_context_menu)
         self.bind("<Control-z>", lambda e: self._safe_undo())
         self.bind("<Control-y>", lambda e: self._safe_redo())
@@ -152,6 +271,7 @@ class BaseTextConsole(tk.Text):
         self.bind("<Left>", lambda e: self.after_idle(self._process_arrows, "Left"))
         self.bind("<Right>", lambda e: self.after_idle(self._process_arrows, "Right"))
         self.bind("<KeyPress>", self.on_key_press)
+        self.bind("<<Modified>>", self.on_modified)
         self.bind("<Home>", lambda e: self._move_to_line_start(e))
         self.bind("<End>", lambda e: self._move_to_line_end(e))
         self.bind('<Control-k>', self.remove_current_history_entry)
@@ -159,6 +279,12 @@ class BaseTextConsole(tk.Text):
         self.bind('<Control-minus>', self.decrease_font_size)
         self.bind('<Control-0>', self.reset_font_size)
         self.bind('<Control-r>', lambda e: self.show_command_history_panel())
+        self.tag_bind("show_more", "<Button-1>", self.on_show_more)
+        self.tag_bind("show_more", "<Enter>", lambda e: self.config(cursor="hand2"))
+        self.tag_bind("show_more", "<Leave>", lambda e: self.config(cursor="xterm"))
+        self.tag_bind("show_spool", "<Button-1>", self.on_show_spool)
+        self.tag_bind("show_spool", "<Enter>", lambda e: self.config(cursor="hand2"))
+        self.tag_bind("show_spool", "<Leave>", lambda e: self.config(cursor="xterm"))
 
     def get_font(self):
         font_name = self.cget("font")
@@ -191,6 +317,8 @@ class BaseTextConsole(tk.Text):
         Remove the currently retrieved element from the history.
         Only works if a history item is currently loaded (not blank input).
         """
+        if self._running:
+            return "break"
         # Only remove if _hist_item is valid and in range
         if getattr(self, '_hist_item', None) is not None and 0 <= self._hist_item < len(self.history):
             del self.history[self._hist_item]
@@ -202,20 +330,26 @@ class BaseTextConsole(tk.Text):
             else:
                 # Show the next item in history if available
                 self.insert_cmd(self.history[self._hist_item] if self._hist_item < len(self.history) else '')
-            self.history.save()
+            self.save_history()
         return "break"
 
     def _safe_undo(self):
+        if self._running:
+            return
         try:
             self.edit_undo()
         except tk.TclError:
             pass
+        self._protected.invalidate()
 
     def _safe_redo(self):
+        if self._running:
+            return
         try:
             self.edit_redo()
         except tk.TclError:
             pass
+        self._protected.invalidate()
 
     def setup_context_menu(self):
         """Set up the context menu"""
@@ -261,14 +395,118 @@ class BaseTextConsole(tk.Text):
         )
         menu_bar.add_cascade(label="History", menu=history_menu)
 
+        # Run menu
+        run_menu = Menu(menu_bar, tearoff=0)
+        run_menu.add_checkbutton(
+            label="Show Command Timing",
+            variable=self._show_timing,
+            onvalue=True,
+            offvalue=False
+        )
+        run_menu.add_checkbutton(
+            label="Trace Memory Allocations",
+            variable=self._trace_memory,
+            onvalue=True,
+            offvalue=False,
+            command=self.on_trace_memory
+        )
+        run_menu.add_separator()
+        run_menu.add_command(
+            label="Profile Next Command", command=self.profile_next_command
+        )
+        run_menu.add_command(label="Show Last Profile", command=self.show_profile)
+        if self.kernel_mode:
+            run_menu.add_separator()
+            run_menu.add_command(label="Interrupt", command=self.interrupt)
+            run_menu.add_command(
+                label="Restart Kernel", command=self.restart_kernel
+            )
+        menu_bar.add_cascade(label="Run", menu=run_menu)
+
         # Help menu
         help_menu = Menu(menu_bar, tearoff=0)
         help_menu.add_command(label="Usage", command=self.show_help)
         help_menu.add_command(label="About", command=self.show_about)
         menu_bar.add_cascade(label="Help", menu=help_menu)
 
+    def interrupt(self):
+        """Raise KeyboardInterrupt in the command running in the kernel."""
+        if self._running and self.kernel_mode:
+            self._console.interrupt()
+
+    def restart_kernel(self):
+        """Replace the kernel process with a new one, with a fresh namespace."""
+        self._console.restart()
+        if not self._running:
+            self.insert('input linestart', '=== RESTART ===\n', 'banner')
+            self.see('end')
+
+    def destroy(self):
+        for job in self._jobs.values():
+            self.after_cancel(job)
+        self._jobs.clear()
+        try:
+            if self.kernel_mode:
+                self._console.close()
+            for spool in self._spools.values():
+                spool.remove()
+            self.history.close()  # saves the pending changes
+        finally:
+            super().destroy()
+
+    def _schedule(self, name, delay, func, *args):
+        """Call func after delay ms, keeping the job so destroy cancels it."""
+        def run():
+            del self._jobs[name]
+            func(*args)
+        self._jobs[name] = self.after(delay, run)
+
+    def on_trace_memory(self):
+        self._console.trace_memory = self._trace_memory.get()
+
+    def profile_next_command(self):
+        """Run the next command under cProfile; the profile is then shown."""
+        self._console.profile_next = True
+
+    def show_profile(self):
+        """Show the profile of the last profiled command in a side window."""
+        stats = self._console.last_profile
+        if stats is None:
+            from tkinter import messagebox
+            messagebox.showinfo(
+                "Profile", "No command has been profiled yet: "
+                "select 'Profile Next Command' before running it."
+            )
+            return
+        if self.profile_panel is not None and self.profile_panel.winfo_exists():
+            self.profile_panel.update_stats(stats)
+            return
+
+        def on_panel_close():
+            self.profile_panel = None
+        self.profile_panel = ProfilePanel(
+            self, stats, top_n=self.profile_top_n, close_callback=on_panel_close
+        )
+
+    def _report_command_stats(self):
+        """Insert the timing status line; show the profile of a profiled command."""
+        stats = self._console.last_stats
+        if stats is not None and self._show_timing.get():
+            line = 'wall %s, CPU %s' % (
+                format_duration(stats.wall_time), format_duration(stats.cpu_time)
+            )
+            if stats.peak_memory is not None:
+                line += ', peak %s' % format_size(stats.peak_memory)
+            if self.get('end-2c') != '\n':
+                line = '\n' + line
+            self.insert('end', '[%s]\n' % line, 'timing')
+        if self._console.last_profile is not self._shown_profile:
+            self._shown_profile = self._console.last_profile
+            self.show_profile()
+
     def show_about(self):
         """Show about dialog - can be overridden by subclasses"""
+        from tkinter import messagebox
         messagebox.showinfo("About", self.show_about_message)
 
     def show_help(self):
@@ -354,6 +592,8 @@ class BaseTextConsole(tk.Text):
 
     def clear(self):
         """Clear all text from the console."""
+        if self._running:
+            return
         self.delete("1.0", "end")
         self.insert('end', self._prompt1, 'prompt')
         self.mark_set('input', 'end-1c')
@@ -378,6 +618,9 @@ class BaseTextConsole(tk.Text):
 
     def on_paste(self, event):
         """Paste commands"""
+        if self._running:
+            self._typeahead.extend(self.clipboard_get())
+            return "break"
         if self.compare('insert', '<', 'input'):
             return "break"
         sel = self.tag_ranges('sel')
@@ -418,10 +661,10 @@ class BaseTextConsole(tk.Text):
 
     def prompt(self, result=False):
         """Insert a prompt"""
-        if result:
-            self.insert('end', self._prompt2, 'prompt')
-        else:
-            self.insert('end', self._prompt1, 'prompt')
+        prompt = self._prompt2 if result else self._prompt1
+        line, column = map(int, self.index('end-1c').split('.'))
+        self.insert('end', prompt, 'prompt')
+        self._protected.append(line, column, len(prompt))
         self.mark_set('input', 'end-1c')
         self.edit_reset()
 
@@ -474,6 +717,8 @@ class BaseTextConsole(tk.Text):
         """
         When pressing Esc, jump to the last blank command (empty input) in history.
         """
+        if self._running:
+            return "break"
         """
         if self.is_command_edited():
             self.flash_prompt_warning()
@@ -492,12 +737,14 @@ class BaseTextConsole(tk.Text):
 
     def on_up(self, event):
         """Handle up arrow key press: navigate history only from first line"""
+        if self._running:
+            return "break"
         try:
             self.index("sel.first")
             # There is a selection, do nothing
         except tk.TclError:
             # No selection
-            if self.tag_names("insert"):
+            if self.is_protected("insert"):
                 self.edit_reset()
                 return "break"
         self.edit_separator()
@@ -509,39 +756,24 @@ class BaseTextConsole(tk.Text):
             first_line_input = self.get('input', 'insert')
             # If we're starting a new search (first up arrow press), initialize
             if self._hist_item == len(self.history):
+                # Include the commands saved meanwhile by other consoles
+                self.history.refresh()
+                self._hist_item = len(self.history)
                 self._hist_match = first_line_input
-                # Start from the last (most recent) history item
-                self._hist_item = len(self.history) - 1
-            else:
-                # Continue navigating backward from current position
-                self._hist_item -= 1
             
-            # Find the next matching history item going backward
-            found_match = False
-            while self._hist_item >= 0:
-                item = self.history[self._hist_item]
-                # Check if this history item starts with our match string
-                if item.startswith(self._hist_match):
-                    found_match = True
-                    break
-                self._hist_item -= 1
+            # Find the previous matching history item through the prefix index
+            found = self.history.find_previous(self._hist_match, self._hist_item)
+            if found is None:
+                # No more matches found, wrap around to find the last matching item
+                found = self.history.find_previous(self._hist_match, len(self.history))
             
-            if found_match:
+            if found is not None:
                 # Found a matching item, insert it
-                self.insert_cmd(self.history[self._hist_item])
+                self._hist_item = found
+                self.insert_cmd(self.history[found])
             else:
-                # No more matches found, wrap around to find the last matching item
-                self._hist_item = len(self.history) - 1
-                while self._hist_item >= 0:
-                    item = self.history[self._hist_item]
-                    if item.startswith(self._hist_match):
-                        self.insert_cmd(self.history[self._hist_item])
-                        break
-                    self._hist_item -= 1
-                
-                if self._hist_item < 0:
-                    # No matches at all, restore to end position
-                    self._hist_item = len(self.history)
+                # No matches at all, restore to end position
+                self._hist_item = len(self.history)
             
             self.edit_reset()
             return 'break'
@@ -551,12 +783,14 @@ class BaseTextConsole(tk.Text):
 
     def on_down(self, event):
         """Handle down arrow key press: navigate history only from last line"""
+        if self._running:
+            return "break"
         try:
             self.index("sel.first")
             # There is a selection, do nothing
         except tk.TclError:
             # No selection
-            if self.tag_names("insert"):
+            if self.is_protected("insert"):
                 self.edit_reset()
                 return "break"
         self.edit_separator()
@@ -565,15 +799,10 @@ class BaseTextConsole(tk.Text):
                 self.flash_prompt_warning()
                 return "break"
             line = self._hist_match
-            self._hist_item += 1
+            found = self.history.find_next(line, self._hist_item)
 
-            while self._hist_item < len(self.history):
-                item = self.history[self._hist_item]
-                if item.startswith(line):
-                    break
-                self._hist_item += 1
-
-            if self._hist_item < len(self.history):
+            if found is not None:
+                self._hist_item = found
                 self.insert_cmd(self.history[self._hist_item])
                 self.mark_set('insert', 'end-1c')
             else:
@@ -591,6 +820,8 @@ class BaseTextConsole(tk.Text):
         Move the cursor back by up to 4 spaces if possible (like un-indenting),
         but do not move back if at the beginning of a line after the prompt.
         """
+        if self._running:
+            return "break"
         cursor_index = self.index("insert")
         line_start = self.index(f"{cursor_index} linestart")
         line_text = self.get(line_start, f"{line_start} lineend")
@@ -622,6 +853,8 @@ class BaseTextConsole(tk.Text):
 
     def on_tab(self, event):
         """Handle tab key press"""
+        if self._running:
+            return "break"
         self.edit_separator()
         if self.compare('insert', '<', 'input'):
             self.mark_set('insert', 'input lineend')
@@ -637,10 +870,102 @@ class BaseTextConsole(tk.Text):
                 self.insert('%i.0' % line, '    ')
         else:
             txt = self.get('insert-1c')
-            if not txt.isalnum() and txt != '.':
+            if not txt.isalnum() and txt not in ('.', '_'):
                 self.insert('insert', '    ')
+            else:
+                self.complete()
         return "break"
 
+    def complete(self):
+        """
+        Complete the name before the cursor: the common prefix of the
+        completions is inserted and, if several remain, they are listed
+        in a popup.
+        """
+        prefix = name_before(self.get('insert linestart', 'insert'))
+        if not prefix:
+            return
+        matches = self._console.complete(prefix)
+        if not matches:
+            self.bell()
+            return
+        self.mark_set('completion_start', 'insert-%dc' % len(prefix))
+        self.mark_gravity('completion_start', 'left')
+        common = os.path.commonprefix(matches)
+        if len(common) > len(prefix):
+            self.insert('insert', common[len(prefix):])
+        if len(matches) > 1:
+            self.show_completions(matches)
+
+    def show_completions(self, matches):
+        """Show the completions in a popup list below the cursor."""
+        if self._completion_popup is None:
+            self._create_completion_popup()
+        popup, listbox = self._completion_popup
+        self._completions = matches
+        listbox.delete(0, 'end')
+        # A single insert; the listbox only draws the visible rows
+        listbox.insert('end', *(match.rsplit('.', 1)[-1] for match in matches))
+        listbox.config(height=min(len(matches), self.completion_rows))
+        listbox.selection_set(0)
+        listbox.activate(0)
+        self.see('insert')
+        self.update_idletasks()
+        bbox = self.bbox('insert')
+        if bbox is None:
+            return
+        x = self.winfo_rootx() + bbox[0]
+        y = self.winfo_rooty() + bbox[1] + bbox[3]
+        popup.geometry('+%d+%d' % (x, y))
+        popup.deiconify()
+        popup.lift()
+        listbox.focus_set()
+
+    def _create_completion_popup(self):
+        popup = tk.Toplevel(self)
+        popup.withdraw()
+        popup.overrideredirect(True)
+        listbox = tk.Listbox(
+            popup, exportselection=False, activestyle='none',
+            font=self.cget('font')
+        )
+        scrollbar = tk.Scrollbar(popup, command=listbox.yview)
+        listbox.config(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        listbox.pack(side='left', fill='both', expand=True)
+        for sequence in ('<Return>', '<Tab>', '<Double-Button-1>'):
+            listbox.bind(sequence, self.accept_completion)
+        listbox.bind('<Escape>', lambda e: self.hide_completions())
+        listbox.bind('<FocusOut>', lambda e: self.hide_completions(False))
+        listbox.bind('<KeyPress>', self._on_completion_key)
+        self._completion_popup = (popup, listbox)
+
+    def hide_completions(self, focus=True):
+        if self._completion_popup is not None:
+            self._completion_popup[0].withdraw()
+        if focus:
+            self.focus_set()
+
+    def accept_completion(self, event=None):
+        """Replace the name being completed with the selected completion."""
+        listbox = self._completion_popup[1]
+        selection = listbox.curselection()
+        self.hide_completions()
+        if selection:
+            self.delete('completion_start', 'insert')
+            self.insert('insert', self._completions[selection[0]])
+        return "break"
+
+    def _on_completion_key(self, event):
+        """Keep typing in the console: close the popup and forward the key."""
+        if event.keysym == 'BackSpace':
+            self.hide_completions()
+            return self.on_backspace(event)
+        if event.char and event.char.isprintable():
+            self.hide_completions()
+            self.insert('insert', event.char)
+            return "break"
+
     def go_to_end(self, event):
         """Move the cursor to the end of the last line of input."""
         self.edit_separator()
@@ -648,7 +973,10 @@ class BaseTextConsole(tk.Text):
         return 'break'
 
     def _move_to_line_start(self, event):
-        index = self.index("insert linestart")
+        # The first editable character, i.e., after the prompt
+        line = int(self.index("insert").split('.')[0])
+        column = self._protected.editable_at_or_after(line, 0)
+        index = "%d.%d" % (line, column) if column is not None else "%d.0" % line
         self.mark_set("insert", index)
         self.see(index)
         return "break"
@@ -661,6 +989,8 @@ class BaseTextConsole(tk.Text):
 
     def on_return(self, event=None):
         """Handle Return key press with modal for mid-line or multiline editing."""
+        if self._running:
+            return "break"
         self.edit_separator()
         input_start = self.index('input')
         input_end = self.index('end-1c')
@@ -673,7 +1003,7 @@ class BaseTextConsole(tk.Text):
             self.eval_current(True)
             self.see('end')
             self._hist_item = len(self.history) 
-            self.history.save()
+            self.save_history()
             return 'break'
 
         lines = full_text.splitlines()
@@ -774,7 +1104,7 @@ class BaseTextConsole(tk.Text):
                     self.mark_set('insert', 'end-1c')
                     self.eval_current(True)
                     self.see('end')
-                    self.history.save()
+                    self.save_history()
 
                 def add_newline_here():
                     modal.destroy()
@@ -847,7 +1177,7 @@ class BaseTextConsole(tk.Text):
         # Default: execute the command
         self.eval_current(True)
         self.see('end')
-        self.history.save()
+        self.save_history()
         return 'break'
 
     def show_command_history_panel(self):
@@ -859,6 +1189,8 @@ class BaseTextConsole(tk.Text):
             return
 
         # Otherwise, create a new panel
+        if self._hist_item == len(self.history) and self.history.refresh():
+            self._hist_item = len(self.history)
         self.history_panel = CommandHistoryPanel(self, self.history, self.insert_cmd, [self._hist_item])
 
         # When the panel is closed, clear the reference
@@ -869,12 +1201,18 @@ class BaseTextConsole(tk.Text):
 
     def insert_line(self, event=None):
         """Handle Ctrl+Return key press"""
+        if self._running:
+            return "break"
         self.edit_separator()
         self.insert('insert', '\n' + self._prompt2, "prompt" )
         return 'break'
 
     def on_backspace(self, event):
         """Handle delete key press"""
+        if self._running:
+            if self._typeahead:
+                self._typeahead.pop()
+            return 'break'
         if self.compare('insert', '<=', 'input'):
             self.mark_set('insert', 'input lineend')
             return 'break'
@@ -921,7 +1259,9 @@ class BaseTextConsole(tk.Text):
         except Exception:
             pass
 
-        index = self.index('input')
+        # Mark where the command starts (survives scrollback trimming)
+        self.mark_set('exec_start', 'input')
+        self.mark_gravity('exec_start', 'left')
         lines = self.get('input', 'insert lineend').splitlines() # commands to execute
         self.mark_set('insert', 'insert lineend')
         self._hist_item = len(self.history)  # set history item to the end
@@ -929,88 +1269,552 @@ class BaseTextConsole(tk.Text):
         if lines:  # there is code to execute
             # remove prompts
             lines = [lines[0].rstrip()] + [line[len(self._prompt2):].rstrip() for line in lines[1:]]
-            for i, l in enumerate(lines):
-                if l.endswith('?'):
-                    lines[i] = 'help(%s)' % l[:-1]
+            lines = [expand_help(line) for line in lines]
             cmds = '\n'.join(lines)
+            for parser in self._ansi_parsers.values():
+                parser.reset()  # no style carries over from the last command
+            self._spool_head_chars = 0
             self.insert('insert', '\n', "output")
-            out = StringIO()  # command output
-            err = StringIO()  # command error traceback
-            with redirect_stderr(err):     # redirect error traceback to err
-                with redirect_stdout(out): # redirect command output
-                    # execute commands in interactive console
-                    res = self._console.push(cmds)
-                    # if res is True, this is a partial command, e.g. 'def test():' and we need to wait for the rest of the code
-            
-            errors = err.getvalue()
-            if errors:  # there were errors during the execution
-                self.insert('end', errors, 'errors')  # display the traceback
-                self.mark_set('input', 'end')
-                self.see('end')
-                self.prompt() # insert new prompt
-                
-                # Save error commands to history if option is enabled
-                if self._save_errors_in_history.get() and lines:
-                    cmd_text = '\n'.join(lines)
-                    if not self.history or self.history[-1] != cmd_text:
-                        self.history.append(cmd_text)
-                        self._hist_item = len(self.history)
+            if self.threaded_execution or self.kernel_mode:
+                self._start_threaded_execution(cmds, lines, auto_indent)
             else:
-                output = out.getvalue()  # get output
-                if output:
-                    self.insert('end', output, 'output')
-                
-                # Check if there's a result from expression evaluation
-                if not res:  # Command was complete
-                    last_result = self._console.get_last_result()
-                    if last_result is not None:
-                        # Display the result of the expression
-                        result_str = repr(last_result) + '\n'
-                        self.insert('end', result_str, 'output')
-                
-                self.mark_set('input', 'end')
-                self.see('end')
-                if not res and self.compare('insert linestart', '>', 'insert'):
-                    self.insert('insert', '\n', "output")
-                self.prompt(res)
-                
-                # Handle auto-indentation logic
-                if auto_indent and lines and res:  # Only auto-indent for incomplete commands
-                    # insert indentation similar to previous lines
-                    indent = re.search(r'^( )*', lines[-1]).group()
-                    line = lines[-1].strip()
-                    if line and line[-1] == ':':
-                        indent = indent + '    '
-                    self.insert('insert', indent, "output")
-                # For complete commands (res is False), don't auto-indent - start fresh
-                
-                self.see('end')
-                if res:
-                    self.mark_set('input', index)
-                    self._console.resetbuffer()  # clear buffer since the whole command will be retrieved from the text widget
-                elif lines:
-                    # join back into one multiline string, so history stores real newlines
-                    cmd_text = '\n'.join(lines)
-                    # avoid duplicate consecutive entries
-                    if not self.history or self.history[-1] != cmd_text:
-                        self.history.append(cmd_text)
-                        self._hist_item = len(self.history)
-            out.close()
-            err.close()
+                try:
+                    res = self._run_command(cmds)
+                except SystemExit:
+                    self._finish_spool()
+                    raise
+                self._complete_execution(res, lines, auto_indent)
         else:
             self.insert('insert', '\n', "output")
             self.prompt()
 
+    def _run_command(self, cmds):
+        """
+        Push the command to the interpreter, streaming its output to the widget.
+        Returns True for a partial command.
+        """
+        self._output.reset()
+        # Only the output of the thread running the command, not the one
+        # of the other threads of the application, is shown
+        with redirect_thread('stderr', ConsoleStream(self._output, 'errors')):
+            with redirect_thread('stdout', ConsoleStream(self._output, 'output')):
+                # execute commands in interactive console; a True result
+                # is a partial command, e.g. 'def test():' and we need to wait for the rest of the code
+                return self._console.push(cmds)
+
+    def _flush_output(self):
+        """
+        Insert the pending output with a single multi-segment insert
+        call, in which ANSI escape sequences are turned into tags.
+        """
+        chunks = self._output.drain()
+        if not chunks:
+            return
+        marker = []
+        if self._output_index == 'end' and self.output_spool_threshold is not None:
+            chunks, marker = self._spool_output(chunks)
+        args = self._output_args(chunks) + marker
+        if not args:
+            return
+        if self._output_index == 'end':
+            self._edit_output(self.insert, 'end', *args)
+        else:
+            self._without_undo(self.insert, self._output_index, *args)
+        # Output of a running command, or above the prompt
+        self.trim_scrollback(
+            'exec_start' if self._output_index == 'end' else 'input linestart'
+        )
+        self.see('end')
+        if not self._running:
+            # Executing on the Tk thread: redraw without processing events
+            self.update_idletasks()
+
+    def _output_args(self, chunks):
+        """Arguments of insert for (tag, text) chunks of output."""
+        args = []
+        for tag, text in chunks:
+            if not self.render_ansi:
+                args.extend((text, tag))
+                continue
+            parser = self._ansi_parsers.get(tag)
+            if parser is None:
+                parser = self._ansi_parsers[tag] = AnsiParser()
+            for segment, ansi_tags in parser.split(text):
+                if not ansi_tags:
+                    args.extend((segment, tag))
+                    continue
+                for ansi_tag in ansi_tags:
+                    if ansi_tag not in self._ansi_tags:
+                        self._configure_ansi_tag(ansi_tag)
+                args.extend((segment, (tag,) + ansi_tags))
+        return args
+
+    def _spool_output(self, chunks):
+        """
+        Return the chunks to be shown of the output of the running command,
+        and the marker line to be inserted after them: beyond
+        output_spool_threshold characters, the output is written to an
+        OutputSpool file, whose tail is shown when the command ends.
+        """
+        if self._spool is not None:
+            for tag, text in chunks:
+                self._spool.write(tag, text)
+            return [], []
+        room = self.output_spool_threshold - self._spool_head_chars
+        shown = []
+        for i, (tag, text) in enumerate(chunks):
+            if len(text) > room:
+                break
+            shown.append((tag, text))
+            room -= len(text)
+        else:
+            self._spool_head.extend(shown)
+            self._spool_head_chars = self.output_spool_threshold - room
+            return chunks, []
+        # Show the head up to a line end, if any, then spool the rest
+        tag, text = chunks[i]
+        cut = text.rfind('\n', 0, room) + 1 or room
+        if cut:
+            shown.append((tag, text[:cut]))
+        spool = OutputSpool(self.output_spool_tail)
+        for head_tag, head_text in self._spool_head + shown:
+            spool.write(head_tag, head_text)
+        self._spool_head = []
+        spool.write(tag, text[cut:])
+        for tag, text in chunks[i + 1:]:
+            spool.write(tag, text)
+        self._spool = spool
+        self._spool_count += 1
+        self._spool_tag = 'spool_%d' % self._spool_count
+        self._spools[self._spool_tag] = spool
+        if len(self._spools) > self.max_output_spools:
+            # Delete the oldest spool file
+            tag, oldest = self._spools.popitem(last=False)
+            oldest.remove()
+            self.tag_delete(tag)
+        last = shown[-1][1] if shown else self.get('end-2c')
+        marker = [] if last.endswith('\n') else ['\n', 'output']
+        marker += [
+            '[... output spooled to %s ...]' % spool.path,
+            ('output', self._spool_tag),
+            ' [view]', ('output', 'show_spool', self._spool_tag),
+            '\n', 'output'
+        ]
+        return shown, marker
+
+    def _finish_spool(self):
+        """
+        Complete the marker line of the spooled output of the command with
+        its size, and show its tail.
+        """
+        spool, tag = self._spool, self._spool_tag
+        self._spool = self._spool_tag = None
+        self._spool_head = []
+        if spool is None:
+            return
+        tail = spool.close()
+        ranges = self.tag_ranges(tag)
+        if ranges:  # not deleted with the oldest scrollback lines
+            start = str(ranges[0])
+            self._without_undo(
+                self.delete, start, '%s lineend' % start
+            )
+            self._without_undo(
+                self.insert, start,
+                '[... %d lines, %s of output spooled to %s; last lines:]' % (
+                    spool.lines, format_size(spool.size()), spool.path),
+                ('output', tag),
+                ' [view]', ('output', 'show_spool', tag)
+            )
+        for parser in self._ansi_parsers.values():
+            parser.reset()  # the tail may start within a styled text
+        args = self._output_args(tail)
+        if args:
+            self.insert('end', *args)
+        self.trim_scrollback('exec_start')
+        self.see('end')
+
+    def on_show_spool(self, event):
+        """Open the viewer of the spooled output of a marker line."""
+        for tag in self.tag_names('current'):
+            spool = self._spools.get(tag)
+            if spool is not None:
+                break
+        else:
+            return "break"
+        def status():
+            spool.flush()  # the command may still be running
+            return '%s, %d lines%s' % (
+                format_size(spool.size()), spool.lines,
+                '' if spool.closed else ' (command running)')
+
+        SpoolViewer(self, spool.path, status=status)
+        return "break"
+
+    def _configure_ansi_tag(self, tag):
+        """Configure a tag returned by AnsiParser on its first use."""
+        options = tag_options(tag)
+        if tag in ('ansi_bold', 'ansi_italic'):
+            font = tkfont.Font(font=self.cget('font'))
+            if tag == 'ansi_bold':
+                font.configure(weight='bold')
+            else:
+                font.configure(slant='italic')
+            self._ansi_fonts[tag] = font
+            options['font'] = font
+        self.tag_configure(tag, **options)
+        self._ansi_tags.add(tag)
+
+    def _edit_output(self, operation, *args):
+        """Run an insert or delete, even if the widget is read-only while running."""
+        if not self._running:
+            return operation(*args)
+        self.config(state='normal')
+        try:
+            return operation(*args)
+        finally:
+            self.config(state='disabled')
+
+    def trim_scrollback(self, limit='input linestart'):
+        """
+        Delete the oldest lines when the scrollback exceeds
+        max_scrollback_lines or max_scrollback_chars. Lines are deleted
+        in batches of a tenth of the limit and never beyond the line
+        of the limit index, like the line of the running command.
+        """
+        cut = 0
+        if self.max_scrollback_lines:
+            lines = int(self.index('end-1c').split('.')[0])
+            if lines > self.max_scrollback_lines:
+                cut = (lines - self.max_scrollback_lines
+                       + self.max_scrollback_lines // 10)
+        if self.max_scrollback_chars:
+            chars = self.count('1.0', 'end', 'chars')
+            if isinstance(chars, tuple):
+                chars = chars[0]
+            if chars and chars > self.max_scrollback_chars:
+                excess = (chars - self.max_scrollback_chars
+                          + self.max_scrollback_chars // 10)
+                line = int(self.index('1.0 + %d chars' % excess).split('.')[0])
+                cut = max(cut, line)
+        cut = min(cut, int(self.index(limit).split('.')[0]) - 1)
+        if cut <= 0:
+            return
+        self._without_undo(self.delete, '1.0', '%d.0' % (cut + 1))
+
+    def _without_undo(self, operation, *args):
+        """
+        Change the scrollback without recording the edit for undo. The undo
+        stack is then cleared: its edits are recorded at absolute indices,
+        which no longer match the input following the changed text.
+        """
+        undo = self.cget('undo')
+        self.config(undo=False)
+        try:
+            return self._edit_output(operation, *args)
+        finally:
+            self.config(undo=undo)
+            self.edit_reset()
+
+    def _start_threaded_execution(self, cmds, lines, auto_indent):
+        """Run the command on a worker thread, keeping the GUI responsive."""
+        self._running = True
+        self._typeahead = []
+        self.tag_add('running', 'exec_start linestart', 'exec_start')
+        self.config(cursor='watch', state='disabled')
+        worker = threading.Thread(
+            target=self._execution_worker, args=(cmds,), daemon=True
+        )
+        worker.start()
+        self._schedule(
+            'poll', self.execution_poll_interval,
+            self._poll_execution, lines, auto_indent
+        )
+
+    def _execution_worker(self, cmds):
+        """Worker thread body: the result is handed back through the queue."""
+        try:
+            self._exec_queue.put((self._run_command(cmds), None))
+        except BaseException as e:  # e.g., SystemExit raised by exit()
+            errors = ''.join(traceback.format_exception_only(type(e), e))
+            self._output.put('errors', errors)
+            self._exec_queue.put((False, e))
+
+    def _poll_execution(self, lines, auto_indent):
+        """
+        Stream the output of the worker thread; re-arm the prompt
+        when it has finished.
+        """
+        self._flush_output()
+        try:
+            res, exc = self._exec_queue.get_nowait()
+        except queue.Empty:
+            self._schedule(
+                'poll', self.execution_poll_interval,
+                self._poll_execution, lines, auto_indent
+            )
+            return
+        self._flush_output()
+        self._running = False
+        self.config(cursor='xterm', state='normal')
+        self.tag_remove('running', '1.0', 'end')
+        if isinstance(exc, SystemExit):
+            self._finish_spool()
+            raise exc
+        self.mark_set('insert', 'end-1c')
+        self._complete_execution(res, lines, auto_indent)
+        self.save_history()
+        if self._typeahead:
+            self.insert('insert', ''.join(self._typeahead))
+            self._typeahead = []
+        self.see('end')
+
+    def _complete_execution(self, res, lines, auto_indent):
+        """Display the outcome of an executed command and re-arm the prompt."""
+        self._flush_output()
+        self._finish_spool()
+        self.trim_scrollback('exec_start')
+        if self._output.had_errors:  # there were errors during the execution
+            self._report_command_stats()
+            self.mark_set('input', 'end')
+            self.see('end')
+            self.prompt() # insert new prompt
+            
+            # Save error commands to history if option is enabled
+            if self._save_errors_in_history.get() and lines:
+                self.add_to_history('\n'.join(lines))
+        else:
+            # Check if there's a result from expression evaluation
+            if not res:  # Command was complete
+                last_result = self._console.get_last_result()
+                if last_result is not None:
+                    # Display the result of the expression
+                    self.show_result(last_result)
+                self._report_command_stats()
+            
+            self.mark_set('input', 'end')
+            self.see('end')
+            if not res and self.compare('insert linestart', '>', 'insert'):
+                self.insert('insert', '\n', "output")
+            self.prompt(res)
+            
+            # Handle auto-indentation logic
+            if auto_indent and lines and res:  # Only auto-indent for incomplete commands
+                # insert indentation similar to previous lines
+                indent = re.search(r'^( )*', lines[-1]).group()
+                line = lines[-1].strip()
+                if line and line[-1] == ':':
+                    indent = indent + '    '
+                self.insert('insert', indent, "output")
+            # For complete commands (res is False), don't auto-indent - start fresh
+            
+            self.see('end')
+            if res:
+                self.mark_set('input', 'exec_start')
+                self._console.resetbuffer()  # clear buffer since the whole command will be retrieved from the text widget
+            elif lines:
+                # join back into one multiline string, so history stores real newlines
+                self.add_to_history('\n'.join(lines))
+        self._schedule_event_loop()
+
+    def add_to_history(self, cmd_text):
+        """
+        Append an executed command to the history. Consecutive duplicates
+        are skipped; with history_deduplicate, the history moves any
+        earlier occurrence to the end, and with history_max_size it
+        evicts the least recently used commands.
+        """
+        if not self.history or self.history[-1] != cmd_text:
+            self.history.append(cmd_text)
+            self._hist_item = len(self.history)
+
+    def _on_history_loaded(self):
+        """Move the history browsing to the end once loaded in background."""
+        if not self.history.loaded.is_set():
+            self._schedule('history', 50, self._on_history_loaded)
+            return
+        self._hist_item = len(self.history)
+
+    def save_history(self):
+        """
+        Save the history; the commands saved meanwhile by other consoles
+        are merged, so the position of the history browsing is kept at
+        the end if it was there.
+        """
+        at_end = self._hist_item == len(self.history)
+        self.history.save()
+        if at_end:
+            self._hist_item = len(self.history)
+
+    def _schedule_event_loop(self):
+        """Run the event loop periodically while awaited commands are pending."""
+        if (self.kernel_mode or self._event_loop_scheduled
+                or not self._console.tasks):
+            return
+        self._event_loop_scheduled = True
+        self._schedule('event_loop', self.event_loop_interval, self._run_event_loop)
+
+    def _run_event_loop(self):
+        """
+        Run the asyncio event loop on the Tk thread, then show the output
+        and the outcome of the completed tasks above the current prompt.
+        """
+        self._event_loop_scheduled = False
+        if self._running:  # the worker thread owns the redirected streams
+            self._schedule_event_loop()
+            return
+        self._output_index = 'input linestart'
+        try:
+            with redirect_thread('stderr', ConsoleStream(self._output, 'errors')):
+                with redirect_thread('stdout', ConsoleStream(self._output, 'output')):
+                    done = self._console.run_pending()
+            self._flush_output()
+            for source, future in done:
+                line = '[done] %s\n' % source.strip().splitlines()[0]
+                self._without_undo(
+                    self.insert, 'input linestart', line, 'timing'
+                )
+                try:
+                    result = future.result()
+                except BaseException as e:  # including CancelledError
+                    errors = ''.join(
+                        traceback.format_exception(type(e), e, e.__traceback__)
+                    )
+                    self._without_undo(
+                        self.insert, 'input linestart', errors, 'errors'
+                    )
+                    continue
+                if result is not None:
+                    self._without_undo(
+                        self.show_result, result, 'input linestart'
+                    )
+        finally:
+            self._output_index = 'end'
+        if done:
+            self.see('end')
+        self._schedule_event_loop()
+
+    def show_result(self, result, index='end'):
+        """
+        Insert the representation of a result, bounded by the result_*
+        limits; a truncated result gets a "show more" link.
+        """
+        text, pager = self._formatter.format(result)
+        if pager is None:
+            self.insert(index, text + '\n', 'output')
+            return
+        self._pager_count += 1
+        tag = 'more_%d' % self._pager_count
+        self._pagers[tag] = pager
+        if len(self._pagers) > self.max_result_pagers:
+            # Release the oldest retained result
+            self.tag_delete(self._pagers.popitem(last=False)[0])
+        self.insert(
+            index, text, 'output',
+            ' [show more]', ('output', 'show_more', tag), '\n', 'output'
+        )
+
+    def on_show_more(self, event):
+        """Replace a "show more" link with the next page of its result."""
+        for tag in self.tag_names('current'):
+            if tag in self._pagers:
+                break
+        else:
+            return "break"
+        if self._running and self.kernel_mode:
+            return "break"  # the kernel sends the page once idle
+        start, end = map(str, self.tag_ranges(tag)[:2])
+        text, more = self._pagers[tag].next_page()
+        args = ['\n' + text, 'output']
+        if more:
+            args += [' [show more]', ('output', 'show_more', tag)]
+        else:
+            del self._pagers[tag]
+        self._without_undo(self.delete, start, end)
+        self._without_undo(self.insert, start, *args)
+        if not more:
+            self.tag_delete(tag)
+        return "break"
+
+    def is_protected(self, index):
+        """
+        Whether the character at index cannot be edited, i.e., it has one
+        of the PROTECTED_TAGS, like prompt or output.
+        """
+        line, column = map(int, self.index(index).split('.'))
+        return self._protected.is_protected(line, column)
+
+    def insert(self, index, chars, *args):
+        self._protected.before_insert(index)
+        return super().insert(index, chars, *args)
+
+    def delete(self, index1, index2=None):
+        self._protected.before_delete(index1, index2)
+        return super().delete(index1, index2)
+
+    def on_modified(self, event=None):
+        """Schedule the highlighting of the input after a change of the text."""
+        if not self.edit_modified():
+            return
+        self.edit_modified(False)  # re-arm <<Modified>>
+        # The class bindings change the text at the cursor line (where a
+        # deleted selection started)
+        self._protected.before_insert('insert')
+        if self.syntax_highlighting and not self._highlight_scheduled:
+            self._highlight_scheduled = True
+            self.after_idle(self.highlight_input)
+
+    def highlight_input(self):
+        """
+        Highlight the code between the input mark and the end. The input
+        is tokenized as a whole, but only the lines whose text or spans
+        changed since the last pass are tagged again.
+        """
+        self._highlight_scheduled = False
+        if self._running:
+            return
+        start = self.index('input')
+        if start != self._highlight_start:  # a new prompt
+            self._highlight_start = start
+            self._highlighted = []
+        first_row, first_col = map(int, start.split('.'))
+        lines = self.get('input', 'end-1c').split('\n')
+        columns = [first_col]
+        code = [lines[0]]
+        for line in lines[1:]:
+            column = len(self._prompt2) if line.startswith(self._prompt2) else 0
+            columns.append(column)
+            code.append(line[column:])
+        highlighted = list(zip(lines, syntax_spans(code)))
+        for i, (line, spans) in enumerate(highlighted):
+            if i < len(self._highlighted) and self._highlighted[i] == (line, spans):
+                continue
+            row, column = first_row + i, columns[i]
+            for tag in SYNTAX_TAGS:
+                self.tag_remove(tag, '%d.%d' % (row, column), '%d.end' % row)
+            for tag, span_start, span_end in spans:
+                self.tag_add(
+                    tag,
+                    '%d.%d' % (row, column + span_start),
+                    '%d.%d' % (row, column + span_end)
+                )
+        self._highlighted = highlighted
+
     def on_key_press(self, event):
         """
-        Prevent character insertion if the cursor is over a character with any tag (e.g., prompt).
+        Prevent character insertion if the cursor is over a character with a protected tag (e.g., prompt).
         """
         # Only block printable characters (not navigation, etc.)
         if event.char and event.char.isprintable():
-            cursor_index = self.index("insert")
-            tags = self.tag_names(cursor_index)
-            if tags:
+            if self._running:
+                # Buffer keystrokes until the running command completes
+                self._typeahead.append(event.char)
                 return "break"
+            if self.is_protected("insert"):
+                return "break"
+            sel = self.tag_ranges('sel')
+            if sel and self.compare(sel[0], '<', 'input'):
+                return "break"  # typing would replace the selected prompts
 
     def _process_arrows(self, direction):
         """
@@ -1026,51 +1830,34 @@ class BaseTextConsole(tk.Text):
         except tk.TclError:
             pass  # No selection, proceed as normal
 
-        cursor_index = self.index("insert")
-        line_start = self.index(f"{cursor_index} linestart")
-        line_end = self.index(f"{line_start} lineend")
+        line, column = map(int, self.index("insert").split('.'))
+        regions = self._protected
 
         if direction == "Left":
-            idx = cursor_index
-            while self.compare(idx, ">", line_start):
-                tags = self.tag_names(idx)
-                if not tags:
-                    self.mark_set("insert", idx)
-                    return
-                idx = self.index(f"{idx} -1c")
+            found = regions.editable_at_or_before(line, column, lowest=1)
+            if found is not None:
+                self.mark_set("insert", "%d.%d" % (line, found))
+                return
             # If we reach the start of the line, check the last character of the previous line
-            if self.compare(idx, "==", line_start):
-                prev_line_num = int(line_start.split('.')[0]) - 1
-                if prev_line_num >= 1:
-                    prev_line_start = f"{prev_line_num}.0"
-                    prev_line_end = self.index(f"{prev_line_start} lineend")
-                    # Check if the last character of the previous line is not tagged
-                    last_char_idx = self.index(f"{prev_line_end} -1c")
-                    tags = self.tag_names(last_char_idx)
-                    if not tags:
-                        self.mark_set("insert", prev_line_end)
-                        return
-                # Otherwise, scan forward to find the first non-tagged character (existing behaviour)
-                scan_idx = line_start
-                line_end = self.index(f"{line_start} lineend")
-                while self.compare(scan_idx, "<", line_end):
-                    tags = self.tag_names(scan_idx)
-                    if not tags:
-                        self.mark_set("insert", scan_idx)
-                        return
-                    scan_idx = self.index(f"{scan_idx} +1c")
-                self.mark_set("insert", line_end)
+            if line > 1:
+                length = regions.length(line - 1)
+                if length and not regions.is_protected(line - 1, length - 1):
+                    self.mark_set("insert", "%d.%d" % (line - 1, length))
+                    return
+            # Otherwise, the first non-protected character of the line (existing behaviour)
+            found = regions.editable_at_or_after(line, 0)
+            if found is not None:
+                self.mark_set("insert", "%d.%d" % (line, found))
+            else:
+                self.mark_set("insert", "%d.end" % line)
 
         elif direction == "Right":
-            idx = cursor_index
-            while self.compare(idx, "<", line_end):
-                tags = self.tag_names(idx)
-                if not tags:
-                    self.mark_set("insert", idx)
-                    return
-                idx = self.index(f"{idx} +1c")
-            # If we reach the end of the line, set cursor there
-            self.mark_set("insert", line_end)
+            found = regions.editable_at_or_after(line, column)
+            if found is not None:
+                self.mark_set("insert", "%d.%d" % (line, found))
+            else:
+                # If we reach the end of the line, set cursor there
+                self.mark_set("insert", "%d.end" % line)
 
 
 class TextConsole(BaseTextConsole):